@@ -0,0 +1,115 @@
+"""
+Size and CPU cost of the cache entry formats: the legacy JSON one (before the codecs), the JSON codec
+and msgpack with optional compression. The page of films is above the default --min-size, so it is the one
+the compression is applied to.
+
+Usage: python -m benchmarks.cache_codec [--number 50] [--min-size 1024] [--redis-url redis://127.0.0.1:6379]
+
+With --redis-url the entries are also written to Redis and their MEMORY USAGE is reported.
+"""
+import argparse
+import asyncio
+import time
+import timeit
+
+import aioredis
+import orjson
+from pydantic import BaseModel
+
+from benchmarks.response_fast_path import make_films
+from src.models.film import Film
+from src.models.page import Page
+from src.services.codec import JsonCodec, MsgpackCodec, decode, lz4, zstandard
+
+
+def legacy_encode(value: BaseModel) -> bytes:
+    """
+    The format before the codecs, without a header: a film was cached as its JSON and a list of films
+    as the JSON list of their JSON strings, so every film of it was encoded (and decoded) twice.
+    """
+    if isinstance(value, Page):
+        return orjson.dumps([item.json(by_alias=True) for item in value.items])
+    return value.json(by_alias=True).encode()
+
+
+def legacy_decode(data: bytes, model: type[BaseModel]) -> BaseModel:
+    if issubclass(model, Page):
+        return model(items=[Film.parse_raw(item) for item in orjson.loads(data)])
+    return model.parse_raw(data)
+
+
+def get_codecs(min_size: int) -> dict:
+    codecs = {'json': JsonCodec(), 'msgpack': MsgpackCodec()}
+    if lz4:
+        codecs['msgpack+lz4'] = MsgpackCodec('lz4', min_size)
+    if zstandard:
+        codecs['msgpack+zstd'] = MsgpackCodec('zstd', min_size)
+    return codecs
+
+
+async def get_memory_usage(redis_url: str, entries: dict[str, bytes]) -> dict[str, int]:
+    redis = await aioredis.from_url(redis_url)
+    try:
+        usage = {}
+        for key, data in entries.items():
+            await redis.set(f'benchmark:{key}', data)
+            usage[key] = await redis.memory_usage(f'benchmark:{key}')
+            await redis.delete(f'benchmark:{key}')
+        return usage
+    finally:
+        await redis.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=50)
+    parser.add_argument('--min-size', type=int, default=1024)
+    parser.add_argument('--redis-url', default='')
+    args = parser.parse_args()
+
+    # The model of a value and whether the legacy format had it (it cached no lists of ids)
+    values = {
+        'film': (Film, make_films(1)[0], True),
+        'page of 20 films': (Page[Film], Page[Film](items=make_films(20)), True),
+        'page of 50 ids': (
+            Page[str], Page[str](items=[f'film-{i}' for i in range(50)], next_cursor='abc'), False,
+        ),
+    }
+    header = [time.time(), 0.05]
+    codecs = get_codecs(args.min_size)
+    entries = {}
+
+    def measure(value_name: str, codec_name: str, data: bytes, encode, decode):
+        entries[f'{value_name}/{codec_name}'] = data
+        encode_time = min(timeit.repeat(encode, number=args.number, repeat=3))
+        decode_time = min(timeit.repeat(decode, number=args.number, repeat=3))
+        print(
+            f'{value_name:<18}{codec_name:<14}{len(data):>8}'
+            f'{encode_time / args.number * 1e6:>12.1f}{decode_time / args.number * 1e6:>12.1f}'
+        )
+
+    print(f'{"value":<18}{"codec":<14}{"bytes":>8}{"encode, us":>12}{"decode, us":>12}')
+    for value_name, (model, value, legacy) in values.items():
+        if legacy:
+            data = legacy_encode(value)
+            assert legacy_decode(data, model) == value
+            measure(
+                value_name, 'legacy json', data,
+                lambda: legacy_encode(value), lambda: legacy_decode(data, model),
+            )
+        for codec_name, codec in codecs.items():
+            data = codec.encode(header, value)
+            assert decode(data, model) == (header, value)
+            measure(
+                value_name, codec_name, data,
+                lambda: codec.encode(header, value), lambda: decode(data, model),
+            )
+
+    if args.redis_url:
+        print('\nRedis MEMORY USAGE, bytes')
+        for key, usage in asyncio.run(get_memory_usage(args.redis_url, entries)).items():
+            print(f'{key:<30}{usage:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+In-memory stand-in of AsyncElasticsearch for the benchmarks.
+
+It supports the subset of the API the services use (get, mget, search with from/size or search_after,
+_source includes, the opening of a point in time) and sleeps `latency` seconds per request to mimic
+the network and ES itself.
+"""
+import asyncio
+import copy
+import random
+from typing import Optional
+
+from elasticsearch import NotFoundError
+
+GENRES = ['Action', 'Adventure', 'Comedy', 'Drama', 'Fantasy', 'Horror', 'Sci-Fi', 'Thriller']
+TITLE_WORDS = [
+    'star', 'war', 'dark', 'night', 'return', 'empire', 'lost', 'city', 'king', 'ring', 'last', 'hope',
+]
+
+
+def make_documents(films: int = 1000, persons: int = 300, seed: int = 0) -> dict[str, dict[str, dict]]:
+    """Documents of the indices by index and id, generated deterministically."""
+    rnd = random.Random(seed)
+    people = [{'id': f'person-{i}', 'name': f'Person {i}'} for i in range(persons)]
+    movies = {}
+    for i in range(films):
+        movies[f'film-{i}'] = {
+            'id': f'film-{i}',
+            'title': ' '.join(rnd.sample(TITLE_WORDS, 3)).title(),
+            'imdb_rating': round(rnd.uniform(1, 10), 1),
+            'description': ' '.join(rnd.choices(TITLE_WORDS, k=40)),
+            'genre': [{'id': name, 'name': name} for name in rnd.sample(GENRES, 2)],
+            'actors': rnd.sample(people, 8),
+            'writers': rnd.sample(people, 2),
+            'directors': rnd.sample(people, 1),
+        }
+    persons = {
+        person['id']: {'id': person['id'], 'full_name': person['name'], 'films': []} for person in people
+    }
+    for movie in movies.values():
+        roles = {}
+        for role in ('actors', 'writers', 'directors'):
+            for person in movie[role]:
+                roles.setdefault(person['id'], []).append(role[:-1])
+        for person_id, person_roles in roles.items():
+            persons[person_id]['films'].append({
+                'id': movie['id'], 'title': movie['title'], 'imdb_rating': movie['imdb_rating'],
+                'roles': person_roles,
+            })
+    return {
+        'movies': movies,
+        'genres': {name: {'id': name, 'name': name} for name in GENRES},
+        'persons': persons,
+    }
+
+
+class ElasticsearchStub:
+    def __init__(self, documents: dict[str, dict[str, dict]], latency: float = 0.0):
+        self.documents = documents
+        self.latency = latency
+        self.requests = 0
+        self.transport = self
+
+    async def get(self, index: str, id: str, _source_includes: Optional[list[str]] = None, **kwargs) -> dict:
+        await self._request()
+        doc = self.documents.get(index, {}).get(id)
+        if doc is None:
+            raise NotFoundError(404, 'not_found', {'_id': id})
+        return {'_index': index, '_id': id, 'found': True, '_source': self._source(doc, _source_includes)}
+
+    async def mget(self, body: dict, index: str, _source_includes: Optional[list[str]] = None,
+                   **kwargs) -> dict:
+        await self._request()
+        docs = []
+        for doc_id in body['ids']:
+            doc = self.documents.get(index, {}).get(doc_id)
+            if doc is None:
+                docs.append({'_index': index, '_id': doc_id, 'found': False})
+            else:
+                source = self._source(doc, _source_includes)
+                docs.append({'_index': index, '_id': doc_id, 'found': True, '_source': source})
+        return {'docs': docs}
+
+    async def search(self, index: Optional[str] = None, body: Optional[dict] = None, **kwargs) -> dict:
+        await self._request()
+        return self._search(index, body or {})
+
+    async def msearch(self, body: list[dict], **kwargs) -> dict:
+        """The searches of the header and body pairs, answered at the cost of one request."""
+        await self._request()
+        responses = []
+        for header, search_body in zip(body[::2], body[1::2]):
+            try:
+                responses.append(dict(self._search(header['index'], search_body), status=200))
+            except NotFoundError as e:
+                responses.append({'error': {'type': e.error, **e.info}, 'status': e.status_code})
+        return {'took': int(self.latency * 1000), 'responses': responses}
+
+    def _search(self, index: Optional[str], body: dict) -> dict:
+        if 'pit' in body:
+            index = body['pit']['id']
+        if index not in self.documents:
+            raise NotFoundError(404, 'index_not_found_exception', {'index': index})
+
+        if 'suggest' in body:
+            return self._suggest(index, body)
+        docs = [doc for doc in self.documents[index].values() if self._matches(doc, body.get('query'))]
+        sort = body.get('sort') or [{'_score': 'desc'}]
+        for clause in reversed(sort):
+            (field, direction), = clause.items()
+            docs.sort(key=lambda doc: self._sort_value(doc, field), reverse=direction == 'desc')
+        hits = [
+            {
+                '_index': index, '_id': doc['id'], '_source': self._source(doc, body.get('_source')),
+                'sort': [self._sort_value(doc, field) for clause in sort for field in clause],
+            }
+            for doc in docs
+        ]
+        if 'search_after' in body:
+            position = next((n for n, hit in enumerate(hits) if hit['sort'] == body['search_after']), None)
+            hits = hits[position + 1:] if position is not None else []
+        start = body.get('from', 0)
+        hits = hits[start:start + body.get('size', 10)]
+        response = {
+            'took': int(self.latency * 1000),
+            'hits': {'total': {'value': len(docs), 'relation': 'eq'}, 'hits': hits},
+        }
+        if 'pit' in body:
+            response['pit_id'] = index
+        return response
+
+    def _suggest(self, index: str, body: dict) -> dict:
+        """The completion suggester, the inputs of a document are the words of its first _source field."""
+        field = body['_source'][0]
+        (name, suggester), = body['suggest'].items()
+        prefix = suggester['prefix'].lower()
+        options = [
+            {'_index': index, '_id': doc['id'], '_source': self._source(doc, [field])}
+            for doc in self.documents[index].values()
+            if any(word.startswith(prefix) for word in self._suffixes(doc.get(field, '')))
+        ]
+        options = options[:suggester['completion']['size']]
+        return {'took': 0, 'suggest': {name: [{'text': prefix, 'options': options}]}}
+
+    @staticmethod
+    def _suffixes(text: str) -> list[str]:
+        words = text.lower().split()
+        return [' '.join(words[start:]) for start in range(len(words))]
+
+    async def perform_request(self, method: str, url: str, **kwargs) -> dict:
+        """Only the opening of a point in time, its id is just the name of the index."""
+        await self._request()
+        return {'id': url.strip('/').split('/')[0]}
+
+    async def ping(self) -> bool:
+        await self._request()
+        return True
+
+    async def close(self):
+        pass
+
+    async def _request(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    @staticmethod
+    def _source(doc: dict, includes: Optional[list[str]]) -> dict:
+        return {
+            field: copy.deepcopy(value) for field, value in doc.items() if not includes or field in includes
+        }
+
+    @staticmethod
+    def _matches(doc: dict, query: Optional[dict]) -> bool:
+        if not query:
+            return True
+        if 'match' in query:
+            (field, match), = query['match'].items()
+            return all(word in doc.get(field, '').lower() for word in match['query'].lower().split())
+        if 'match_bool_prefix' in query:
+            (field, prefix), = query['match_bool_prefix'].items()
+            *words, last = prefix.lower().split()
+            value = doc.get(field, '').lower().split()
+            return all(word in value for word in words) and any(word.startswith(last) for word in value)
+        if 'query_string' in query:
+            value = query['query_string']['query']
+            return any(value in (genre['id'], genre['name']) for genre in doc.get('genre', []))
+        return True
+
+    @staticmethod
+    def _sort_value(doc: dict, field: str):
+        if field == '_score':
+            return 1.0
+        return doc.get(field.removesuffix('.raw'))
@@ -0,0 +1,200 @@
+"""
+Throughput and latency of the API under a realistic mix of requests.
+
+The real src.main:app is served in-process against the in-memory ES stub (with the given latency)
+and fakeredis, or a local redis-server with --redis-url. Each scenario replays the same mix:
+"cold" starts with empty caches, "warm" runs right after it on the filled ones.
+
+The results are compared with the stored baselines: the run fails if p95 grows or the throughput
+drops by more than --tolerance. Baselines depend on the machine, refresh them with --update-baseline.
+
+With --msearch-window-ms the searches are batched into _msearch requests (ELASTIC_MSEARCH_WINDOW_IN_MS),
+compare its "ES reqs" and latencies with a run without it.
+
+Usage: python -m benchmarks.load [--requests 2000] [--concurrency 32] [--es-latency-ms 5]
+                                 [--redis-url redis://127.0.0.1:6379] [--msearch-window-ms 2]
+                                 [--update-baseline]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import aioredis
+import httpx
+from loguru import logger
+
+from benchmarks.es_stub import GENRES, TITLE_WORDS, ElasticsearchStub, make_documents
+from src.core.config import settings
+from src.db import elastic, local_cache, redis
+from src.main import app
+
+BASELINE_PATH = Path(__file__).parent / 'baselines' / 'load.json'
+SORTS = ['', 'imdb_rating:desc', 'imdb_rating:asc', 'title.raw:asc']
+
+
+def make_requests(count: int, films: int, seed: int = 0) -> list[tuple[str, dict]]:
+    """
+    The mix of the requests: film lists and searches, film details (popular films are requested more often)
+    and a few genre requests. Searches vary in case and spaces, as typed by people.
+    """
+    rnd = random.Random(seed)
+    film_weights = [1 / (rank + 1) for rank in range(films)]
+    requests = []
+    for _ in range(count):
+        kind = rnd.random()
+        if kind < 0.35:
+            params = {'page': rnd.choice([1, 1, 1, 2, 3]), 'page_size': 20, 'sort': rnd.choice(SORTS)}
+            if rnd.random() < 0.3:
+                params['genre'] = rnd.choice(GENRES)
+            requests.append(('/api/v1/films/', params))
+        elif kind < 0.6:
+            query = ' '.join(rnd.sample(TITLE_WORDS[:6], rnd.choice([1, 2])))
+            query = rnd.choice([query, query.title(), f' {query} '])
+            requests.append(('/api/v1/films/search', {'query': query, 'page_size': 20}))
+        elif kind < 0.95:
+            film = rnd.choices(range(films), weights=film_weights)[0]
+            requests.append((f'/api/v1/films/film-{film}', {}))
+        elif kind < 0.98:
+            requests.append(('/api/v1/genres/', {'page_size': 20}))
+        else:
+            requests.append((f'/api/v1/genres/{rnd.choice(GENRES)}', {}))
+    return requests
+
+
+async def run_scenario(client: httpx.AsyncClient, requests: list[tuple[str, dict]], concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    queue = iter(requests)
+
+    async def worker():
+        nonlocal errors
+        for path, params in queue:
+            started_at = time.perf_counter()
+            response = await client.get(path, params=params)
+            latencies.append(time.perf_counter() - started_at)
+            if response.status_code != 200:
+                errors += 1
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started_at
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        'throughput': len(latencies) / duration,
+        'p50_ms': quantiles[49] * 1000,
+        'p95_ms': quantiles[94] * 1000,
+        'p99_ms': quantiles[98] * 1000,
+        'errors': errors,
+    }
+
+
+async def create_redis(redis_url: str):
+    if redis_url:
+        client = aioredis.from_url(redis_url)
+        await client.flushdb()
+        return client
+    import fakeredis.aioredis
+    return fakeredis.aioredis.FakeRedis()
+
+
+async def run(args) -> dict:
+    documents = make_documents(films=args.films)
+    requests = make_requests(args.requests, args.films)
+    # The app is driven without its lifespan, so the connections are set up here
+    redis.redis = await create_redis(args.redis_url)
+    elastic.es = ElasticsearchStub(documents, latency=args.es_latency_ms / 1000)
+    if args.msearch_window_ms:
+        elastic.es = elastic.BatchingElasticsearch(
+            elastic.es, args.msearch_window_ms / 1000, settings.ELASTIC_MSEARCH_MAX_SIZE,
+        )
+    local_cache.local_cache = local_cache.LocalCache(
+        settings.CACHE_L1_MAX_ITEMS, settings.CACHE_L1_TTL_IN_SECONDS,
+    )
+
+    stub = getattr(elastic.es, 'elastic', elastic.es)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+        for scenario in ('cold', 'warm'):
+            es_requests = stub.requests
+            results[scenario] = await run_scenario(client, requests, args.concurrency)
+            results[scenario]['es_requests'] = stub.requests - es_requests
+    await redis.redis.close()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for scenario, result in results.items():
+        expected = baseline.get(scenario)
+        if not expected:
+            continue
+        if result['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+            regressions.append(
+                f'{scenario}: p95 {result["p95_ms"]:.1f} ms > baseline {expected["p95_ms"]:.1f} ms',
+            )
+        if result['throughput'] < expected['throughput'] * (1 - tolerance):
+            regressions.append(
+                f'{scenario}: throughput {result["throughput"]:.0f} rps '
+                f'< baseline {expected["throughput"]:.0f} rps',
+            )
+        if result['errors']:
+            regressions.append(f'{scenario}: {result["errors"]} requests failed')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--films', type=int, default=1000)
+    parser.add_argument('--es-latency-ms', type=float, default=5)
+    parser.add_argument('--redis-url', default='')
+    parser.add_argument('--msearch-window-ms', type=float, default=0)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+    # Every request is logged by httpx and the cache otherwise, which would be measured as well
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    results = asyncio.run(run(args))
+    print(
+        f'{args.requests} requests, concurrency {args.concurrency}, ES latency {args.es_latency_ms} ms, '
+        f'msearch window {args.msearch_window_ms} ms'
+    )
+    print(
+        f'{"scenario":<10}{"rps":>10}{"p50, ms":>10}{"p95, ms":>10}{"p99, ms":>10}'
+        f'{"ES reqs":>10}{"errors":>8}'
+    )
+    for scenario, result in results.items():
+        print(
+            f'{scenario:<10}{result["throughput"]:>10.0f}{result["p50_ms"]:>10.1f}{result["p95_ms"]:>10.1f}'
+            f'{result["p99_ms"]:>10.1f}{result["es_requests"]:>10}{result["errors"]:>8}'
+        )
+
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(results, indent=4) + '\n')
+        print(f'Baseline is saved to {args.baseline}')
+        return
+    if not args.baseline.exists():
+        print('No baseline to compare with, save one with --update-baseline')
+        return
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
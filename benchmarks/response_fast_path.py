@@ -0,0 +1,80 @@
+"""
+CPU cost of serving a cached page of films: the pydantic path vs the cached response bytes.
+
+Usage: python -m benchmarks.response_fast_path [--items 50] [--number 20]
+"""
+import argparse
+import asyncio
+import timeit
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from src.api.v1.films import FilmListAPI
+from src.models.film import Film
+from src.models.page import Page
+from src.services.cache import Cache, CachedResponse
+
+
+def make_films(count: int) -> list[Film]:
+    return [
+        Film(
+            id=f'film-{i}',
+            title=f'Star Wars: Episode {i}',
+            imdb_rating=7.5,
+            description='A long time ago in a galaxy far, far away...' * 5,
+            genre=[{'id': 'action', 'name': 'Action'}, {'id': 'sci-fi', 'name': 'Sci-Fi'}],
+            actors=[{'id': f'actor-{n}', 'name': f'Actor {n}'} for n in range(10)],
+            writers=[{'id': f'writer-{n}', 'name': f'Writer {n}'} for n in range(3)],
+            directors=[{'id': 'director', 'name': 'Director'}],
+        )
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=50)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    films = make_films(args.items)
+    cached_list = orjson.dumps([film.json(by_alias=True) for film in films])
+    response_field = create_response_field(name='films', type_=list[FilmListAPI])
+    cached_response = CachedResponse.from_page(Page[Film](items=films), FilmListAPI)
+    cached_response_bytes = Cache._pack_response(cached_response)
+    loop = asyncio.new_event_loop()
+
+    def pydantic_path():
+        items = [Film.parse_raw(item) for item in orjson.loads(cached_list)]
+        content = [FilmListAPI.parse_obj(film.dict(by_alias=True)) for film in items]
+        content = loop.run_until_complete(serialize_response(field=response_field, response_content=content))
+        return ORJSONResponse(jsonable_encoder(content)).body
+
+    def redis_fast_path():
+        return Cache._unpack_response('key', cached_response_bytes).to_response().body
+
+    def local_fast_path():
+        return cached_response.to_response().body
+
+    assert orjson.loads(pydantic_path()) == orjson.loads(local_fast_path()) == orjson.loads(redis_fast_path())
+
+    print(f'Page of {args.items} films, {args.number} requests per path')
+    results = {}
+    for name, func in (
+        ('pydantic path (Redis hit)', pydantic_path),
+        ('cached bytes (Redis hit)', redis_fast_path),
+        ('cached bytes (L1 hit)', local_fast_path),
+    ):
+        results[name] = min(timeit.repeat(func, number=args.number, repeat=3)) / args.number * 1e6
+        print(f'{name:<28}{results[name]:>10.1f} us/request')
+    baseline = results['pydantic path (Redis hit)']
+    for name, value in list(results.items())[1:]:
+        print(f'CPU saved by {name}: {baseline - value:.1f} us/request ({baseline / value:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
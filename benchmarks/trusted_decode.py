@@ -0,0 +1,71 @@
+"""
+CPU cost of decoding a page of films: validating pydantic parsing vs the trusted construction.
+
+Both the cache hit (the entries of the films, see CACHE_TRUSTED_DECODE) and the ES hit
+(the _source of the hits, see ELASTIC_VALIDATE_DOCUMENTS) are measured.
+
+Usage: python -m benchmarks.trusted_decode [--items 50] [--number 500]
+"""
+import argparse
+import time
+import timeit
+
+import orjson
+
+from benchmarks.response_fast_path import make_films
+from src.core.config import settings
+from src.models.film import Film
+from src.services.codec import JsonCodec, MsgpackCodec, decode
+from src.services.utils import parse_document
+
+
+def measure(func, number: int) -> float:
+    """Microseconds per call, the best of three runs."""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=50)
+    parser.add_argument('--number', type=int, default=500)
+    args = parser.parse_args()
+
+    films = make_films(args.items)
+    header = [time.time(), 0.05]
+    hits = [
+        orjson.loads(orjson.dumps({'_id': film.uuid, '_source': film.dict(by_alias=True, exclude={'uuid'})}))
+        for film in films
+    ]
+    json_entries = [JsonCodec().encode(header, film) for film in films]
+    msgpack_entries = [MsgpackCodec().encode(header, film) for film in films]
+    # The source of the page, the setting which switches the trusted path on and the decoding of the page
+    paths = {
+        'cache (json)': ('CACHE_TRUSTED_DECODE', lambda: [decode(entry, Film)[1] for entry in json_entries]),
+        'cache (msgpack)': (
+            'CACHE_TRUSTED_DECODE', lambda: [decode(entry, Film)[1] for entry in msgpack_entries],
+        ),
+        'ES hits': (
+            'ELASTIC_VALIDATE_DOCUMENTS',
+            lambda: [parse_document(Film, dict(hit['_source'], id=hit['_id'])) for hit in hits],
+        ),
+    }
+
+    print(f'Page of {args.items} films, {args.number} pages per path')
+    print(f'{"source":<18}{"validated, us":>15}{"trusted, us":>13}{"speedup":>9}')
+    for name, (setting, func) in paths.items():
+        original = getattr(settings, setting)
+        try:
+            results = {}
+            for trusted in (False, True):
+                # One setting turns the trusted path on, the other one turns the validation off
+                setattr(settings, setting, trusted if setting == 'CACHE_TRUSTED_DECODE' else not trusted)
+                results[trusted] = measure(func, args.number), func()
+        finally:
+            setattr(settings, setting, original)
+        (validated_time, validated), (trusted_time, trusted) = results[False], results[True]
+        assert [item.dict() for item in validated] == [item.dict() for item in trusted]
+        print(f'{name:<18}{validated_time:>15.1f}{trusted_time:>13.1f}{validated_time / trusted_time:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
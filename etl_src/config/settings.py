@@ -8,3 +8,7 @@ class Settings(BaseSettings):
     psql_host: str = '127.0.0.1'
     psql_port: str = '5432'
     file_path: str = 'etl_state.json'
+    redis_host: str = '127.0.0.1'
+    redis_port: str = '6379'
+    es_host: str = '127.0.0.1'
+    es_port: str = '9200'
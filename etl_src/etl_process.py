@@ -27,6 +27,7 @@ def etl_process():
             for ts_data in transformed_data:
                 logger.debug(ts_data)
                 es_loader.load_data(ts_data, ES_BATCH_SIZE, INDEX_NAME_GENRES)
+        es_loader.publish_changes(INDEX_NAME_GENRES)
 
         raw_generator = pg_extractor.get_batches_persons(PG_BATCH_SIZE)
         for raw_data in raw_generator:
@@ -35,6 +36,7 @@ def etl_process():
             for ts_data in transformed_data:
                 logger.debug(ts_data)
                 es_loader.load_data(ts_data, ES_BATCH_SIZE, INDEX_NAME_PERSONS)
+        es_loader.publish_changes(INDEX_NAME_PERSONS)
         pg_conn.commit()
         pg_conn.close()
 
@@ -12,11 +12,28 @@ PG_SQL_GENRES = """SELECT
    g.updated_by
 FROM content.genre g;
 """
+# The person with their filmography: a film with all the roles of the person in it
 PG_SQL_PERSONS = """SELECT
    p.id,
    p.full_name,
-   p.updated_by
-FROM ccontent.person p;
+   p.updated_by,
+   COALESCE(
+       json_agg(
+           json_build_object(
+               'id', pf.film_work_id, 'title', pf.title, 'imdb_rating', pf.rating, 'roles', pf.roles
+           )
+           ORDER BY pf.rating DESC NULLS LAST
+       ) FILTER (WHERE pf.film_work_id IS NOT NULL),
+       '[]'
+   ) AS films
+FROM content.person p
+LEFT JOIN (
+   SELECT pfw.person_id, fw.id AS film_work_id, fw.title, fw.rating, array_agg(DISTINCT pfw.role) AS roles
+   FROM content.person_film_work pfw
+   JOIN content.film_work fw ON fw.id = pfw.film_work_id
+   GROUP BY pfw.person_id, fw.id
+) pf ON pf.person_id = p.id
+GROUP BY p.id;
 """
 
 
@@ -1,14 +1,48 @@
+import asyncio
+from collections import defaultdict
 from functools import lru_cache
 
+import aioredis
 from aioredis import Redis
-from elasticsearch import AsyncElasticsearch
+from elasticsearch import Elasticsearch
 from elasticsearch.helpers import streaming_bulk
-from fastapi import Depends
 from loguru import logger
 
 from etl_src.backoff.backoff import backoff
-from src.db.elastic import get_elastic
-from src.db.redis import get_redis
+from etl_src.config.settings import Settings
+from src.services.changes import publish_changes
+
+# The autocomplete field of an index, its inputs are made by suggest_inputs of the transformer
+SUGGEST_MAPPING = {
+    'type': 'completion',
+    'analyzer': 'simple',
+}
+# The filmography of a person, denormalized so that it is read with the person by one get
+FILMS_MAPPING = {
+    'type': 'nested',
+    'dynamic': 'strict',
+    'properties': {
+        'id': {
+            'type': 'keyword'
+        },
+        'title': {
+            'type': 'text',
+            'analyzer': 'ru_en'
+        },
+        'imdb_rating': {
+            'type': 'float'
+        },
+        'roles': {
+            'type': 'keyword'
+        },
+    }
+}
+# Fields added to the mappings after the indices were first created. The mappings are strict, so an index
+# created before rejects the documents with such a field until it is put to the mapping (see update_mapping).
+ADDED_FIELDS = {
+    'genres': {'suggest': SUGGEST_MAPPING},
+    'persons': {'suggest': SUGGEST_MAPPING, 'films': FILMS_MAPPING},
+}
 
 
 class Service:
@@ -16,13 +50,23 @@ class Service:
     Class to load data into Elasticsearch, to create and update indices
     """
 
-    def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
+    def __init__(self, redis: Redis, elastic: Elasticsearch):
         self.redis = redis
         self.elastic = elastic
+        # Ids of the documents changed by the loads of this cycle by index, published once per index
+        self.changed_ids: dict[str, list[str]] = defaultdict(list)
+        # Indices whose mapping is checked by this process, it is updated once before their first load
+        self.mapped_indices = set()
+        # The publications of all the loads run on this loop, so they reuse the connections of the client
+        # which are bound to it, rather than a new loop and connection per bulk
+        self.loop = asyncio.new_event_loop()
 
     def load_data(self, transformed_data, chunk_size, index_name):
         if not self.elastic.indices.exists(index=index_name):
             create_index(self.elastic, index_name)
+        elif index_name not in self.mapped_indices:
+            update_mapping(self.elastic, index_name)
+        self.mapped_indices.add(index_name)
         streaming_bulk(self.elastic, 'update', transformed_data, chunk_size, ignore=400, raise_on_error=True)
         try:
             bulks_processed = 0
@@ -33,6 +77,11 @@ class Service:
                 ok, result = response
                 if not ok:
                     not_ok.append(result)
+                else:
+                    item = next(iter(result.values()))
+                    # A noop update leaves the document as it was, the API has nothing to reload
+                    if item.get('result') != 'noop':
+                        self.changed_ids[index_name].append(item['_id'])
                 if cnt % chunk_size == 0:
                     bulks_processed += 1
                 logger.debug(
@@ -51,12 +100,29 @@ class Service:
         else:
             return cnt + 1
 
+    def publish_changes(self, index_name):
+        """
+        Tells the API which documents the loads of the index have changed, so that it drops them from its
+        cache.
+        Called once the cycle has loaded (and refreshed) the index, so that the API reloads the documents
+        which are already searchable and its lists get one new generation per cycle, not per bulk.
+        Nothing is published if nothing has changed. A failure is only logged: the API cache expires
+        on its own anyway.
+        """
+        ids = self.changed_ids.pop(index_name, [])
+        if not ids:
+            return
+        try:
+            self.loop.run_until_complete(publish_changes(self.redis, index_name, ids))
+        except Exception as e:
+            logger.error(f'Failed to publish the changes of {index_name}: {e}')
+
 
 @lru_cache()
-def get_service(
-    redis: Redis = Depends(get_redis),
-    elastic: AsyncElasticsearch = Depends(get_elastic),
-) -> Service:
+def get_service() -> Service:
+    settings = Settings()
+    redis = aioredis.from_url(f'redis://{settings.redis_host}:{settings.redis_port}')
+    elastic = Elasticsearch(hosts=[f'http://{settings.es_host}:{settings.es_port}'])
     return Service(redis, elastic)
 
 
@@ -65,6 +131,22 @@ def create_index(client, index_name):
     eval(func_name(client, index_name))
 
 
+def update_mapping(client, index_name):
+    """
+    Puts ADDED_FIELDS to the mapping of the existing index, it is a no-op if they are there already.
+    The documents loaded before get the new fields on their next change; to fill them in all the documents
+    at once, remove the state of the ETL (etl_state.json), so that the next run loads everything again.
+    """
+    fields = ADDED_FIELDS.get(index_name)
+    if not fields:
+        return
+    try:
+        client.indices.put_mapping(index=index_name, body={'properties': fields})
+        logger.info(f'Mapping of {index_name} is updated with {", ".join(fields)}')
+    except Exception as ex:
+        logger.error(f'Failed to update the mapping of {index_name}: {ex}')
+
+
 def create_index_genres(client, index_name):
     created = False
     settings = {
@@ -125,6 +207,7 @@ def create_index_genres(client, index_name):
                                 }
                             }
                         },
+                        'suggest': SUGGEST_MAPPING,
                     }
                 }
         }
@@ -201,6 +284,8 @@ def create_index_persons(client, index_name):
                                 }
                             }
                         },
+                        'suggest': SUGGEST_MAPPING,
+                        'films': FILMS_MAPPING,
                     }
             }
         }
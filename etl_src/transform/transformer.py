@@ -9,15 +9,36 @@ class Genre:
     id: uuid.UUID = field(default_factory=uuid.uuid4)
 
 
+@dataclass
+class PersonFilm:
+    title: str
+    imdb_rating: float
+    roles: list[str]
+    id: uuid.UUID = field(default_factory=uuid.uuid4)
+
+
 @dataclass
 class Person:
     full_name: str
+    films: list[PersonFilm] = field(default_factory=list)
     id: uuid.UUID = field(default_factory=uuid.uuid4)
 
 
+def suggest_inputs(text: str) -> list[str]:
+    """
+    Inputs of the completion (autocomplete) field: the text starting from each of its words,
+    so that "dark kn" suggests "The Dark Knight" as well as "the da" does.
+    """
+    words = text.split()
+    return [' '.join(words[start:]) for start in range(len(words))]
+
+
 class DataTransform:
     """
     Class to prepare extracted from PostgresQL data for loading into Elasticsearch indices
+
+    The id of a document is its field as well, the API sorts by it last so that the order of its cursors
+    is stable. The documents loaded without it are fixed by a reload (remove the state of the ETL).
     """
     def __init__(self):
         pass
@@ -27,7 +48,8 @@ class DataTransform:
             data = []
             item = {'_op_type': 'update', '_index': index_name,
                     'source': {
-                        '_id': row['id'], 'name': row['name']}}
+                        '_id': row['id'], 'id': row['id'], 'name': row['name'],
+                        'suggest': suggest_inputs(row['name'])}}
             data.append(item)
             json_data = json.dumps(item)
             yield json_data
@@ -37,7 +59,8 @@ class DataTransform:
             data = []
             item = {'_op_type': 'update', '_index': index_name,
                     'source': {
-                        '_id': row['id'], 'full_name': row['full_name']}}
+                        '_id': row['id'], 'id': row['id'], 'full_name': row['full_name'],
+                        'films': row['films'], 'suggest': suggest_inputs(row['full_name'])}}
             data.append(item)
             json_data = json.dumps(item)
             yield json_data
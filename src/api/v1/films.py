@@ -1,14 +1,30 @@
 from http import HTTPStatus
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from pydantic import BaseModel, Field
 
+from src.api.v1.utils import parse_fields
 from src.models.film import Genre, Person
 from src.models.mixins import UUIDMixin
+from src.models.utils import partial_model
 from src.services.film import FilmService, get_film_service
 
 router = APIRouter()
 
+MAX_BATCH_SIZE = 100
+MAX_SUGGEST_SIZE = 20
+MAX_PREFIX_LENGTH = 100
+# Cache-Control max-age of the responses for the clients and CDNs
+FILM_MAX_AGE_IN_SECONDS = 60
+FILM_LIST_MAX_AGE_IN_SECONDS = 30
+FILM_SEARCH_MAX_AGE_IN_SECONDS = 30
+FILM_SUGGEST_MAX_AGE_IN_SECONDS = 30
+
+
+class FilmSuggestAPI(UUIDMixin, BaseModel):
+    title: str
+
 
 class FilmListAPI(UUIDMixin, BaseModel):
     title: str
@@ -26,6 +42,16 @@ class FilmAPI(UUIDMixin, BaseModel):
     directors: list[Person]
 
 
+class FilmBatchRequestAPI(BaseModel):
+    ids: list[str] = Field(..., min_items=1, max_items=MAX_BATCH_SIZE, description='Film uuids')
+
+
+class FilmBatchItemAPI(BaseModel):
+    id: str
+    found: bool
+    film: Optional[FilmAPI] = None
+
+
 @router.get('/',
             response_model=list[FilmListAPI],
             response_description='List of films')
@@ -36,14 +62,25 @@ async def film_list(
                                       'of "field":"direction(=asc|desc)" '
                                       'pairs. Example: imdb_rating:desc)'),
     genre: str = Query(None, description='Filter by genre uuid'),
+    cursor: str = Query(None, description='Cursor of the next page returned in the X-Next-Cursor '
+                                          'header. When set, the "page" parameter is ignored'),
+    fields: str = Query(None, description='Comma-separated fields of the films to return '
+                                          '(Example: id,title). By default the fields of FilmListAPI'),
+    with_total: bool = Query(False, description='Return the total of the list in the X-Total-Count '
+                                                'header and whether there is a next page in X-Has-Next'),
+    if_none_match: Optional[str] = Header(None),
     film_service: FilmService = Depends(get_film_service),
-) -> list[FilmListAPI]:
+) -> Response:
     """
     Returns list of films by the parameters specified in the query.
     Each element of the list is a dict of the FilmListAPI structure.
     """
-    films = await film_service.all(page_size=page_size, page=page, sort=sort, genre=genre)
-    return [FilmListAPI.parse_obj(film.dict(by_alias=True)) for film in films]
+    field_names = parse_fields(fields, FilmAPI, default=FilmListAPI)
+    result = await film_service.all_response(
+        partial_model(FilmAPI, field_names), page_size=page_size, page=page, sort=sort,
+        genre=genre, cursor=cursor, fields=field_names, with_total=with_total,
+    )
+    return result.to_response(if_none_match, FILM_LIST_MAX_AGE_IN_SECONDS)
 
 
 @router.get('/search',
@@ -56,8 +93,15 @@ async def film_search(
                                       'of "field":"direction(=asc|desc)" '
                                       'pairs. Example: imdb_rating:desc)'),
     query: str = Query(None, description='Part of the movie title (Example: dark sta )'),
-    film_service: FilmService = Depends(get_film_service)
-) -> list[FilmListAPI]:
+    cursor: str = Query(None, description='Cursor of the next page returned in the X-Next-Cursor '
+                                          'header. When set, the "page" parameter is ignored'),
+    fields: str = Query(None, description='Comma-separated fields of the films to return '
+                                          '(Example: id,title). By default the fields of FilmListAPI'),
+    with_total: bool = Query(False, description='Return the total of the list in the X-Total-Count '
+                                                'header and whether there is a next page in X-Has-Next'),
+    if_none_match: Optional[str] = Header(None),
+    film_service: FilmService = Depends(get_film_service),
+) -> Response:
     """
     Returns list of films by the parameters specified in the query.
     Each element of the list is a dict of the FilmListAPI structure.
@@ -66,19 +110,72 @@ async def film_search(
 
     Parameter **query**: part of film title.
     """
-    films = await film_service.all(page_size=page_size, page=page, sort=sort, query=query)
-    return [FilmListAPI.parse_obj(film.dict(by_alias=True)) for film in films]
+    field_names = parse_fields(fields, FilmAPI, default=FilmListAPI)
+    result = await film_service.all_response(
+        partial_model(FilmAPI, field_names), page_size=page_size, page=page, sort=sort,
+        query=query, cursor=cursor, fields=field_names, with_total=with_total,
+    )
+    return result.to_response(if_none_match, FILM_SEARCH_MAX_AGE_IN_SECONDS)
+
+
+@router.get('/suggest',
+            response_model=list[FilmSuggestAPI],
+            response_description='Films for the autocomplete')
+async def film_suggest(
+    prefix: str = Query(..., max_length=MAX_PREFIX_LENGTH,
+                        description='Beginning of a word of the title (Example: dar)'),
+    size: int = Query(10, ge=1, le=MAX_SUGGEST_SIZE, description='Number of suggestions'),
+    if_none_match: Optional[str] = Header(None),
+    film_service: FilmService = Depends(get_film_service),
+) -> Response:
+    """
+    Returns the films with a word of the title starting with the prefix, for the search as you type.
+    Unlike /search, it is not fuzzy and returns the id and the title only, but it is fast.
+    """
+    result = await film_service.suggest_response(FilmSuggestAPI, prefix, size)
+    return result.to_response(if_none_match, FILM_SUGGEST_MAX_AGE_IN_SECONDS)
+
+
+@router.post('/batch',
+             response_model=list[FilmBatchItemAPI],
+             response_description='Films in the order of the requested ids')
+async def film_batch(
+    request: FilmBatchRequestAPI,
+    film_service: FilmService = Depends(get_film_service),
+) -> list[FilmBatchItemAPI]:
+    """
+    Returns all information about several films at once.
+    The items are in the order of the requested ids, an unknown id has "found": false.
+    """
+    films = await film_service.get_by_ids(request.ids)
+    return [
+        FilmBatchItemAPI(
+            id=film_id,
+            found=film is not None,
+            film=FilmAPI(**film.dict(by_alias=True)) if film else None,
+        )
+        for film_id, film in zip(request.ids, films)
+    ]
 
 
 @router.get('/{film_id}',
             response_model=FilmAPI,
             response_description='Dict with all information about the film')
-async def film_details(film_id: str, film_service: FilmService = Depends(get_film_service)) -> FilmAPI:
+async def film_details(
+    film_id: str,
+    fields: str = Query(None, description='Comma-separated fields of the film to return '
+                                          '(Example: id,title). By default all of them'),
+    if_none_match: Optional[str] = Header(None),
+    film_service: FilmService = Depends(get_film_service),
+) -> Response:
     """
     Returns the dict with all information about the film by ID.
     """
-    film = await film_service.get_by_id(film_id)
+    field_names = parse_fields(fields, FilmAPI, default=FilmAPI)
+    film = await film_service.get_response_by_id(
+        film_id, partial_model(FilmAPI, field_names), field_names,
+    )
     if not film:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='film not found')
 
-    return FilmAPI(**film.dict(by_alias=True))
+    return film.to_response(if_none_match, FILM_MAX_AGE_IN_SECONDS)
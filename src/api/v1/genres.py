@@ -1,14 +1,29 @@
 from http import HTTPStatus
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from pydantic import BaseModel, Field
 
+from src.api.v1.utils import parse_fields
 from src.models.mixins import UUIDMixin
+from src.models.utils import partial_model
 from src.services.genre import GenreService, get_genre_service
 
 router = APIRouter()
 
+MAX_BATCH_SIZE = 100
+MAX_SUGGEST_SIZE = 20
+MAX_PREFIX_LENGTH = 100
+# Cache-Control max-age of the responses for the clients and CDNs
+GENRE_MAX_AGE_IN_SECONDS = 300
+GENRE_LIST_MAX_AGE_IN_SECONDS = 300
+GENRE_SEARCH_MAX_AGE_IN_SECONDS = 60
+GENRE_SUGGEST_MAX_AGE_IN_SECONDS = 30
+
+
+class GenreSuggestAPI(UUIDMixin, BaseModel):
+    name: str
+
 
 class GenreListAPI(UUIDMixin, BaseModel):
     name: str
@@ -18,6 +33,16 @@ class GenreAPI(UUIDMixin, BaseModel):
     name: str
 
 
+class GenreBatchRequestAPI(BaseModel):
+    ids: List[str] = Field(..., min_items=1, max_items=MAX_BATCH_SIZE, description='Genre uuids')
+
+
+class GenreBatchItemAPI(BaseModel):
+    id: str
+    found: bool
+    genre: Optional[GenreAPI] = None
+
+
 @router.get('/', response_model=List[GenreListAPI])
 async def genre_list(
     page_size: int = Query(10, description='Number of genres on page'),
@@ -26,14 +51,25 @@ async def genre_list(
                                       'of "field":"direction(=asc|desc)" '
                                       'pairs. Example: name:desc)'),
     genre: str = Query(None, description='Filter by genre uuid'),
-    genre_service: GenreService = Depends(get_genre_service)
-) -> List[GenreListAPI]:
+    cursor: str = Query(None, description='Cursor of the next page returned in the X-Next-Cursor '
+                                          'header. When set, the "page" parameter is ignored'),
+    fields: str = Query(None, description='Comma-separated fields of the genres to return '
+                                          '(Example: id,name). By default the fields of GenreListAPI'),
+    with_total: bool = Query(False, description='Return the total of the list in the X-Total-Count '
+                                                'header and whether there is a next page in X-Has-Next'),
+    if_none_match: Optional[str] = Header(None),
+    genre_service: GenreService = Depends(get_genre_service),
+) -> Response:
     """
     Returns list of genres by the parameters specified in the query.
     Each element of the list is a dict of the GenreListAPI structure.
     """
-    genres = await genre_service.all(page_size=page_size, page=page, sort=sort, genre=genre)
-    return [GenreListAPI.parse_obj(genre.dict(by_alias=True)) for genre in genres]
+    field_names = parse_fields(fields, GenreAPI, default=GenreListAPI)
+    result = await genre_service.all_response(
+        partial_model(GenreAPI, field_names), page_size=page_size, page=page, sort=sort,
+        genre=genre, cursor=cursor, fields=field_names, with_total=with_total,
+    )
+    return result.to_response(if_none_match, GENRE_LIST_MAX_AGE_IN_SECONDS)
 
 
 @router.get('/search', response_model=List[GenreListAPI])
@@ -44,8 +80,15 @@ async def genre_search(
                                       'of "field":"direction(=asc|desc)" '
                                       'pairs. Example: name:desc)'),
     query: str = Query(None, description='Part of the name (Example: comed )'),
-    genre_service: GenreService = Depends(get_genre_service)
-) -> List[GenreListAPI]:
+    cursor: str = Query(None, description='Cursor of the next page returned in the X-Next-Cursor '
+                                          'header. When set, the "page" parameter is ignored'),
+    fields: str = Query(None, description='Comma-separated fields of the genres to return '
+                                          '(Example: id,name). By default the fields of GenreListAPI'),
+    with_total: bool = Query(False, description='Return the total of the list in the X-Total-Count '
+                                                'header and whether there is a next page in X-Has-Next'),
+    if_none_match: Optional[str] = Header(None),
+    genre_service: GenreService = Depends(get_genre_service),
+) -> Response:
     """
     Returns list of genres by the parameters specified in the query.
     Each element of the list is a dict of the GenreListAPI structure.
@@ -54,17 +97,70 @@ async def genre_search(
 
     Parameter **query**: part of genre's name.
     """
-    genres = await genre_service.all(page_size=page_size, page=page, sort=sort, query=query)
-    return [GenreListAPI.parse_obj(genre.dict(by_alias=True)) for genre in genres]
+    field_names = parse_fields(fields, GenreAPI, default=GenreListAPI)
+    result = await genre_service.all_response(
+        partial_model(GenreAPI, field_names), page_size=page_size, page=page, sort=sort,
+        query=query, cursor=cursor, fields=field_names, with_total=with_total,
+    )
+    return result.to_response(if_none_match, GENRE_SEARCH_MAX_AGE_IN_SECONDS)
+
+
+@router.get('/suggest',
+            response_model=List[GenreSuggestAPI],
+            response_description='Genres for the autocomplete')
+async def genre_suggest(
+    prefix: str = Query(..., max_length=MAX_PREFIX_LENGTH,
+                        description='Beginning of a word of the name (Example: dar)'),
+    size: int = Query(10, ge=1, le=MAX_SUGGEST_SIZE, description='Number of suggestions'),
+    if_none_match: Optional[str] = Header(None),
+    genre_service: GenreService = Depends(get_genre_service),
+) -> Response:
+    """
+    Returns the genres with a word of the name starting with the prefix, for the search as you type.
+    Unlike /search, it is not fuzzy and returns the id and the name only, but it is fast.
+    """
+    result = await genre_service.suggest_response(GenreSuggestAPI, prefix, size)
+    return result.to_response(if_none_match, GENRE_SUGGEST_MAX_AGE_IN_SECONDS)
+
+
+@router.post('/batch',
+             response_model=List[GenreBatchItemAPI],
+             response_description='Genres in the order of the requested ids')
+async def genre_batch(
+    request: GenreBatchRequestAPI,
+    genre_service: GenreService = Depends(get_genre_service),
+) -> List[GenreBatchItemAPI]:
+    """
+    Returns all information about several genres at once.
+    The items are in the order of the requested ids, an unknown id has "found": false.
+    """
+    genres = await genre_service.get_by_ids(request.ids)
+    return [
+        GenreBatchItemAPI(
+            id=genre_id,
+            found=genre is not None,
+            genre=GenreAPI(**genre.dict(by_alias=True)) if genre else None,
+        )
+        for genre_id, genre in zip(request.ids, genres)
+    ]
 
 
 @router.get('/{genre_id}', response_model=GenreAPI)
-async def genre_details(genre_id: str, genre_service: GenreService = Depends(get_genre_service)) -> GenreAPI:
+async def genre_details(
+    genre_id: str,
+    fields: str = Query(None, description='Comma-separated fields of the genre to return '
+                                          '(Example: id,name). By default all of them'),
+    if_none_match: Optional[str] = Header(None),
+    genre_service: GenreService = Depends(get_genre_service),
+) -> Response:
     """
     Returns the dict with all information about the genre by ID.
     """
-    genre = await genre_service.get_by_id(genre_id)
+    field_names = parse_fields(fields, GenreAPI, default=GenreAPI)
+    genre = await genre_service.get_response_by_id(
+        genre_id, partial_model(GenreAPI, field_names), field_names,
+    )
     if not genre:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='genre not found')
 
-    return GenreAPI(**genre.dict(by_alias=True))
+    return genre.to_response(if_none_match, GENRE_MAX_AGE_IN_SECONDS)
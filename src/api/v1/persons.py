@@ -1,14 +1,36 @@
 from http import HTTPStatus
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from pydantic import BaseModel, Field
 
+from src.api.v1.utils import parse_fields
 from src.models.mixins import UUIDMixin
+from src.models.utils import partial_model
 from src.services.person import PersonService, get_person_service
 
 router = APIRouter()
 
+MAX_BATCH_SIZE = 100
+MAX_SUGGEST_SIZE = 20
+MAX_PREFIX_LENGTH = 100
+# Cache-Control max-age of the responses for the clients and CDNs
+PERSON_MAX_AGE_IN_SECONDS = 60
+PERSON_LIST_MAX_AGE_IN_SECONDS = 30
+PERSON_SEARCH_MAX_AGE_IN_SECONDS = 30
+PERSON_SUGGEST_MAX_AGE_IN_SECONDS = 30
+PERSON_FILMS_MAX_AGE_IN_SECONDS = 60
+
+
+class PersonFilmAPI(UUIDMixin, BaseModel):
+    title: str
+    imdb_rating: Optional[float]
+    roles: List[str]
+
+
+class PersonSuggestAPI(UUIDMixin, BaseModel):
+    full_name: str
+
 
 class PersonListAPI(UUIDMixin, BaseModel):
     full_name: str
@@ -16,6 +38,17 @@ class PersonListAPI(UUIDMixin, BaseModel):
 
 class PersonAPI(UUIDMixin, BaseModel):
     full_name: str
+    films: List[PersonFilmAPI]
+
+
+class PersonBatchRequestAPI(BaseModel):
+    ids: List[str] = Field(..., min_items=1, max_items=MAX_BATCH_SIZE, description='Person uuids')
+
+
+class PersonBatchItemAPI(BaseModel):
+    id: str
+    found: bool
+    person: Optional[PersonAPI] = None
 
 
 @router.get('/', response_model=List[PersonListAPI])
@@ -26,14 +59,26 @@ async def person_list(
                                       'of "field":"direction(=asc|desc)" '
                                       'pairs. Example: name:desc)'),
     genre: str = Query(None, description='Filter by genre uuid'),
-    person_service: PersonService = Depends(get_person_service)
-) -> List[PersonListAPI]:
+    cursor: str = Query(None, description='Cursor of the next page returned in the X-Next-Cursor '
+                                          'header. When set, the "page" parameter is ignored'),
+    fields: str = Query(None, description='Comma-separated fields of the persons to return '
+                                          '(Example: id,full_name,films). '
+                                          'By default the fields of PersonListAPI'),
+    with_total: bool = Query(False, description='Return the total of the list in the X-Total-Count '
+                                                'header and whether there is a next page in X-Has-Next'),
+    if_none_match: Optional[str] = Header(None),
+    person_service: PersonService = Depends(get_person_service),
+) -> Response:
     """
     Returns list of persons by the parameters specified in the query.
     Each element of the list is a dict of the PersonListAPI structure.
     """
-    persons = await person_service.all(page_size=page_size, page=page, sort=sort, genre=genre)
-    return [PersonListAPI.parse_obj(person.dict(by_alias=True)) for person in persons]
+    field_names = parse_fields(fields, PersonAPI, default=PersonListAPI)
+    result = await person_service.all_response(
+        partial_model(PersonAPI, field_names), page_size=page_size, page=page, sort=sort,
+        genre=genre, cursor=cursor, fields=field_names, with_total=with_total,
+    )
+    return result.to_response(if_none_match, PERSON_LIST_MAX_AGE_IN_SECONDS)
 
 
 @router.get('/search', response_model=List[PersonListAPI])
@@ -44,8 +89,16 @@ async def person_search(
                                       'of "field":"direction(=asc|desc)" '
                                       'pairs. Example: name:desc)'),
     query: str = Query(None, description='Part of the full-name (Example: Jame )'),
-    person_service: PersonService = Depends(get_person_service)
-) -> List[PersonListAPI]:
+    cursor: str = Query(None, description='Cursor of the next page returned in the X-Next-Cursor '
+                                          'header. When set, the "page" parameter is ignored'),
+    fields: str = Query(None, description='Comma-separated fields of the persons to return '
+                                          '(Example: id,full_name,films). '
+                                          'By default the fields of PersonListAPI'),
+    with_total: bool = Query(False, description='Return the total of the list in the X-Total-Count '
+                                                'header and whether there is a next page in X-Has-Next'),
+    if_none_match: Optional[str] = Header(None),
+    person_service: PersonService = Depends(get_person_service),
+) -> Response:
     """
     Returns list of persons by the parameters specified in the query.
     Each element of the list is a dict of the PersonListAPI structure.
@@ -54,18 +107,89 @@ async def person_search(
 
     Parameter **query**: part of person's full-name.
     """
-    persons = await person_service.all(page_size=page_size, page=page, sort=sort, query=query)
-    return [PersonListAPI.parse_obj(person.dict(by_alias=True)) for person in persons]
+    field_names = parse_fields(fields, PersonAPI, default=PersonListAPI)
+    result = await person_service.all_response(
+        partial_model(PersonAPI, field_names), page_size=page_size, page=page, sort=sort,
+        query=query, cursor=cursor, fields=field_names, with_total=with_total,
+    )
+    return result.to_response(if_none_match, PERSON_SEARCH_MAX_AGE_IN_SECONDS)
+
+
+@router.get('/suggest',
+            response_model=List[PersonSuggestAPI],
+            response_description='Persons for the autocomplete')
+async def person_suggest(
+    prefix: str = Query(..., max_length=MAX_PREFIX_LENGTH,
+                        description='Beginning of a word of the full name (Example: dar)'),
+    size: int = Query(10, ge=1, le=MAX_SUGGEST_SIZE, description='Number of suggestions'),
+    if_none_match: Optional[str] = Header(None),
+    person_service: PersonService = Depends(get_person_service),
+) -> Response:
+    """
+    Returns the persons with a word of the full name starting with the prefix, for the search as you type.
+    Unlike /search, it is not fuzzy and returns the id and the full name only, but it is fast.
+    """
+    result = await person_service.suggest_response(PersonSuggestAPI, prefix, size)
+    return result.to_response(if_none_match, PERSON_SUGGEST_MAX_AGE_IN_SECONDS)
+
+
+@router.post('/batch',
+             response_model=List[PersonBatchItemAPI],
+             response_description='Persons in the order of the requested ids')
+async def person_batch(
+    request: PersonBatchRequestAPI,
+    person_service: PersonService = Depends(get_person_service),
+) -> List[PersonBatchItemAPI]:
+    """
+    Returns all information about several persons at once.
+    The items are in the order of the requested ids, an unknown id has "found": false.
+    """
+    persons = await person_service.get_by_ids(request.ids)
+    return [
+        PersonBatchItemAPI(
+            id=person_id,
+            found=person is not None,
+            person=PersonAPI(**person.dict(by_alias=True)) if person else None,
+        )
+        for person_id, person in zip(request.ids, persons)
+    ]
 
 
 @router.get('/{person_id}', response_model=PersonAPI)
-async def person_details(person_id: str,
-                         person_service: PersonService = Depends(get_person_service)) -> PersonAPI:
+async def person_details(
+    person_id: str,
+    fields: str = Query(None, description='Comma-separated fields of the person to return '
+                                          '(Example: id,full_name). By default all of them'),
+    if_none_match: Optional[str] = Header(None),
+    person_service: PersonService = Depends(get_person_service),
+) -> Response:
     """
     Returns the dict with all information about the person by ID.
     """
-    person = await person_service.get_by_id(person_id)
+    field_names = parse_fields(fields, PersonAPI, default=PersonAPI)
+    person = await person_service.get_response_by_id(
+        person_id, partial_model(PersonAPI, field_names), field_names,
+    )
     if not person:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='Person not found')
 
-    return PersonAPI(**person.dict(by_alias=True))
+    return person.to_response(if_none_match, PERSON_MAX_AGE_IN_SECONDS)
+
+
+@router.get('/{person_id}/film',
+            response_model=List[PersonFilmAPI],
+            response_description='Films of the person')
+async def person_films(
+    person_id: str,
+    role: str = Query(None, description='Only the films with the role of the person (Example: actor)'),
+    if_none_match: Optional[str] = Header(None),
+    person_service: PersonService = Depends(get_person_service),
+) -> Response:
+    """
+    Returns the films the person took part in, with their roles in each of them.
+    """
+    films = await person_service.get_films_response(person_id, PersonFilmAPI, role)
+    if not films:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='Person not found')
+
+    return films.to_response(if_none_match, PERSON_FILMS_MAX_AGE_IN_SECONDS)
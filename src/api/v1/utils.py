@@ -0,0 +1,29 @@
+from http import HTTPStatus
+from typing import Optional, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel],
+                 default: Type[BaseModel]) -> Optional[tuple[str, ...]]:
+    """
+    Converts the comma-separated names of the response fields (e.g. "id,title") into the field names of
+    the model. If the fields are not specified, the fields of the `default` model are taken.
+    The id is always returned. None means all the fields of the model.
+    """
+    names = {field.alias: name for name, field in model.__fields__.items()}
+    if fields:
+        requested = {item.strip() for item in fields.split(',') if item.strip()}
+    else:
+        requested = {field.alias for field in default.__fields__.values()}
+    unknown = requested - names.keys()
+    if unknown:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail=f'Unknown fields: {", ".join(sorted(unknown))}',
+        )
+
+    selected = {names[item] for item in requested} | {'uuid'}
+    if selected == model.__fields__.keys():
+        return None
+    return tuple(name for name in model.__fields__ if name in selected)
@@ -0,0 +1,184 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from http import HTTPStatus
+from typing import AsyncIterator, Callable, Optional
+
+import orjson
+from aioredis import Redis
+from fastapi import FastAPI
+from loguru import logger
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from src.core.config import settings
+from src.core.metrics import REQUESTS_REJECTED
+
+# Routes (path templates) the limits apply to, the probes and the docs are not limited
+LIMITED_ROUTES_PREFIX = '/api/v1/'
+# The fuzzy searches, which are the most expensive requests, have their own lower limit
+SEARCH_ROUTE_SUFFIX = '/search'
+RATE_LIMIT_KEY = 'ratelimit:{client}:{route}'
+# Takes a token from the bucket of KEYS[1], refilled at ARGV[1] tokens per second up to ARGV[2] tokens,
+# ARGV[3] is the current time. Returns whether a token was taken and in how many seconds one will be there.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+
+class RateLimitMiddleware:
+    """
+    Token buckets of each client (its address, as uvicorn takes it from the trusted proxy headers)
+    per route, kept in Redis, so that the limits are shared by all the workers. A request costs
+    one script call, which takes a token atomically. A request without a token is answered with 429.
+
+    The limits are RATE_LIMIT_PER_SECOND (with RATE_LIMIT_BURST) and RATE_LIMIT_SEARCH_PER_SECOND
+    (with RATE_LIMIT_SEARCH_BURST) for the searches. If Redis fails, the requests are let through.
+    """
+
+    def __init__(self, app: ASGIApp, fastapi_app: FastAPI, get_redis: Callable[[], Optional[Redis]]):
+        self.app = app
+        self.fastapi_app = fastapi_app
+        self.get_redis = get_redis
+        self._script = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route(scope)
+        if not route or not route.startswith(LIMITED_ROUTES_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = await self._take_token(scope, route)
+        if retry_after is None:
+            await self.app(scope, receive, send)
+            return
+
+        REQUESTS_REJECTED.labels(route, 'rate_limit').inc()
+        body = orjson.dumps({'detail': 'Too many requests'})
+        await send({
+            'type': 'http.response.start',
+            'status': HTTPStatus.TOO_MANY_REQUESTS,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', str(math.ceil(retry_after)).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _take_token(self, scope: Scope, route: str) -> Optional[float]:
+        """Returns None if the request is let through, otherwise in how many seconds the client may retry."""
+        if route.endswith(SEARCH_ROUTE_SUFFIX):
+            rate, burst = settings.RATE_LIMIT_SEARCH_PER_SECOND, settings.RATE_LIMIT_SEARCH_BURST
+        else:
+            rate, burst = settings.RATE_LIMIT_PER_SECOND, settings.RATE_LIMIT_BURST
+        client = scope['client'][0] if scope.get('client') else 'unknown'
+        try:
+            redis = self.get_redis()
+            if self._script is None or self._script.registered_client is not redis:
+                self._script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+            allowed, retry_after = await self._script(
+                keys=[RATE_LIMIT_KEY.format(client=client, route=route)], args=[rate, burst, time.time()],
+            )
+        except Exception as e:
+            logger.warning(f'Failed to check the rate limit of {client}, the request is let through: {e!r}')
+            return None
+        return None if allowed else float(retry_after)
+
+    def _route(self, scope: Scope) -> Optional[str]:
+        """The path template of the route the request goes to, e.g. /api/v1/films/{film_id}."""
+        for route in self.fastapi_app.routes:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                return route.path
+        return None
+
+
+class OverloadedError(Exception):
+    """The request has waited in the queue of PrioritySemaphore for too long."""
+
+
+class PrioritySemaphore:
+    """
+    Semaphore whose waiters are admitted by their priority (the lower, the sooner), then in order of arrival.
+    A waiter gives up after `timeout` seconds with OverloadedError, so that a burst of the requests of
+    the low priority is shed rather than queued.
+    """
+
+    def __init__(self, limit: int, timeout: float):
+        self.limit = limit
+        self.timeout = timeout
+        self._active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, priority: int) -> AsyncIterator[None]:
+        if not self.limit:
+            yield
+            return
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: int):
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            return
+        waiter = (priority, next(self._counter), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        future = waiter[2]
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._remove(waiter)
+            raise OverloadedError(f'No slot within {self.timeout}s (priority {priority})') from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over right before the cancellation
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            # A waiter may be cancelled, but not removed yet
+            if not future.done():
+                # The slot goes to the waiter, the number of the active ones is the same
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def _remove(self, waiter: tuple[int, int, asyncio.Future]):
+        """Drops the waiter which has given up, so that only the live ones are in the queue."""
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
@@ -13,10 +13,95 @@ BASE_DIR = Path(__file__).resolve().parent
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = 'movies'
+    # The production server (python -m src.server): the address and the number of the worker processes,
+    # zero is one per CPU core
+    SERVER_HOST: str = '0.0.0.0'
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 0
     REDIS_HOST: str = '127.0.0.1'
     REDIS_PORT: str = '6379'
     ELASTIC_HOST: str = '127.0.0.1'
     ELASTIC_PORT: str = '9200'
+    # Keep-alive of the point-in-time opened for cursor pagination (e.g. "1m"). Empty disables PIT.
+    ELASTIC_PIT_KEEP_ALIVE: str = ''
+    # The totals of the lists are counted up to this number, a larger one is reported as "at least" it
+    ELASTIC_TRACK_TOTAL_HITS: int = 10000
+    # Whether the documents read from ES are validated by the models, off trusts the ETL
+    ELASTIC_VALIDATE_DOCUMENTS: bool = True
+    # Timeouts of the ES requests: the lookups by id, the searches and the rest
+    ELASTIC_GET_TIMEOUT_IN_SECONDS: float = 1
+    ELASTIC_SEARCH_TIMEOUT_IN_SECONDS: float = 3
+    ELASTIC_TIMEOUT_IN_SECONDS: float = 10
+    # ES is not called for ELASTIC_BREAKER_RESET_TIMEOUT_IN_SECONDS after ELASTIC_BREAKER_FAILURES failed
+    # requests in a row, the cache is served meanwhile (see CACHE_DEGRADED_TTL_IN_SECONDS)
+    ELASTIC_BREAKER_FAILURES: int = 5
+    ELASTIC_BREAKER_RESET_TIMEOUT_IN_SECONDS: float = 10
+    # Concurrent ES requests of a worker, the others wait for ELASTIC_QUEUE_TIMEOUT_IN_SECONDS at most
+    # (the lookups by id first, the searches last) and fail then. Zero disables the limit.
+    ELASTIC_MAX_CONCURRENT_REQUESTS: int = 50
+    ELASTIC_QUEUE_TIMEOUT_IN_SECONDS: float = 1
+    # The searches a worker issues within the window are sent to ES as one _msearch, at most
+    # ELASTIC_MSEARCH_MAX_SIZE of them. Zero window disables the batching.
+    ELASTIC_MSEARCH_WINDOW_IN_MS: float = 0
+    ELASTIC_MSEARCH_MAX_SIZE: int = 32
+    # In-process LRU cache in front of Redis. Zero CACHE_L1_MAX_ITEMS disables it.
+    CACHE_L1_MAX_ITEMS: int = 10000
+    CACHE_L1_TTL_IN_SECONDS: float = 60
+    # How long one worker may hold the lock while loading a missed cache entry from ES
+    CACHE_LOCK_TIMEOUT_IN_SECONDS: float = 5
+    # How long a cache entry is still served (and refreshed in the background) after its ttl is over
+    CACHE_STALE_TTL_IN_SECONDS: int = 60 * 5
+    # How long a cache entry is kept after that, it is served only while ES is unavailable
+    CACHE_DEGRADED_TTL_IN_SECONDS: int = 60 * 60
+    # Eagerness of the probabilistic early refresh (XFetch), 0 disables it
+    CACHE_XFETCH_BETA: float = 1.0
+    # Ready JSON responses of the endpoints. They duplicate the entities, so they are kept shortly
+    CACHE_RESPONSE_TTL_IN_SECONDS: int = 60
+    # Totals of the lists, shared by all the pages of a list
+    CACHE_COUNT_TTL_IN_SECONDS: int = 60 * 15
+    # Autocomplete suggestions, a new prefix on every keystroke makes most of them one-off
+    CACHE_SUGGEST_TTL_IN_SECONDS: int = 10
+    # The cache entries were validated before they were written, so they are decoded without validation
+    CACHE_TRUSTED_DECODE: bool = True
+    # Format of the cache entries written to Redis: "json" or the compact "msgpack". Entries of both formats
+    # are read, so switch to "msgpack" once all the workers run the version able to read it.
+    CACHE_CODEC: str = 'json'
+    # Compression of the msgpack entries of at least CACHE_COMPRESSION_MIN_SIZE bytes: "", "lz4" or "zstd"
+    # (requires the lz4 or zstandard package)
+    CACHE_COMPRESSION: str = ''
+    CACHE_COMPRESSION_MIN_SIZE: int = 1024
+    # Requests slower than this are logged with their timings and ES queries, the share of them given
+    # by the sample rate
+    SLOW_REQUEST_THRESHOLD_IN_SECONDS: float = 1.0
+    SLOW_REQUEST_LOG_SAMPLE_RATE: float = 1.0
+    # Token buckets of each client per route, refilled at the rate (per second) up to the burst.
+    # The searches have their own limits.
+    RATE_LIMIT_ENABLED: bool = False
+    RATE_LIMIT_PER_SECOND: float = 20
+    RATE_LIMIT_BURST: int = 40
+    RATE_LIMIT_SEARCH_PER_SECOND: float = 2
+    RATE_LIMIT_SEARCH_BURST: int = 10
+    # Warm-up of the cache on startup: /ready reports ready once it is over (or has failed or timed out)
+    WARMUP_ENABLED: bool = False
+    WARMUP_TIMEOUT_IN_SECONDS: float = 60
+    # Connections opened to Redis and ES in advance
+    WARMUP_CONNECTIONS: int = 10
+    # Number of the best rated films to load
+    WARMUP_TOP_FILMS: int = 1000
+    # Number of the most frequent lists and searches of each kind to load, they are counted for the last
+    # WARMUP_QUERIES_WINDOW_IN_HOURS. Zero disables the counting.
+    WARMUP_TOP_QUERIES: int = 100
+    WARMUP_QUERIES_WINDOW_IN_HOURS: int = 24
+    QUERY_STATS_FLUSH_INTERVAL_IN_SECONDS: float = 10
+    # In-memory snapshots of the small indices, served without Redis and ES. An index of more documents
+    # than its limit (at most 9999) is not kept, zero disables the snapshot.
+    SNAPSHOT_GENRES_MAX_ITEMS: int = 1000
+    SNAPSHOT_PERSONS_MAX_ITEMS: int = 0
+    # Directory in shared memory (e.g. /dev/shm) the workers of the host share the snapshots through,
+    # so that one of them reads the index from ES. Empty disables the sharing.
+    SHARED_CACHE_DIR: str = ''
+    # How often the workers check if the ETL has changed the index and the snapshot is to be reloaded
+    SNAPSHOT_REFRESH_INTERVAL_IN_SECONDS: float = 5
 
     class Config:
         env_file = os.path.join(BASE_DIR, '.env')
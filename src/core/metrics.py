@@ -0,0 +1,120 @@
+import os
+import time
+
+from fastapi import FastAPI, Response
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest)
+from prometheus_client.multiprocess import MultiProcessCollector
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Buckets of the latencies of the external calls, which are mostly fast, in seconds
+CALL_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+
+REQUEST_LATENCY = Histogram(
+    'api_request_duration_seconds', 'Latency of the API requests', ['method', 'route', 'status'],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'api_requests_in_progress', 'API requests being processed', multiprocess_mode='livesum',
+)
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups by result (l1_hit, redis_hit, miss, error, degraded)',
+    ['namespace', 'kind', 'result'],
+)
+ELASTIC_LATENCY = Histogram(
+    'elasticsearch_request_duration_seconds', 'Latency of the ES requests', ['operation'],
+    buckets=CALL_BUCKETS,
+)
+ELASTIC_TOOK = Histogram(
+    'elasticsearch_took_seconds', 'Time ES reports to have spent on the requests', ['operation'],
+    buckets=CALL_BUCKETS,
+)
+ELASTIC_MSEARCH_BATCH_SIZE = Histogram(
+    'elasticsearch_msearch_batch_size', 'Searches sent together in one _msearch',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+ELASTIC_MSEARCH_WAIT = Histogram(
+    'elasticsearch_msearch_wait_seconds', 'Time a search waited for its _msearch batch to be sent',
+    buckets=CALL_BUCKETS,
+)
+ELASTIC_BREAKER_STATE = Gauge(
+    'elasticsearch_breaker_state', 'State of the ES circuit breaker: 0 closed, 1 half-open, 2 open',
+    multiprocess_mode='max',
+)
+ELASTIC_BREAKER_TRANSITIONS = Counter(
+    'elasticsearch_breaker_transitions_total', 'Changes of the state of the ES circuit breaker', ['state'],
+)
+ELASTIC_BREAKER_REJECTED = Counter(
+    'elasticsearch_breaker_rejected_total', 'ES requests failed fast by the open circuit breaker',
+)
+ELASTIC_QUEUE_WAIT = Histogram(
+    'elasticsearch_queue_wait_seconds', 'Time the ES requests waited for a slot of the worker', ['operation'],
+    buckets=CALL_BUCKETS,
+)
+ELASTIC_SHED = Counter(
+    'elasticsearch_shed_total', 'ES requests failed as they had not got a slot of the worker in time',
+    ['operation'],
+)
+REQUESTS_REJECTED = Counter(
+    'api_requests_rejected_total', 'API requests rejected by the admission control', ['route', 'reason'],
+)
+REDIS_LATENCY = Histogram(
+    'redis_command_duration_seconds', 'Latency of the Redis commands', ['command'], buckets=CALL_BUCKETS,
+)
+
+
+class MetricsMiddleware:
+    """
+    Measures the latency of the requests by route template (e.g. /api/v1/films/{film_id}).
+
+    A plain ASGI middleware: the route is taken from the endpoint the router put into the scope,
+    so the request costs a dict lookup and a histogram observation.
+    """
+
+    def __init__(self, app: ASGIApp, fastapi_app: FastAPI):
+        self.app = app
+        self.fastapi_app = fastapi_app
+        self._route_by_endpoint = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started_at = time.perf_counter()
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+            REQUEST_LATENCY.labels(scope['method'], self._route(scope), status).observe(
+                time.perf_counter() - started_at,
+            )
+
+    def _route(self, scope: Scope) -> str:
+        if self._route_by_endpoint is None:
+            self._route_by_endpoint = {
+                route.endpoint: route.path for route in self.fastapi_app.routes if hasattr(route, 'endpoint')
+            }
+        # Unmatched paths share one label, otherwise any scanner would blow up the number of series
+        return self._route_by_endpoint.get(scope.get('endpoint'), 'unmatched')
+
+
+def metrics_response() -> Response:
+    """
+    The metrics in the Prometheus text format.
+    With several worker processes PROMETHEUS_MULTIPROC_DIR must be set to merge the metrics of all of them.
+    """
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    # The content type already has the charset, so it is set as a header not to get it twice
+    return Response(generate_latest(registry), headers={'Content-Type': CONTENT_TYPE_LATEST})
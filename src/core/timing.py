@@ -0,0 +1,95 @@
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+from loguru import logger
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.core.config import settings
+
+
+class RequestTiming:
+    """Time spent by the request in each phase (redis, es, decode, render) and the ES queries it sent."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases: dict[str, float] = defaultdict(float)
+        self.es_queries: list[tuple[str, Any]] = []
+
+    def header(self, total: float) -> str:
+        """Value of the Server-Timing header, the durations are in milliseconds."""
+        items = [f'{phase};dur={duration * 1000:.2f}' for phase, duration in self.phases.items()]
+        items.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(items)
+
+
+request_timing: ContextVar[Optional[RequestTiming]] = ContextVar('request_timing', default=None)
+
+
+def record(phase: str, duration: float):
+    """Adds the duration (in seconds) to the phase of the current request, if any."""
+    timing = request_timing.get()
+    if timing:
+        timing.phases[phase] += duration
+
+
+def record_es_query(url: str, body: Any):
+    timing = request_timing.get()
+    if timing:
+        timing.es_queries.append((url, body))
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started_at)
+
+
+class ServerTimingMiddleware:
+    """
+    Returns the time spent by the request in each phase in the Server-Timing header.
+
+    The phases are recorded by the Redis client, the ES transport and the cache. Concurrent calls
+    of the same phase are summed up, so a phase may take longer than the whole request.
+    A request slower than SLOW_REQUEST_THRESHOLD_IN_SECONDS is logged (with the sample rate
+    SLOW_REQUEST_LOG_SAMPLE_RATE) together with its ES queries.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = request_timing.set(timing)
+
+        async def send_wrapper(message: Message):
+            if message['type'] == 'http.response.start':
+                header = timing.header(time.perf_counter() - timing.started_at)
+                headers = [*message.get('headers', []), (b'server-timing', header.encode())]
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_timing.reset(token)
+            total = time.perf_counter() - timing.started_at
+            if (
+                total >= settings.SLOW_REQUEST_THRESHOLD_IN_SECONDS
+                and random.random() < settings.SLOW_REQUEST_LOG_SAMPLE_RATE
+            ):
+                query = scope.get('query_string', b'').decode()
+                logger.warning(
+                    f'Slow request {scope["method"]} {scope["path"]}{"?" + query if query else ""}: '
+                    f'{timing.header(total)}; ES queries: {timing.es_queries}'
+                )
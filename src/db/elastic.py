@@ -1,9 +1,300 @@
-from typing import Optional
+import asyncio
+import contextvars
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
 
-from elasticsearch import AsyncElasticsearch
+from elasticsearch import AsyncElasticsearch, AsyncTransport, ConnectionError
+from elasticsearch.exceptions import HTTP_EXCEPTIONS, TransportError
+from loguru import logger
+
+from src.core.admission import OverloadedError, PrioritySemaphore
+from src.core.config import settings
+from src.core.metrics import (ELASTIC_BREAKER_REJECTED, ELASTIC_BREAKER_STATE, ELASTIC_BREAKER_TRANSITIONS,
+                              ELASTIC_LATENCY, ELASTIC_MSEARCH_BATCH_SIZE, ELASTIC_MSEARCH_WAIT,
+                              ELASTIC_QUEUE_WAIT, ELASTIC_SHED, ELASTIC_TOOK)
+from src.core.timing import record, record_es_query
+
+# Operations (see get_operation) of the lookups by id and of the searches, they have their own timeouts
+GET_OPERATIONS = {'_doc', '_source', '_mget'}
+SEARCH_OPERATIONS = {'_search', '_msearch', '_count'}
+# States of the circuit breaker, the values are those of its gauge
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+BREAKER_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
 
 es: Optional[AsyncElasticsearch] = None
 
 
 async def get_elastic() -> AsyncElasticsearch:
     return es
+
+
+class CircuitOpenError(ConnectionError):
+    """ES is not called while the circuit breaker is open."""
+
+
+class ElasticOverloadedError(ConnectionError):
+    """The request has not got a slot among ELASTIC_MAX_CONCURRENT_REQUESTS in time."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling ES once `failures` requests in a row have failed (timed out, not connected, 5xx or 429),
+    so that the requests fail fast instead of waiting for the timeout of an ES which is down or overloaded.
+
+    After `reset_timeout` seconds the breaker is half-open: one trial request is let through, its success
+    closes the breaker, its failure opens it again. Only the trial request does: the outcome of a request
+    started before the breaker opened says nothing about ES now.
+    """
+
+    def __init__(self, failures: int, reset_timeout: float):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._failed = 0
+        self._probing = False
+        ELASTIC_BREAKER_STATE.set(BREAKER_STATES[CLOSED])
+
+    def available(self) -> bool:
+        """Whether a request would be sent to ES now, the cached data is served as long as it would not."""
+        if self.state == OPEN:
+            return time.monotonic() >= self.opened_at + self.reset_timeout
+        return not (self.state == HALF_OPEN and self._probing)
+
+    def before_call(self) -> bool:
+        """Lets the call through or raises CircuitOpenError. Returns whether the call is the trial one."""
+        if self.state == OPEN and time.monotonic() >= self.opened_at + self.reset_timeout:
+            self._set_state(HALF_OPEN)
+        if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+            ELASTIC_BREAKER_REJECTED.inc()
+            raise CircuitOpenError('N/A', 'The circuit breaker of ES is open', None)
+        if self.state == HALF_OPEN:
+            self._probing = True
+            return True
+        return False
+
+    def on_success(self, probe: bool = False):
+        """`probe` is what before_call returned for the call."""
+        if self.state == CLOSED:
+            self._failed = 0
+        elif probe:
+            self._failed = 0
+            self._set_state(CLOSED)
+
+    def on_failure(self, probe: bool = False):
+        """`probe` is what before_call returned for the call."""
+        if self.state == CLOSED:
+            self._failed += 1
+            if self._failed >= self.failures:
+                self._open()
+        elif probe:
+            self._open()
+
+    def release(self, probe: bool):
+        """
+        Ends the call, even if it was cancelled without a result. `probe` is what before_call returned:
+        only the end of the trial call lets another one through, the calls started before it do not.
+        """
+        if probe:
+            self._probing = False
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        logger.warning(f'The circuit breaker of ES is {state} (was {self.state})')
+        self.state = state
+        ELASTIC_BREAKER_STATE.set(BREAKER_STATES[state])
+        ELASTIC_BREAKER_TRANSITIONS.labels(state).inc()
+
+
+elastic_breaker = CircuitBreaker(
+    settings.ELASTIC_BREAKER_FAILURES, settings.ELASTIC_BREAKER_RESET_TIMEOUT_IN_SECONDS,
+)
+
+
+elastic_limiter = PrioritySemaphore(
+    settings.ELASTIC_MAX_CONCURRENT_REQUESTS, settings.ELASTIC_QUEUE_TIMEOUT_IN_SECONDS,
+)
+
+
+class InstrumentedTransport(AsyncTransport):
+    """
+    Transport which measures the latency of the ES requests and the time ES spent on them (took).
+    The latency is also added to the "es" phase of the request, whose slow log gets the query.
+
+    Each request has the timeout of its operation, unless it is given explicitly, goes through
+    the circuit breaker and waits for a slot of the worker (see elastic_slot).
+    """
+
+    async def perform_request(self, method, url, headers=None, params=None, body=None):
+        operation = get_operation(url)
+        params = dict(params or {})
+        params.setdefault('request_timeout', get_timeout(operation))
+        probe = elastic_breaker.before_call()
+        try:
+            queued_at = time.perf_counter()
+            async with elastic_slot(operation):
+                queued = time.perf_counter() - queued_at
+                ELASTIC_QUEUE_WAIT.labels(operation).observe(queued)
+                record('es_queue', queued)
+                return await self._perform_request(operation, method, url, headers, params, body, probe)
+        finally:
+            elastic_breaker.release(probe)
+
+    async def _perform_request(self, operation, method, url, headers, params, body, probe):
+        record_es_query(url, body)
+        started_at = time.perf_counter()
+        try:
+            response = await super().perform_request(method, url, headers=headers, params=params, body=body)
+            elastic_breaker.on_success(probe)
+        except TransportError as e:
+            if is_failure(e):
+                elastic_breaker.on_failure(probe)
+            else:
+                # ES has answered, e.g. the document is not found
+                elastic_breaker.on_success(probe)
+            raise
+        finally:
+            duration = time.perf_counter() - started_at
+            ELASTIC_LATENCY.labels(operation).observe(duration)
+            record('es', duration)
+        if isinstance(response, dict) and 'took' in response:
+            ELASTIC_TOOK.labels(operation).observe(response['took'] / 1000)
+        return response
+
+
+@asynccontextmanager
+async def elastic_slot(operation: str) -> AsyncIterator[None]:
+    """
+    One of ELASTIC_MAX_CONCURRENT_REQUESTS slots of the worker for the request. The lookups by id
+    get the free slots first, then the rest, then the searches.
+    """
+    priority = 0 if operation in GET_OPERATIONS else 2 if operation in SEARCH_OPERATIONS else 1
+    try:
+        async with elastic_limiter.slot(priority):
+            yield
+    except OverloadedError as e:
+        ELASTIC_SHED.labels(operation).inc()
+        raise ElasticOverloadedError('N/A', 'Too many concurrent ES requests', str(e)) from e
+
+
+def get_timeout(operation: str) -> float:
+    if operation in GET_OPERATIONS:
+        return settings.ELASTIC_GET_TIMEOUT_IN_SECONDS
+    if operation in SEARCH_OPERATIONS:
+        return settings.ELASTIC_SEARCH_TIMEOUT_IN_SECONDS
+    return settings.ELASTIC_TIMEOUT_IN_SECONDS
+
+
+def is_failure(error: TransportError) -> bool:
+    """Whether the error means that ES is unavailable or overloaded, rather than that the request is wrong."""
+    if isinstance(error, ConnectionError):
+        return True
+    return isinstance(error.status_code, int) and (error.status_code >= 500 or error.status_code == 429)
+
+
+def get_operation(url: str) -> str:
+    """Name of the ES API of the url, e.g. "_search" for /movies/_search."""
+    for part in reversed(url.split('/')):
+        if part.startswith('_'):
+            return part
+    return 'other'
+
+
+class BatchingElasticsearch:
+    """
+    ES client which sends the searches issued within `window` seconds (or `max_size` of them) as one
+    _msearch and hands each caller its own response, or the exception a single search would have raised.
+    The rest of the API goes to the wrapped client as is, as do the searches with url parameters or without
+    an index (point in time).
+
+    The batch is sent out of the context of the requests, each of them gets the time it waited for
+    the response in its "es" phase.
+    """
+
+    def __init__(self, elastic: AsyncElasticsearch, window: float, max_size: int):
+        self.elastic = elastic
+        self.window = window
+        self.max_size = max_size
+        self._pending: list[tuple[str, dict, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def __getattr__(self, name: str):
+        return getattr(self.elastic, name)
+
+    async def search(self, index: Optional[str] = None, body: Optional[dict] = None, **kwargs) -> dict:
+        if not index or kwargs:
+            return await self.elastic.search(index=index, body=body, **kwargs)
+        record_es_query(f'/{index}/_msearch', body)
+        future = asyncio.get_running_loop().create_future()
+        started_at = time.perf_counter()
+        self._pending.append((index, body or {}, future, started_at))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif not self._timer:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        try:
+            return await future
+        finally:
+            record('es', time.perf_counter() - started_at)
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # An empty context: the time of the batch is not added to the request which happened to start it
+            contextvars.Context().run(asyncio.create_task, self._send(batch))
+
+    async def _send(self, batch: list[tuple[str, dict, asyncio.Future, float]]):
+        sent_at = time.perf_counter()
+        for *_, started_at in batch:
+            ELASTIC_MSEARCH_WAIT.observe(sent_at - started_at)
+        ELASTIC_MSEARCH_BATCH_SIZE.observe(len(batch))
+        if len(batch) == 1:
+            (index, body, future, _), = batch
+            try:
+                result = await self.elastic.search(index=index, body=body)
+            except Exception as e:
+                result = e
+            self._resolve(future, result)
+            return
+
+        lines = []
+        for index, body, *_ in batch:
+            lines.extend(({'index': index}, body))
+        try:
+            responses = (await self.elastic.msearch(body=lines))['responses']
+        except Exception as e:
+            responses = [e] * len(batch)
+        for (*_, future, _), response in zip(batch, responses):
+            if isinstance(response, dict) and 'error' in response:
+                response = get_search_error(response)
+                if is_failure(response):
+                    # The _msearch has succeeded, but ES has rejected or failed the search
+                    elastic_breaker.on_failure()
+            self._resolve(future, response)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result):
+        if future.done():
+            # The caller is gone (cancelled)
+            return
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
+def get_search_error(response: dict) -> TransportError:
+    """The exception the search of the _msearch response item would have raised on its own."""
+    status = response.get('status', 'N/A')
+    error = response['error']
+    error_type = error.get('type', 'unknown') if isinstance(error, dict) else str(error)
+    return HTTP_EXCEPTIONS.get(status, TransportError)(status, error_type, response)
@@ -0,0 +1,167 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+from aioredis import Redis
+from loguru import logger
+
+INVALIDATION_CHANNEL = '__redis__:invalidate'
+LISTENER_RETRY_IN_SECONDS = 5
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache in front of Redis (L1).
+
+    Entries are kept for at most `ttl` seconds, so even if an invalidation message is lost
+    a worker does not serve data older than that.
+    """
+
+    def __init__(self, max_items: int, ttl: float):
+        self.max_items = max_items
+        self.ttl = ttl
+        # Bumped on every invalidation. A value read from Redis is put into L1 only if its key was not
+        # invalidated while it was being read, otherwise a stale value could outlive its invalidation.
+        self.version = 0
+        self._items: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        # Versions the keys were last invalidated at. The oldest ones are forgotten beyond max_items,
+        # the reads started before the version of a forgotten key (or of a full invalidation) are outdated.
+        self._invalidated: OrderedDict[str, int] = OrderedDict()
+        self._outdated_before = 0
+        # Writes of this worker to Redis whose invalidation message has not come back yet, by key.
+        # Their messages echo the values the worker has put to L1 itself, which they must not evict.
+        self._own_writes: OrderedDict[str, int] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, version: Optional[int] = None):
+        if version is not None and (
+            version < self._outdated_before or self._invalidated.get(key, version) > version
+        ):
+            return
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def expect_echo(self, keys: Iterable[str]):
+        """Records the writes the worker is about to send to Redis, before it sends them."""
+        for key in keys:
+            self._own_writes[key] = self._own_writes.get(key, 0) + 1
+            self._own_writes.move_to_end(key)
+        while len(self._own_writes) > self.max_items:
+            # Its echo will evict the key, which is safe
+            self._own_writes.popitem(last=False)
+
+    def on_invalidation(self, keys: Iterable[str]):
+        """
+        Applies the invalidation message of Redis. Redis sends the messages in the order of the writes,
+        so as many messages of a key as the worker has written it are its own echo and are skipped.
+        """
+        invalidated = []
+        for key in keys:
+            pending = self._own_writes.pop(key, 0)
+            if pending > 1:
+                self._own_writes[key] = pending - 1
+            elif not pending:
+                invalidated.append(key)
+        if invalidated:
+            self.invalidate(invalidated)
+
+    def invalidate(self, keys: Optional[Iterable[str]] = None):
+        """Drops the given keys or, if they are not specified, the whole cache."""
+        self.version += 1
+        if keys is None:
+            self._items.clear()
+            self._invalidated.clear()
+            self._own_writes.clear()
+            self._outdated_before = self.version
+            return
+        for key in keys:
+            self._items.pop(key, None)
+            self._own_writes.pop(key, None)
+            self._invalidated[key] = self.version
+            self._invalidated.move_to_end(key)
+        while len(self._invalidated) > self.max_items:
+            _, version = self._invalidated.popitem(last=False)
+            self._outdated_before = max(self._outdated_before, version)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+local_cache: Optional[LocalCache] = None
+
+
+async def get_local_cache() -> LocalCache:
+    return local_cache
+
+
+def tracking_prefixes(prefixes: Iterable[str]) -> list[str]:
+    """The prefixes without the ones covered by another, Redis refuses overlapping prefixes."""
+    prefixes = sorted(set(prefixes))
+    return [
+        prefix for index, prefix in enumerate(prefixes)
+        if not any(prefix.startswith(other) for other in prefixes[:index])
+    ]
+
+
+async def listen_invalidations(redis: Redis, cache: LocalCache, prefixes: Iterable[str]):
+    """
+    Keeps L1 coherent with Redis using server-assisted client side caching (Redis 6+).
+
+    Tracking is enabled in the broadcasting mode for the `prefixes` of the keys L1 keeps copies of,
+    and redirected to a dedicated pub/sub connection, so a write of such a key by any worker
+    (or by the ETL) evicts that key from L1 of every worker, except for the echo of the own writes of
+    the worker (see LocalCache.expect_echo). The writes of the other keys (rate limits, locks, tags,
+    statistics) are not broadcast.
+    Whenever the listener (re)connects or fails L1 is dropped, since invalidations may have been missed;
+    until it is back entries are bounded by the L1 ttl only.
+    """
+    while True:
+        pubsub = redis.pubsub()
+        tracker = redis.client()
+        try:
+            await pubsub.execute_command('CLIENT', 'ID')
+            client_id = await pubsub.parse_response(block=True)
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            await tracker.initialize()
+            await tracker.execute_command(
+                'CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id, 'BCAST',
+                *(argument for prefix in tracking_prefixes(prefixes) for argument in ('PREFIX', prefix)),
+                'NOLOOP',
+            )
+            cache.invalidate()
+            logger.info('L1 cache invalidation listener is connected')
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if not message:
+                    continue
+                keys = message['data']
+                if isinstance(keys, list):
+                    cache.on_invalidation(key.decode() if isinstance(key, bytes) else key for key in keys)
+                else:
+                    # An empty message is sent on FLUSHALL/FLUSHDB
+                    cache.invalidate()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f'L1 cache invalidation listener failed: {e}')
+            cache.invalidate()
+            await asyncio.sleep(LISTENER_RETRY_IN_SECONDS)
+        finally:
+            await pubsub.close()
+            if tracker.connection:
+                # The connection goes back to the pool, it must not keep the tracking on
+                await tracker.connection.disconnect()
+            await tracker.close()
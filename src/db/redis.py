@@ -1,9 +1,44 @@
+import time
 from typing import Optional
 
 from aioredis import Redis
+from aioredis.client import Pipeline
+
+from src.core.metrics import REDIS_LATENCY
+from src.core.timing import record
 
 redis: Optional[Redis] = None
 
 
 async def get_redis() -> Redis:
     return redis
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started_at = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            duration = time.perf_counter() - started_at
+            REDIS_LATENCY.labels('PIPELINE').observe(duration)
+            record('redis', duration)
+
+
+class InstrumentedRedis(Redis):
+    """
+    Client which measures the latency of the Redis commands (a pipeline is measured as a whole)
+    and adds it to the "redis" phase of the request.
+    """
+
+    async def execute_command(self, *args, **options):
+        started_at = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            duration = time.perf_counter() - started_at
+            REDIS_LATENCY.labels(args[0]).observe(duration)
+            record('redis', duration)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
@@ -0,0 +1,89 @@
+import fcntl
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Optional
+
+import orjson
+from loguru import logger
+
+SEGMENT_MAGIC = b'SEG1'
+# The magic, the offset and the length of the index (JSON of the offsets and lengths of the entries by key).
+# The data of the entries follows the header, the index goes last.
+SEGMENT_HEADER = struct.Struct('<4sQI')
+
+
+class SharedSegment:
+    """
+    Read-only entries (bytes by key) in shared memory: a file, normally in /dev/shm, which all the workers
+    of the host map. The kernel keeps one copy of it however many workers read it.
+
+    A segment is never changed: it is published anew as a whole and atomically replaces the previous one.
+    A reader maps the new file on its next lookup, the previous one stays valid for the
+    readers still holding it. One worker at a time is the leader (holds the lock of the segment)
+    and is supposed to publish it, the lock is released when the worker dies.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._mapped: Optional[mmap.mmap] = None
+        self._mapped_id: Optional[tuple[int, int]] = None
+        self._index: dict[str, list[int]] = {}
+        self._lock_file = None
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            self._remap()
+        except (OSError, ValueError) as e:
+            logger.warning(f'Failed to map the shared segment {self.path}: {e!r}')
+            return None
+        position = self._index.get(key)
+        if not position:
+            return None
+        offset, length = position
+        return self._mapped[offset:offset + length]
+
+    def publish(self, entries: dict[str, bytes]):
+        index, offset = {}, SEGMENT_HEADER.size
+        for key, value in entries.items():
+            index[key] = [offset, len(value)]
+            offset += len(value)
+        index = orjson.dumps(index)
+        tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, offset, len(index)))
+            for value in entries.values():
+                f.write(value)
+            f.write(index)
+        os.replace(tmp_path, self.path)
+
+    def is_leader(self) -> bool:
+        """Takes the lock of the segment if it is free, the worker keeps it until it exits."""
+        if self._lock_file:
+            return True
+        lock_file = open(self.path.with_name(f'{self.path.name}.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _remap(self):
+        """Maps the segment file again if it has been replaced since it was mapped."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        file_id = (stat.st_ino, stat.st_mtime_ns)
+        if file_id == self._mapped_id:
+            return
+        with open(self.path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_offset, index_length = SEGMENT_HEADER.unpack_from(mapped)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f'Not a shared segment: {magic!r}')
+        self._index = orjson.loads(mapped[index_offset:index_offset + index_length])
+        self._mapped, self._mapped_id = mapped, file_id
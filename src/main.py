@@ -1,15 +1,33 @@
+import asyncio
 import logging
+import math
+from http import HTTPStatus
 
-import aioredis
 import uvicorn as uvicorn
-from elasticsearch import AsyncElasticsearch
-from fastapi import FastAPI
+from elasticsearch import AsyncElasticsearch, TransportError
+from fastapi import FastAPI, Request, Response
 from fastapi.responses import ORJSONResponse
+from loguru import logger
 
 from src.api.v1 import films, genres, persons
+from src.core.admission import RateLimitMiddleware
 from src.core.config import settings
 from src.core.logger import LOGGING
-from src.db import elastic, redis
+from src.core.metrics import MetricsMiddleware, metrics_response
+from src.core.timing import ServerTimingMiddleware
+from src.db import elastic, local_cache, redis
+from src.services.changes import consume_changes
+from src.services.film import FILM_CACHE_NAMESPACE, FILM_GENERATION_KEY, get_film_service
+from src.services.genre import GENRE_CACHE_NAMESPACE, GENRE_GENERATION_KEY, get_genre_service
+from src.services.pagination import ExpiredCursorError, InvalidCursorError, InvalidSortError
+from src.services.person import PERSON_CACHE_NAMESPACE, PERSON_GENERATION_KEY, get_person_service
+from src.services.warmup import query_stats, warm_up
+
+# Keys of Redis which L1 keeps copies of: the entries of the services and the generations of the indices
+L1_KEY_PREFIXES = (
+    f'{FILM_CACHE_NAMESPACE}:', f'{GENRE_CACHE_NAMESPACE}:', f'{PERSON_CACHE_NAMESPACE}:',
+    FILM_GENERATION_KEY, GENRE_GENERATION_KEY, PERSON_GENERATION_KEY,
+)
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -21,16 +39,124 @@ app = FastAPI(
 
 @app.on_event('startup')
 async def startup():
-    redis.redis = await aioredis.from_url(f'redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}')
-    elastic.es = AsyncElasticsearch(hosts=[f'http://{settings.ELASTIC_HOST}:{settings.ELASTIC_PORT}'])
+    redis.redis = redis.InstrumentedRedis.from_url(f'redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}')
+    elastic.es = AsyncElasticsearch(
+        hosts=[f'http://{settings.ELASTIC_HOST}:{settings.ELASTIC_PORT}'],
+        transport_class=elastic.InstrumentedTransport,
+        timeout=settings.ELASTIC_TIMEOUT_IN_SECONDS,
+    )
+    if settings.ELASTIC_MSEARCH_WINDOW_IN_MS:
+        elastic.es = elastic.BatchingElasticsearch(
+            elastic.es, settings.ELASTIC_MSEARCH_WINDOW_IN_MS / 1000, settings.ELASTIC_MSEARCH_MAX_SIZE,
+        )
+    local_cache.local_cache = local_cache.LocalCache(
+        max_items=settings.CACHE_L1_MAX_ITEMS, ttl=settings.CACHE_L1_TTL_IN_SECONDS,
+    )
+    if settings.CACHE_L1_MAX_ITEMS:
+        app.state.invalidation_listener = asyncio.create_task(
+            local_cache.listen_invalidations(redis.redis, local_cache.local_cache, L1_KEY_PREFIXES),
+        )
+    # Keyword arguments, as FastAPI passes them, so that the same (lru cached) instances are used
+    services = dict(redis=redis.redis, elastic=elastic.es, local_cache=local_cache.local_cache)
+    film_service = get_film_service(**services)
+    genre_service = get_genre_service(**services)
+    person_service = get_person_service(**services)
+    app.state.changes_consumer = asyncio.create_task(consume_changes(redis.redis, {
+        'movies': film_service.invalidate,
+        'genres': genre_service.invalidate,
+        'persons': person_service.invalidate,
+    }))
+    app.state.query_stats_flusher = asyncio.create_task(query_stats.run(redis.redis))
+    app.state.snapshot_loaders = [
+        asyncio.create_task(service.snapshot.run())
+        for service in (genre_service, person_service) if service.snapshot.max_items
+    ]
+    app.state.ready = not settings.WARMUP_ENABLED
+    if settings.WARMUP_ENABLED:
+        app.state.warmer = asyncio.create_task(
+            run_warm_up({'films': film_service, 'genres': genre_service, 'persons': person_service}),
+        )
+
+
+async def run_warm_up(services: dict):
+    try:
+        await asyncio.wait_for(
+            warm_up(redis.redis, elastic.es, services), timeout=settings.WARMUP_TIMEOUT_IN_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f'The cache warm-up took over {settings.WARMUP_TIMEOUT_IN_SECONDS}s, it is stopped')
+    except Exception as e:
+        logger.warning(f'The cache warm-up failed: {e!r}')
+    finally:
+        # A cold cache is better than no traffic at all
+        app.state.ready = True
+
+
+@app.get('/ready', include_in_schema=False)
+async def ready() -> Response:
+    """Readiness probe for the load balancer: 503 until the cache is warmed up."""
+    if not app.state.ready:
+        return ORJSONResponse(status_code=HTTPStatus.SERVICE_UNAVAILABLE, content={'status': 'warming up'})
+    return ORJSONResponse(content={'status': 'ready'})
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics() -> Response:
+    return metrics_response()
+
+
+@app.exception_handler(ExpiredCursorError)
+async def expired_cursor_handler(request: Request, exc: ExpiredCursorError):
+    return ORJSONResponse(status_code=HTTPStatus.GONE, content={'detail': str(exc)})
+
+
+@app.exception_handler(InvalidCursorError)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursorError):
+    return ORJSONResponse(status_code=HTTPStatus.BAD_REQUEST, content={'detail': str(exc)})
+
+
+@app.exception_handler(InvalidSortError)
+async def invalid_sort_handler(request: Request, exc: InvalidSortError):
+    return ORJSONResponse(status_code=HTTPStatus.UNPROCESSABLE_ENTITY, content={'detail': str(exc)})
+
+
+@app.exception_handler(TransportError)
+async def elastic_unavailable_handler(request: Request, exc: TransportError):
+    """
+    ES is down, slow, overloaded (5xx or 429) or its circuit breaker is open, and the response
+    is not in the cache. The other errors of ES are the errors of the server.
+    """
+    if not elastic.is_failure(exc):
+        raise exc
+    return ORJSONResponse(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        content={'detail': 'The search is temporarily unavailable'},
+        headers={'Retry-After': str(math.ceil(settings.ELASTIC_BREAKER_RESET_TIMEOUT_IN_SECONDS))},
+    )
 
 
 @app.on_event('shutdown')
 async def shutdown():
+    if getattr(app.state, 'invalidation_listener', None):
+        app.state.invalidation_listener.cancel()
+    app.state.changes_consumer.cancel()
+    app.state.query_stats_flusher.cancel()
+    for loader in app.state.snapshot_loaders:
+        loader.cancel()
+    if getattr(app.state, 'warmer', None):
+        app.state.warmer.cancel()
+    try:
+        await query_stats.flush(redis.redis)
+    except Exception as e:
+        logger.warning(f'Failed to flush the query stats: {e!r}')
     await redis.redis.close()
     await elastic.es.close()
 
 
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, fastapi_app=app, get_redis=lambda: redis.redis)
+app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(MetricsMiddleware, fastapi_app=app)
 app.include_router(films.router, prefix='/api/v1/films', tags=['films'])
 app.include_router(genres.router, prefix='/api/v1/genres', tags=['genres'])
 app.include_router(persons.router, prefix='/api/v1/persons', tags=['persons'])
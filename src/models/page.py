@@ -0,0 +1,18 @@
+from typing import Generic, Optional, TypeVar
+
+from pydantic.generics import GenericModel
+
+from src.models.mixins import OrjsonConfigMixin
+
+ItemT = TypeVar('ItemT')
+
+
+class Page(GenericModel, OrjsonConfigMixin, Generic[ItemT]):
+    items: list[ItemT] = []
+    next_cursor: Optional[str] = None
+
+
+class Total(OrjsonConfigMixin):
+    """Number of the items of a list. A bounded count is a lower bound, its relation is "gte"."""
+    value: int
+    relation: str = 'eq'
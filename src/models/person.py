@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import Field
 
 from src.models.mixins import OrjsonConfigMixin, UUIDMixin
@@ -5,3 +7,15 @@ from src.models.mixins import OrjsonConfigMixin, UUIDMixin
 
 class Person(UUIDMixin, OrjsonConfigMixin):
     full_name: str = Field(alias='name')
+
+
+class PersonFilm(UUIDMixin, OrjsonConfigMixin):
+    title: str
+    imdb_rating: Optional[float] = None
+    roles: list[str] = []
+
+
+class PersonFilmography(UUIDMixin, OrjsonConfigMixin):
+    """Document of the persons index: the person with the films they took part in, denormalized by the ETL."""
+    full_name: str
+    films: list[PersonFilm] = []
@@ -0,0 +1,118 @@
+"""
+Production entry point: SERVER_WORKERS uvicorn workers on uvloop (one per CPU core by default).
+
+The app is imported once and the workers are forked from this process, so they share its memory
+until they write to it. Each worker listens on its own socket bound to the same port with SO_REUSEPORT,
+the kernel balances the connections between them. The connections to Redis and ES are opened
+by each worker on the startup of the app, that is after the fork.
+
+A worker which dies is started again, SIGTERM or SIGINT stops all of them gracefully.
+
+Usage: python -m src.server
+"""
+import os
+import signal
+import socket
+import tempfile
+import time
+
+import uvicorn
+from loguru import logger
+
+from src.core.config import settings
+from src.core.logger import LOGGING
+
+# Backlog of the listening socket of each worker
+BACKLOG = 2048
+# Pause before a dead worker is started again, so that a crashing one does not spin
+RESTART_DELAY_IN_SECONDS = 1
+
+
+def create_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def run_worker(app):
+    """Serves the app in the forked process, until it is signalled to stop."""
+    # The handlers of the supervisor, uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(app, loop='uvloop', log_config=LOGGING, backlog=BACKLOG)
+    uvicorn.Server(config).run(sockets=[create_socket(settings.SERVER_HOST, settings.SERVER_PORT)])
+
+
+class Supervisor:
+    def __init__(self, app, workers: int):
+        self.app = app
+        self.workers = workers
+        self.children: dict[int, int] = {}
+        self.stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info(f'Starting {self.workers} workers on {settings.SERVER_HOST}:{settings.SERVER_PORT}')
+        for number in range(self.workers):
+            self.spawn(number)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            number = self.children.pop(pid, None)
+            if number is None:
+                continue
+            mark_process_dead(pid)
+            if not self.stopping:
+                logger.warning(f'Worker {number} (pid {pid}) exited with status {status}, starting it again')
+                time.sleep(RESTART_DELAY_IN_SECONDS)
+                if not self.stopping:
+                    self.spawn(number)
+        logger.info('All the workers have stopped')
+
+    def spawn(self, number: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app)
+            except BaseException as e:
+                logger.exception(f'Worker {number} failed: {e!r}')
+                code = 1
+            finally:
+                # The worker never returns to the loop of the supervisor
+                os._exit(code)
+        self.children[pid] = number
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def mark_process_dead(pid: int):
+    """Drops the live gauges of the dead worker from the metrics of the host."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(pid)
+
+
+def main():
+    workers = settings.SERVER_WORKERS or os.cpu_count() or 1
+    # The metrics of all the workers are merged from this directory (see metrics_response). It is read
+    # when prometheus_client is imported, so it is set before the app is.
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='prometheus-'))
+    # Fails right away if the address is taken, rather than in every worker
+    create_socket(settings.SERVER_HOST, settings.SERVER_PORT).close()
+    from src.main import app
+    Supervisor(app, workers).run()
+
+
+if __name__ == '__main__':
+    main()
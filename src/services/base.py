@@ -0,0 +1,288 @@
+import time
+from functools import partial
+from typing import Generic, Optional, Type, TypeVar
+
+from aioredis import Redis
+from elasticsearch import AsyncElasticsearch, NotFoundError
+from loguru import logger
+from pydantic import BaseModel
+
+from src.core.config import settings
+from src.db.local_cache import LocalCache
+from src.models.page import Page, Total
+from src.models.utils import partial_model
+from src.services.cache import Cache, CachedResponse
+from src.services.changes import generation_key
+from src.services.pagination import count_hits, reads_point_in_time, search_page, total_headers
+from src.services.snapshot import SnapshotStore
+from src.services.suggest import normalize_prefix, suggest
+from src.services.utils import (canonical_params, entity_key, filter_params, list_key, parse_document,
+                                source_includes)
+from src.services.warmup import query_stats
+
+ModelT = TypeVar('ModelT', bound=BaseModel)
+
+
+class BaseService(Generic[ModelT]):
+    """
+    Documents of an ES index served through the cache: the lists, the documents by id, the counts
+    and the suggestions, as models or as ready JSON responses, and the invalidation of the changed documents.
+
+    A service defines the index, the model of its documents, the namespace of its cache entries and the field
+    searched by the query. The one with a snapshot (see SnapshotStore) serves the requests from it
+    when it can.
+    """
+
+    index: str
+    model: Type[ModelT]
+    namespace: str
+    search_field: str
+    # Name of a document in the logs
+    entity_name: str
+    cache_ttl: int
+
+    def __init__(self, redis: Redis, elastic: AsyncElasticsearch, local_cache: LocalCache):
+        self.redis = redis
+        self.elastic = elastic
+        self.generation_key = generation_key(self.index)
+        self.cache = Cache(redis, local_cache, self.cache_ttl, self.namespace)
+        self.count_cache = Cache(redis, local_cache, settings.CACHE_COUNT_TTL_IN_SECONDS, self.namespace)
+        self.snapshot: Optional[SnapshotStore] = None
+
+    async def all(self, **kwargs) -> Page[ModelT]:
+        params = canonical_params(**kwargs)
+        if reads_point_in_time(**params):
+            ids = await self._get_ids_from_elastic(**params)
+        else:
+            ids = await self.cache.get_or_load(
+                list_key(await self.cache.get_generation(self.generation_key), **params),
+                Page[str],
+                partial(self._get_ids_from_elastic, **params),
+            )
+        if not ids:
+            return Page[self.model]()
+        items = await self.get_by_ids(ids.items, params.get('fields'))
+        return Page[self.model].construct(items=[item for item in items if item], next_cursor=ids.next_cursor)
+
+    async def count(self, **kwargs) -> Total:
+        """
+        Returns the number of the documents matching the filters of the list, up to ELASTIC_TRACK_TOTAL_HITS.
+        It is cached by the filters only, so the pages of one list share it, and longer than the pages.
+        """
+        filters = filter_params(**kwargs)
+        generation = await self.cache.get_generation(self.generation_key)
+        return await self.count_cache.get_or_load(
+            f'count:{list_key(generation, **filters)}',
+            Total,
+            partial(self._count_in_elastic, **filters),
+        )
+
+    async def get_by_id(self, item_id: str, fields: Optional[tuple[str, ...]] = None) -> Optional[ModelT]:
+        """Returns the document, or only its `fields` if they are specified."""
+        return await self.cache.get_or_load(
+            entity_key(item_id, fields),
+            partial_model(self.model, fields),
+            partial(self._get_from_elastic, item_id, fields),
+            tags=[item_id],
+        )
+
+    async def all_response(self, response_model: Type[BaseModel], **kwargs) -> CachedResponse:
+        """Returns the ready JSON list of `response_model` items, cached as bytes."""
+        params = canonical_params(**kwargs)
+        query_stats.record(self.namespace, params)
+        if self.snapshot:
+            response = self.snapshot.render_all(response_model, **params)
+            if response:
+                return response
+        if reads_point_in_time(**params):
+            return await self._render_all(response_model, **params)
+        generation = await self.cache.get_generation(self.generation_key)
+        return await self.cache.get_or_render(
+            list_key(generation, response=response_model.__name__, **params),
+            partial(self._render_all, response_model, **params),
+        )
+
+    async def get_response_by_id(self, item_id: str, response_model: Type[BaseModel],
+                                 fields: Optional[tuple[str, ...]] = None) -> Optional[CachedResponse]:
+        """Returns the ready JSON of the document as `response_model`, cached as bytes."""
+        if self.snapshot:
+            response = self.snapshot.render_by_id(item_id, response_model)
+            if response:
+                return response
+        return await self.cache.get_or_render(
+            f'{entity_key(item_id)}:response:{response_model.__name__}',
+            partial(self._render_by_id, item_id, response_model, fields),
+            tags=[item_id],
+        )
+
+    async def suggest_response(self, response_model: Type[BaseModel], prefix: str,
+                               size: int) -> CachedResponse:
+        """
+        Returns the ready JSON list of the documents with a word of the search field
+        starting with the prefix.
+        """
+        prefix = normalize_prefix(prefix)
+        if not prefix:
+            return CachedResponse(body=b'[]')
+        if self.snapshot:
+            response = self.snapshot.render_suggestions(response_model, prefix, size)
+            if response:
+                return response
+        generation = await self.cache.get_generation(self.generation_key)
+        return await self.cache.get_or_render(
+            f'suggest:v{generation}:{size}:{prefix}',
+            partial(self._render_suggestions, response_model, prefix, size),
+            ttl=settings.CACHE_SUGGEST_TTL_IN_SECONDS,
+        )
+
+    async def get_by_ids(self, ids: list[str],
+                         fields: Optional[tuple[str, ...]] = None) -> list[Optional[ModelT]]:
+        """Returns the documents in the order of the ids, None stands for the one which was not found."""
+        keys = {entity_key(item_id, fields): item_id for item_id in ids}
+        cached = await self.cache.get_many(
+            list(keys),
+            partial_model(self.model, fields),
+            lambda key: self._get_from_elastic(keys[key], fields),
+            tags={key: [item_id] for key, item_id in keys.items()},
+        )
+        items = {keys[key]: item for key, item in cached.items()}
+        missed_ids = [item_id for item_id in dict.fromkeys(ids) if item_id not in items]
+        if missed_ids:
+            started_at = time.monotonic()
+            found = await self._get_from_elastic_by_ids(missed_ids, fields)
+            if found:
+                await self.cache.set_many(
+                    {entity_key(item.uuid, fields): item for item in found},
+                    delta=time.monotonic() - started_at,
+                    tags={entity_key(item.uuid, fields): [item.uuid] for item in found},
+                )
+                items.update((item.uuid, item) for item in found)
+        return [items.get(item_id) for item_id in ids]
+
+    async def invalidate(self, ids: list[str]):
+        """
+        Drops everything cached about the changed documents.
+        The lists are outdated by the new generation of the index, which the ETL bumps.
+        The documents which were cached as a whole are reloaded at once, since they are likely to be
+        requested.
+        """
+        keys = await self.cache.invalidate(ids)
+        cached_ids = [item_id for item_id in ids if entity_key(item_id) in keys]
+        if not cached_ids:
+            return
+        started_at = time.monotonic()
+        items = await self._get_from_elastic_by_ids(cached_ids)
+        await self.cache.set_many(
+            {item.uuid: item for item in items},
+            delta=time.monotonic() - started_at,
+            tags={item.uuid: [item.uuid] for item in items},
+        )
+
+    async def _render_all(self, response_model: Type[BaseModel], with_total: bool = False,
+                          **kwargs) -> CachedResponse:
+        page = await self.all(**kwargs)
+        response = CachedResponse.from_page(page, response_model)
+        if with_total:
+            response.headers.update(total_headers(await self.count(**kwargs), page.next_cursor, **kwargs))
+        return response
+
+    async def _render_by_id(self, item_id: str, response_model: Type[BaseModel],
+                            fields: Optional[tuple[str, ...]]) -> Optional[CachedResponse]:
+        item = await self.get_by_id(item_id, fields)
+        if not item:
+            return None
+        return CachedResponse.from_item(item, response_model)
+
+    async def _render_suggestions(self, response_model: Type[BaseModel], prefix: str,
+                                  size: int) -> CachedResponse:
+        model = partial_model(self.model, ('uuid', self.search_field))
+        docs = await suggest(self.elastic, self.index, self.search_field, prefix, size)
+        items = [parse_document(model, doc) for doc in docs]
+        return CachedResponse.from_page(Page[model].construct(items=items), response_model)
+
+    @classmethod
+    def _make_from_es_doc(cls, doc: dict, model: Type[ModelT]) -> ModelT:
+        return parse_document(model, dict(doc['_source'], id=doc['_id']))
+
+    async def _get_from_elastic(self, item_id: str,
+                                fields: Optional[tuple[str, ...]] = None) -> Optional[ModelT]:
+        try:
+            doc = await self.elastic.get(
+                index=self.index, id=item_id, _source_includes=source_includes(self.model, fields),
+            )
+        except NotFoundError:
+            logger.debug(f'An error occurred while trying to find {self.entity_name} in ES (id: {item_id})')
+            return None
+        return self._make_from_es_doc(doc, partial_model(self.model, fields))
+
+    async def _get_from_elastic_by_ids(self, ids: list[str],
+                                       fields: Optional[tuple[str, ...]] = None) -> list[ModelT]:
+        try:
+            docs = await self.elastic.mget(
+                index=self.index, body={'ids': ids}, _source_includes=source_includes(self.model, fields),
+            )
+        except NotFoundError:
+            logger.debug(f'An error occurred while trying to get {self.namespace} by ids in ES')
+            return []
+        model = partial_model(self.model, fields)
+        return [self._make_from_es_doc(doc, model) for doc in docs['docs'] if doc.get('found')]
+
+    def _search_body(self, genre: Optional[str], query: Optional[str]) -> Optional[dict]:
+        """The query of the documents matching the filters of a list, None for all of them."""
+        body = None
+        if genre:
+            body = {
+                'query': {
+                    'query_string': {
+                        'default_field': 'genre',
+                        'query': genre
+                    }
+                }
+            }
+        if query:
+            body = {
+                'query': {
+                    'match': {
+                        self.search_field: {
+                            'query': query,
+                            'fuzziness': 1,
+                            'operator': 'and'
+                        }
+                    }
+                }
+            }
+        return body
+
+    async def _count_in_elastic(self, **kwargs) -> Total:
+        try:
+            return await count_hits(
+                self.elastic, self.index, self._search_body(kwargs.get('genre'), kwargs.get('query')),
+            )
+        except NotFoundError:
+            logger.debug(f'An error occurred while trying to count {self.namespace} in ES')
+            return Total(value=0)
+
+    async def _get_ids_from_elastic(self, **kwargs) -> Optional[Page[str]]:
+        """
+        Searches the documents and returns the page of their ids.
+        The found documents are put to the cache, so a list is cached as ids and the documents only once.
+        """
+        fields = kwargs.get('fields', None)
+        body = self._search_body(kwargs.get('genre'), kwargs.get('query'))
+        if fields:
+            body = dict(body or {}, _source=source_includes(self.model, fields))
+        try:
+            hits, next_cursor = await search_page(self.elastic, self.index, body, **kwargs)
+        except NotFoundError:
+            logger.debug(f'An error occurred while trying to get {self.namespace} in ES')
+            return None
+
+        if not hits:
+            return None
+        model = partial_model(self.model, fields)
+        items = [self._make_from_es_doc(doc, model) for doc in hits]
+        await self.cache.set_many(
+            {entity_key(item.uuid, fields): item for item in items},
+            tags={entity_key(item.uuid, fields): [item.uuid] for item in items},
+        )
+        return Page[str](items=[item.uuid for item in items], next_cursor=next_cursor)
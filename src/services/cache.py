@@ -0,0 +1,383 @@
+import hashlib
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable, Iterable, Optional, Set, Type
+
+import orjson
+from aioredis import Redis
+from aioredis.client import Pipeline
+from elasticsearch import TransportError
+from fastapi import Response
+from loguru import logger
+from pydantic import BaseModel
+
+from src.core.config import settings
+from src.core.metrics import CACHE_REQUESTS
+from src.core.timing import timed
+from src.db.elastic import elastic_breaker, is_failure
+from src.db.local_cache import LocalCache
+from src.models.page import Page
+from src.services.codec import Codec, CodecError, decode, get_codec
+from src.services.pagination import NEXT_CURSOR_HEADER
+from src.services.single_flight import SingleFlight
+
+HEADER_SEPARATOR = b'\n'
+ETAG_HEADER = 'ETag'
+L1_HIT = 'l1_hit'
+REDIS_HIT = 'redis_hit'
+MISS = 'miss'
+ERROR = 'error'
+# An expired entry served while ES is unavailable
+DEGRADED = 'degraded'
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    # Time (unix) when the entry becomes stale. It is still served for CACHE_STALE_TTL_IN_SECONDS,
+    # but every request for a stale entry starts its refresh.
+    expires_at: float
+    # How long it took to get the value from the source, used to start the refresh in advance
+    delta: float
+
+    def should_refresh(self) -> bool:
+        """
+        Probabilistic early refresh (XFetch): the closer the entry is to its expiry and the longer its
+        recomputation takes, the more likely a request refreshes it, so hot keys are refreshed
+        by a single request before they actually go stale.
+        """
+        gap = -self.delta * settings.CACHE_XFETCH_BETA * math.log(1.0 - random.random())
+        return time.time() + gap >= self.expires_at
+
+    def is_expired(self) -> bool:
+        """Whether the stale period is over, then Redis keeps it CACHE_DEGRADED_TTL_IN_SECONDS longer."""
+        return time.time() >= self.expires_at + settings.CACHE_STALE_TTL_IN_SECONDS
+
+
+@dataclass
+class CachedResponse:
+    """
+    Final JSON body of an endpoint with its headers, served as is on a cache hit.
+    The strong ETag of the body is computed once, when the response is rendered, and cached in its headers.
+    """
+    body: bytes
+    headers: dict[str, str] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if ETAG_HEADER not in self.headers:
+            self.headers[ETAG_HEADER] = f'"{hashlib.blake2b(self.body, digest_size=16).hexdigest()}"'
+
+    @classmethod
+    def from_item(cls, item: BaseModel, response_model: Type[BaseModel]) -> 'CachedResponse':
+        with timed('render'):
+            body = orjson.dumps(response_model.parse_obj(item.dict(by_alias=True)).dict(by_alias=True))
+        return cls(body=body)
+
+    @classmethod
+    def from_page(cls, page: Page, response_model: Type[BaseModel]) -> 'CachedResponse':
+        with timed('render'):
+            body = orjson.dumps([
+                response_model.parse_obj(item.dict(by_alias=True)).dict(by_alias=True) for item in page.items
+            ])
+        headers = {NEXT_CURSOR_HEADER: page.next_cursor} if page.next_cursor else {}
+        return cls(body=body, headers=headers)
+
+    def to_response(self, if_none_match: Optional[str] = None, max_age: int = 0) -> Response:
+        """
+        The response to send, 304 without the body if the client already has it (its If-None-Match
+        has the ETag). `max_age` is the Cache-Control max-age for the clients and CDNs.
+        """
+        headers = self.headers
+        if max_age:
+            headers = dict(headers, **{'Cache-Control': f'public, max-age={max_age}'})
+        if if_none_match and etag_matches(if_none_match, self.headers[ETAG_HEADER]):
+            return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+        return Response(content=self.body, media_type='application/json', headers=headers)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether the If-None-Match header matches the ETag, the comparison is weak as RFC 7232 requires."""
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+class Cache:
+    """
+    Cache-aside storage of pydantic models in Redis with the in-process LRU (L1) in front of it.
+
+    Each entry has a soft ttl, after which it is stale, and a hard one (soft ttl +
+    CACHE_STALE_TTL_IN_SECONDS), after which it expires. A stale entry is served immediately
+    while one background task refreshes it. An expired entry is loaded anew, unless ES is unavailable
+    (its circuit breaker is open, the load fails to connect or gets a 5xx or 429): then it is served
+    (degraded) until Redis drops it CACHE_DEGRADED_TTL_IN_SECONDS later.
+
+    An entry may be tagged (e.g. with the ids of the entities it contains), so that all the entries of a tag
+    are dropped at once when the data behind them changes. A tag is a Redis set of the keys.
+
+    The keys (and tags) of the methods are relative to the namespace of the cache, e.g. "films".
+    The entries are encoded by the `codec`, by default by the one configured in the settings.
+    """
+
+    def __init__(self, redis: Redis, local_cache: LocalCache, ttl: int, namespace: str,
+                 codec: Optional[Codec] = None):
+        self.redis = redis
+        self.local_cache = local_cache
+        self.ttl = ttl
+        self.namespace = namespace
+        self.codec = codec or get_codec()
+        # The counters are bound to their labels once, so that counting a lookup is cheap
+        self._entry_lookups = {
+            result: CACHE_REQUESTS.labels(namespace, 'entry', result)
+            for result in (L1_HIT, REDIS_HIT, MISS, ERROR, DEGRADED)
+        }
+        self._response_lookups = {
+            result: CACHE_REQUESTS.labels(namespace, 'response', result)
+            for result in (L1_HIT, REDIS_HIT, MISS, ERROR)
+        }
+        self.single_flight = SingleFlight(redis)
+        self.entry_ttl = ttl + settings.CACHE_STALE_TTL_IN_SECONDS + settings.CACHE_DEGRADED_TTL_IN_SECONDS
+        # A tag lives as long as the longest of its entries
+        self.tag_ttl = max(self.entry_ttl, settings.CACHE_RESPONSE_TTL_IN_SECONDS)
+
+    async def get_or_load(self, key: str, model: Type[BaseModel],
+                          load: Callable[[], Awaitable[Optional[BaseModel]]],
+                          tags: Iterable[str] = ()) -> Optional[BaseModel]:
+        """
+        Returns the value from the cache, loading it with `load` on a miss.
+        Concurrent misses of the key share one load, a value loaded as None is not cached.
+        """
+        entry = await self.get(key, model)
+        if entry and self._usable(entry):
+            if entry.should_refresh() and elastic_breaker.available():
+                self.single_flight.refresh(self._key(key), lambda: self._load(key, load, tags))
+            return entry.value
+
+        try:
+            return await self.single_flight.do(
+                self._key(key),
+                lambda: self._load(key, load, tags),
+                lambda: self._value(key, model),
+            )
+        except TransportError as e:
+            if not entry or not is_failure(e):
+                raise
+            logger.warning(f'ES is unavailable, the expired entry is served (key: {self._key(key)}): {e}')
+            self._entry_lookups[DEGRADED].inc()
+            return entry.value
+
+    async def get(self, key: str, model: Type[BaseModel]) -> Optional[CacheEntry]:
+        entry, result = await self._read(key, model)
+        self._entry_lookups[result].inc()
+        return entry
+
+    async def get_many(self, keys: list[str], model: Type[BaseModel],
+                       load: Callable[[str], Awaitable[Optional[BaseModel]]],
+                       tags: Optional[dict[str, Iterable[str]]] = None) -> dict[str, BaseModel]:
+        """
+        Returns the cached values of the keys with one MGET for those missing in L1.
+        The entries to be refreshed are refreshed in the background one by one with `load(key)`.
+        """
+        entries = {}
+        for key in keys:
+            entry = self.local_cache.get(self._key(key))
+            if entry:
+                entries[key] = entry
+        self._entry_lookups[L1_HIT].inc(len(entries))
+
+        missed_keys = [key for key in dict.fromkeys(keys) if key not in entries]
+        if missed_keys:
+            version = self.local_cache.version
+            for key, data in zip(missed_keys, await self.redis.mget([self._key(key) for key in missed_keys])):
+                entry = self._unpack(key, data, model) if data else None
+                self._entry_lookups[REDIS_HIT if entry else ERROR if data else MISS].inc()
+                if entry:
+                    self.local_cache.set(self._key(key), entry, version)
+                    entries[key] = entry
+
+        # The expired entries are missing for the caller, unless ES is unavailable to load them
+        entries = {key: entry for key, entry in entries.items() if self._usable(entry)}
+        refresh = elastic_breaker.available()
+        for key, entry in entries.items():
+            if refresh and entry.should_refresh():
+                self.single_flight.refresh(
+                    self._key(key),
+                    lambda key=key: self._load(key, lambda: load(key), (tags or {}).get(key, ())),
+                )
+        return {key: entry.value for key, entry in entries.items()}
+
+    async def get_or_render(
+        self, key: str, render: Callable[[], Awaitable[Optional[CachedResponse]]], tags: Iterable[str] = (),
+        ttl: Optional[int] = None,
+    ) -> Optional[CachedResponse]:
+        """
+        Returns the cached response, rendering it with `render` on a miss.
+        The responses are kept for `ttl` or CACHE_RESPONSE_TTL_IN_SECONDS only, since they copy
+        the cached entities.
+        """
+        key = self._key(key)
+        response = self.local_cache.get(key)
+        if response:
+            self._response_lookups[L1_HIT].inc()
+            return response
+
+        version = self.local_cache.version
+        data = await self.redis.get(key)
+        response = self._unpack_response(key, data) if data else None
+        self._response_lookups[REDIS_HIT if response else ERROR if data else MISS].inc()
+        if response:
+            self.local_cache.set(key, response, version)
+            return response
+
+        response = await render()
+        if response:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.set(key, self._pack_response(response), ex=ttl or settings.CACHE_RESPONSE_TTL_IN_SECONDS)
+                self._tag(pipe, key, tags)
+                version = await self._write(pipe, [key])
+            self.local_cache.set(key, response, version)
+        return response
+
+    async def set(self, key: str, value: BaseModel, delta: float = 0, tags: Iterable[str] = ()):
+        await self.set_many({key: value}, delta, {key: tags})
+
+    async def set_many(self, values: dict[str, BaseModel], delta: float = 0,
+                       tags: Optional[dict[str, Iterable[str]]] = None):
+        """Puts the values to the cache, `tags` maps a key to the tags of its entry."""
+        entries = {
+            key: CacheEntry(value=value, expires_at=time.time() + self.ttl, delta=delta)
+            for key, value in values.items()
+        }
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, entry in entries.items():
+                pipe.set(self._key(key), self._pack(entry), ex=self.entry_ttl)
+                self._tag(pipe, self._key(key), (tags or {}).get(key, ()))
+            version = await self._write(pipe, [self._key(key) for key in entries])
+        for key, entry in entries.items():
+            self.local_cache.set(self._key(key), entry, version)
+
+    async def invalidate(self, tags: Iterable[str]) -> Set[str]:
+        """Drops the entries of the tags and returns their keys."""
+        tag_keys = [self._tag_key(tag) for tag in tags]
+        if not tag_keys:
+            return set()
+        # Atomically, so that an entry tagged meanwhile is not untagged without being dropped
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for tag_key in tag_keys:
+                pipe.smembers(tag_key)
+            pipe.delete(*tag_keys)
+            *members, _ = await pipe.execute()
+        keys = {key.decode() for tag_members in members for key in tag_members}
+        if keys:
+            await self.redis.delete(*keys)
+        # Other workers drop them from L1 on the invalidation message of Redis
+        self.local_cache.invalidate(keys)
+        return {key[len(self.namespace) + 1:] for key in keys}
+
+    async def get_generation(self, key: str) -> int:
+        """
+        Returns the generation counter stored in Redis under the (absolute) key.
+        It is kept in L1, which is refreshed on the invalidation message of Redis when the counter is bumped.
+        """
+        generation = self.local_cache.get(key)
+        if generation is None:
+            version = self.local_cache.version
+            generation = int(await self.redis.get(key) or 0)
+            self.local_cache.set(key, generation, version)
+        return generation
+
+    async def _write(self, pipe: Pipeline, keys: list[str]) -> int:
+        """
+        Executes the pipeline which writes the keys, returns the version of L1 to put them there with:
+        the invalidation messages of these writes are not to evict them (see LocalCache.expect_echo),
+        the ones of the writes by others after them are.
+        """
+        version = self.local_cache.version
+        self.local_cache.expect_echo(keys)
+        try:
+            await pipe.execute()
+        except Exception:
+            # Whatever has been written, its message just evicts the key
+            self.local_cache.invalidate(keys)
+            raise
+        return version
+
+    def _key(self, key: str) -> str:
+        return f'{self.namespace}:{key}'
+
+    def _tag_key(self, tag: str) -> str:
+        return f'tag:{self.namespace}:{tag}'
+
+    def _tag(self, pipe: Pipeline, key: str, tags: Iterable[str]):
+        for tag in tags:
+            pipe.sadd(self._tag_key(tag), key)
+            pipe.expire(self._tag_key(tag), self.tag_ttl)
+
+    async def _load(self, key: str, load: Callable[[], Awaitable[Optional[BaseModel]]],
+                    tags: Iterable[str] = ()) -> Optional[BaseModel]:
+        started_at = time.monotonic()
+        value = await load()
+        if value is not None:
+            await self.set(key, value, delta=time.monotonic() - started_at, tags=tags)
+        return value
+
+    async def _read(self, key: str, model: Type[BaseModel]) -> tuple[Optional[CacheEntry], str]:
+        """Returns the entry with the result of the lookup."""
+        key = self._key(key)
+        entry = self.local_cache.get(key)
+        if entry:
+            return entry, L1_HIT
+
+        version = self.local_cache.version
+        data = await self.redis.get(key)
+        if not data:
+            logger.debug(f'The value was not found in the cache (key: {key})')
+            return None, MISS
+
+        entry = self._unpack(key, data, model)
+        if not entry:
+            return None, ERROR
+        self.local_cache.set(key, entry, version)
+        return entry, REDIS_HIT
+
+    async def _value(self, key: str, model: Type[BaseModel]) -> Optional[BaseModel]:
+        entry, _ = await self._read(key, model)
+        return entry.value if entry and not entry.is_expired() else None
+
+    def _usable(self, entry: CacheEntry) -> bool:
+        """Whether the entry may be served, an expired one only while ES is unavailable."""
+        if not entry.is_expired():
+            return True
+        if elastic_breaker.available():
+            return False
+        self._entry_lookups[DEGRADED].inc()
+        return True
+
+    def _pack(self, entry: CacheEntry) -> bytes:
+        return self.codec.encode([entry.expires_at, entry.delta], entry.value)
+
+    @staticmethod
+    def _unpack(key: str, data: bytes, model: Type[BaseModel]) -> Optional[CacheEntry]:
+        try:
+            with timed('decode'):
+                (expires_at, delta), value = decode(data, model)
+            return CacheEntry(value=value, expires_at=expires_at, delta=delta)
+        except CodecError as e:
+            logger.error(f'Failed to decode the cache entry (key: {key}): {e}')
+            return None
+
+    @staticmethod
+    def _pack_response(response: CachedResponse) -> bytes:
+        return orjson.dumps(response.headers) + HEADER_SEPARATOR + response.body
+
+    @staticmethod
+    def _unpack_response(key: str, data: bytes) -> Optional[CachedResponse]:
+        try:
+            headers, body = data.split(HEADER_SEPARATOR, 1)
+            return CachedResponse(body=body, headers=orjson.loads(headers))
+        except ValueError as e:
+            logger.error(f'Failed to decode the cached response (key: {key}): {e}')
+            return None
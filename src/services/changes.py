@@ -0,0 +1,85 @@
+import asyncio
+import os
+import socket
+from typing import Awaitable, Callable
+
+from aioredis import Redis
+from aioredis.exceptions import ResponseError
+from loguru import logger
+
+# The ETL appends the ids of the loaded documents to the stream, the API drops them from its cache
+CHANGES_STREAM = 'etl:changes'
+CHANGES_STREAM_MAX_LEN = 10000
+CHANGES_GROUP = 'api'
+CHANGES_BATCH_SIZE = 100
+CHANGES_BLOCK_IN_MS = 5000
+# Messages not acknowledged for this long by a consumer (e.g. a stopped worker) are taken over by another one
+CHANGES_CLAIM_IDLE_IN_MS = 60 * 1000
+CONSUMER_RETRY_IN_SECONDS = 5
+
+
+def generation_key(index: str) -> str:
+    """Key of the counter of the index changes, a new generation makes all the cached lists outdated."""
+    return f'{index}:generation'
+
+
+async def publish_changes(redis: Redis, index: str, ids: list[str]):
+    """Bumps the generation of the index and publishes the ids of its changed documents."""
+    if ids:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.incr(generation_key(index))
+            pipe.xadd(CHANGES_STREAM, {'index': index, 'ids': ','.join(ids)}, maxlen=CHANGES_STREAM_MAX_LEN)
+            await pipe.execute()
+
+
+async def consume_changes(redis: Redis, handlers: dict[str, Callable[[list[str]], Awaitable]]):
+    """
+    Applies the changes published by the ETL, `handlers` maps an index to the invalidation of its documents.
+
+    The workers share one consumer group, so each change is applied once: the cache entries are dropped
+    in Redis and every worker evicts them from L1 on the invalidation message of Redis.
+    A message is acknowledged only after it is applied, so a failed one is retried.
+    """
+    consumer = f'{socket.gethostname()}:{os.getpid()}'
+    while True:
+        try:
+            try:
+                await redis.xgroup_create(CHANGES_STREAM, CHANGES_GROUP, id='$', mkstream=True)
+            except ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+            await redis.execute_command(
+                'XAUTOCLAIM', CHANGES_STREAM, CHANGES_GROUP, consumer, CHANGES_CLAIM_IDLE_IN_MS, '0-0',
+            )
+            logger.info('ETL changes consumer is connected')
+            # The pending messages of the consumer go first, then the new ones. Whenever the stream is idle
+            # the pending ones are checked again, since a delivered message may be lost with the connection.
+            last_id = '0'
+            while True:
+                response = await redis.xreadgroup(
+                    CHANGES_GROUP, consumer, {CHANGES_STREAM: last_id},
+                    count=CHANGES_BATCH_SIZE, block=CHANGES_BLOCK_IN_MS if last_id == '>' else None,
+                )
+                messages = response[0][1] if response else []
+                if not messages:
+                    last_id = '>' if last_id == '0' else '0'
+                    continue
+                for message_id, fields in messages:
+                    await _apply_change(fields, handlers)
+                    await redis.xack(CHANGES_STREAM, CHANGES_GROUP, message_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f'ETL changes consumer failed: {e}')
+            await asyncio.sleep(CONSUMER_RETRY_IN_SECONDS)
+
+
+async def _apply_change(fields: dict, handlers: dict[str, Callable[[list[str]], Awaitable]]):
+    index = fields[b'index'].decode()
+    ids = fields[b'ids'].decode().split(',')
+    handler = handlers.get(index)
+    if not handler:
+        logger.warning(f'Changes of an unknown index are skipped (index: {index})')
+        return
+    logger.debug(f'Invalidating the cache of the changed documents (index: {index}, ids: {len(ids)})')
+    await handler(ids)
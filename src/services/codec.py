@@ -0,0 +1,119 @@
+import abc
+from typing import Optional, Type
+
+import msgpack
+import orjson
+from pydantic import BaseModel
+
+from src.core.config import settings
+from src.models.utils import construct_trusted
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON_HEADER_SEPARATOR = b'\n'
+# The first byte of an entry in the binary format. An entry of the JSON format starts with "[".
+MSGPACK_FORMAT_VERSION = 1
+NO_COMPRESSION = 0
+LZ4_COMPRESSION = 1
+ZSTD_COMPRESSION = 2
+
+
+class CodecError(ValueError):
+    pass
+
+
+class Codec(abc.ABC):
+    """
+    Encodes a cache entry: its header (a list of numbers) and its value.
+    Whatever codec encoded an entry, it is decoded by `decode`, so the codec may be changed on the fly.
+    """
+
+    @abc.abstractmethod
+    def encode(self, header: list, value: BaseModel) -> bytes:
+        """Encodes the entry into the bytes to put to Redis."""
+
+
+class JsonCodec(Codec):
+    """The JSON format: the JSON header and the JSON value separated by a newline."""
+
+    def encode(self, header: list, value: BaseModel) -> bytes:
+        return orjson.dumps(header) + JSON_HEADER_SEPARATOR + value.json(by_alias=True).encode()
+
+
+class MsgpackCodec(Codec):
+    """
+    The binary format: the version byte, the compression byte and the msgpack of [*header, value].
+    Values of at least `min_size` bytes are compressed, the smaller ones are not worth the CPU.
+    """
+
+    def __init__(self, compression: str = '', min_size: int = 1024):
+        self.compression = {'': NO_COMPRESSION, 'lz4': LZ4_COMPRESSION, 'zstd': ZSTD_COMPRESSION}[compression]
+        self.min_size = min_size
+        if self.compression == LZ4_COMPRESSION and not lz4:
+            raise CodecError('lz4 compression requires the lz4 package')
+        if self.compression == ZSTD_COMPRESSION and not zstandard:
+            raise CodecError('zstd compression requires the zstandard package')
+        self._zstd_compressor = zstandard.ZstdCompressor() if self.compression == ZSTD_COMPRESSION else None
+
+    def encode(self, header: list, value: BaseModel) -> bytes:
+        payload = msgpack.packb([*header, value.dict(by_alias=True)])
+        compression = NO_COMPRESSION
+        if self.compression and len(payload) >= self.min_size:
+            compression = self.compression
+            if compression == LZ4_COMPRESSION:
+                payload = lz4.frame.compress(payload)
+            else:
+                payload = self._zstd_compressor.compress(payload)
+        return bytes((MSGPACK_FORMAT_VERSION, compression)) + payload
+
+
+def decode(data: bytes, model: Type[BaseModel]) -> tuple[list, BaseModel]:
+    """Decodes the entry of any format into its header and value, raises CodecError if it is invalid."""
+    try:
+        if data[:1] == b'[':
+            header, payload = data.split(JSON_HEADER_SEPARATOR, 1)
+            return orjson.loads(header), parse_value(model, orjson.loads(payload))
+        if data[0] != MSGPACK_FORMAT_VERSION:
+            raise CodecError(f'Unknown format version: {data[0]}')
+        compression, payload = data[1], data[2:]
+        if compression == LZ4_COMPRESSION:
+            payload = lz4.frame.decompress(payload)
+        elif compression == ZSTD_COMPRESSION:
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        elif compression != NO_COMPRESSION:
+            raise CodecError(f'Unknown compression: {compression}')
+        *header, value = msgpack.unpackb(payload)
+        return header, parse_value(model, value)
+    except CodecError:
+        raise
+    except Exception as e:
+        # Whatever the reason (corrupted data, a missing compression package), the entry is just a miss
+        raise CodecError(str(e)) from e
+
+
+def parse_value(model: Type[BaseModel], data: dict) -> BaseModel:
+    """
+    The value of the entry. It was validated before it was cached, so unless CACHE_TRUSTED_DECODE is off
+    it is just constructed. An entry of an older version of the model, which misses a required field, fails.
+    """
+    if settings.CACHE_TRUSTED_DECODE:
+        return construct_trusted(model, data)
+    return model.parse_obj(data)
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    """Returns the codec configured by CACHE_CODEC, CACHE_COMPRESSION and CACHE_COMPRESSION_MIN_SIZE."""
+    name = name or settings.CACHE_CODEC
+    if name == 'json':
+        return JsonCodec()
+    if name == 'msgpack':
+        return MsgpackCodec(settings.CACHE_COMPRESSION, settings.CACHE_COMPRESSION_MIN_SIZE)
+    raise CodecError(f'Unknown cache codec: {name}')
@@ -0,0 +1,198 @@
+import base64
+import binascii
+from typing import Optional
+
+import orjson
+from elasticsearch import AsyncElasticsearch, NotFoundError
+
+from src.core.config import settings
+from src.models.page import Total
+
+CURSOR_TIEBREAKER = 'id'
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+TOTAL_COUNT_HEADER = 'X-Total-Count'
+TOTAL_RELATION_HEADER = 'X-Total-Relation'
+HAS_NEXT_HEADER = 'X-Has-Next'
+SORT_DIRECTIONS = ('asc', 'desc')
+# The field of the cursor of a snapshot page, the generation of the snapshot it was taken from
+SNAPSHOT_GENERATION = 'gen'
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+class InvalidSortError(ValueError):
+    pass
+
+
+class ExpiredCursorError(InvalidCursorError):
+    """
+    The point in time the cursor reads from has expired (see ELASTIC_PIT_KEEP_ALIVE),
+    or the snapshot it was taken from has been replaced.
+    """
+
+
+def parse_sort(sort: str) -> list[dict]:
+    """
+    Converts a comma-separated list of "field:direction" pairs into the ES sort clause.
+    The tiebreaker field is always appended, so the order is total and search_after is stable.
+    Raises InvalidSortError for a direction other than asc or desc.
+    """
+    clause = []
+    for item in filter(None, (part.strip() for part in sort.split(','))):
+        field, _, direction = item.partition(':')
+        direction = direction.strip().lower() or 'asc'
+        if direction not in SORT_DIRECTIONS:
+            raise InvalidSortError(f'Invalid sort direction of {field.strip()}: {direction}')
+        clause.append({field.strip(): direction})
+    if not clause:
+        clause.append({'_score': 'desc'})
+    if not any(CURSOR_TIEBREAKER in item for item in clause):
+        clause.append({CURSOR_TIEBREAKER: 'asc'})
+    return clause
+
+
+def encode_cursor(search_after: list, sort: list[dict], pit_id: Optional[str] = None) -> str:
+    """The cursor of the page following the hit with the `search_after` values of the `sort` clause."""
+    payload = {'sa': search_after, 'sort': sort}
+    if pit_id:
+        payload['pit'] = pit_id
+    return base64.urlsafe_b64encode(orjson.dumps(payload)).decode()
+
+
+def decode_cursor(cursor: str, sort: list[dict]) -> tuple[list, Optional[str]]:
+    """
+    Returns the search_after values and the PIT id of the cursor.
+    The values only make sense for the sort they were taken with, a cursor of another sort is invalid.
+    A cursor of a snapshot (see encode_snapshot_cursor) which is not kept anymore has expired.
+    """
+    payload = _load_cursor(cursor)
+    if SNAPSHOT_GENERATION in payload and 'sa' not in payload:
+        raise ExpiredCursorError('The snapshot of the list is not kept anymore, read it from its first page')
+    try:
+        search_after, cursor_sort = list(payload['sa']), payload['sort']
+        pit_id = payload.get('pit')
+    except (TypeError, KeyError, ValueError) as e:
+        raise InvalidCursorError(f'Invalid cursor: {cursor}') from e
+    if cursor_sort != sort or len(search_after) != len(sort):
+        raise InvalidCursorError(f'The cursor does not match the sort of the list: {cursor}')
+    return search_after, pit_id
+
+
+def encode_snapshot_cursor(generation: int, offset: int, sort: list[dict]) -> str:
+    """The cursor of the page starting at the `offset` of the matches of the snapshot of the `generation`."""
+    payload = {SNAPSHOT_GENERATION: generation, 'off': offset, 'sort': sort}
+    return base64.urlsafe_b64encode(orjson.dumps(payload)).decode()
+
+
+def decode_snapshot_cursor(cursor: str, sort: list[dict], generation: int) -> Optional[int]:
+    """
+    Returns the offset of the snapshot cursor, None for a cursor of ES. The offset only makes sense
+    for the snapshot it was taken from, ExpiredCursorError is raised for a cursor of another generation.
+    """
+    payload = _load_cursor(cursor)
+    if SNAPSHOT_GENERATION not in payload:
+        return None
+    try:
+        cursor_generation, offset = int(payload[SNAPSHOT_GENERATION]), int(payload['off'])
+        cursor_sort = payload['sort']
+    except (TypeError, KeyError, ValueError) as e:
+        raise InvalidCursorError(f'Invalid cursor: {cursor}') from e
+    if cursor_sort != sort or offset < 0:
+        raise InvalidCursorError(f'The cursor does not match the sort of the list: {cursor}')
+    if cursor_generation != generation:
+        raise ExpiredCursorError('The list has changed since the cursor was taken, read it anew')
+    return offset
+
+
+def _load_cursor(cursor: str) -> dict:
+    try:
+        payload = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, orjson.JSONDecodeError, ValueError) as e:
+        raise InvalidCursorError(f'Invalid cursor: {cursor}') from e
+    if not isinstance(payload, dict):
+        raise InvalidCursorError(f'Invalid cursor: {cursor}')
+    return payload
+
+
+def reads_point_in_time(**kwargs) -> bool:
+    """
+    Whether the page is read from a point in time (see search_page). The cursor of its next page carries
+    the id of the PIT, which expires after ELASTIC_PIT_KEEP_ALIVE, so such a page is not cached.
+    """
+    return bool(settings.ELASTIC_PIT_KEEP_ALIVE and kwargs.get('cursor'))
+
+
+async def open_point_in_time(elastic: AsyncElasticsearch, index: str) -> str:
+    response = await elastic.transport.perform_request(
+        'POST', f'/{index}/_pit', params={'keep_alive': settings.ELASTIC_PIT_KEEP_ALIVE},
+    )
+    return response['id']
+
+
+async def search_page(elastic: AsyncElasticsearch, index: str, body: Optional[dict],
+                      **kwargs) -> tuple[list[dict], Optional[str]]:
+    """
+    Runs the search for one page and returns its hits together with the cursor of the next page.
+
+    Without a cursor the page is addressed by "page"/"page_size" (from + size).
+    With a cursor the search continues right after the last hit of the previous page (search_after),
+    so a deep page costs the same as the first one. If ELASTIC_PIT_KEEP_ALIVE is set, the pages
+    following the first cursor are read from a point-in-time snapshot of the index, ExpiredCursorError
+    is raised once it has expired.
+    """
+    page_size = kwargs.get('page_size', 10)
+    page = kwargs.get('page', 1)
+    cursor = kwargs.get('cursor')
+
+    # The total is counted separately (see count_hits), a page does not spend time on it
+    sort = parse_sort(kwargs.get('sort') or '')
+    body = dict(body or {}, size=page_size, sort=sort, track_total_hits=False)
+    pit_id = None
+    if cursor:
+        body['search_after'], pit_id = decode_cursor(cursor, sort)
+        if settings.ELASTIC_PIT_KEEP_ALIVE and not pit_id:
+            pit_id = await open_point_in_time(elastic, index)
+    else:
+        body['from'] = (page - 1) * page_size
+
+    if pit_id:
+        body['pit'] = {'id': pit_id, 'keep_alive': settings.ELASTIC_PIT_KEEP_ALIVE}
+        try:
+            docs = await elastic.search(body=body)
+        except NotFoundError as e:
+            raise ExpiredCursorError('The cursor has expired, read the list from its first page') from e
+        pit_id = docs.get('pit_id', pit_id)
+    else:
+        docs = await elastic.search(index=index, body=body)
+
+    hits = docs['hits']['hits']
+    next_cursor = None
+    if len(hits) == page_size:
+        next_cursor = encode_cursor(hits[-1]['sort'], sort, pit_id)
+    return hits, next_cursor
+
+
+async def count_hits(elastic: AsyncElasticsearch, index: str, body: Optional[dict]) -> Total:
+    """
+    Counts the documents matching the query up to ELASTIC_TRACK_TOTAL_HITS: ES stops counting there,
+    so a count of a broad query costs as much as that of a narrow one.
+    """
+    body = dict(body or {}, size=0, track_total_hits=settings.ELASTIC_TRACK_TOTAL_HITS)
+    docs = await elastic.search(index=index, body=body)
+    total = docs['hits']['total']
+    return Total(value=total['value'], relation=total['relation'])
+
+
+def total_headers(total: Total, next_cursor: Optional[str], **kwargs) -> dict[str, str]:
+    """Headers of a list page with the total of the list and whether the page is not the last one."""
+    if kwargs.get('cursor') or total.relation != 'eq':
+        # The position of a cursor page is unknown, as is the end of a bounded count
+        has_next = next_cursor is not None
+    else:
+        has_next = kwargs.get('page', 1) * kwargs.get('page_size', 10) < total.value
+    headers = {TOTAL_COUNT_HEADER: str(total.value), HAS_NEXT_HEADER: 'true' if has_next else 'false'}
+    if total.relation != 'eq':
+        headers[TOTAL_RELATION_HEADER] = total.relation
+    return headers
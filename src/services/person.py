@@ -1,135 +1,71 @@
-from functools import lru_cache
-from typing import List, Optional
+from functools import lru_cache, partial
+from typing import Optional, Type
 
-import orjson
 from aioredis import Redis
-from elasticsearch import AsyncElasticsearch, NotFoundError
+from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
-from loguru import logger
+from pydantic import BaseModel
 
+from src.core.config import settings
 from src.db.elastic import get_elastic
+from src.db.local_cache import LocalCache, get_local_cache
 from src.db.redis import get_redis
-from src.models.person import Person
-from src.services.utils import get_key_by_args
+from src.models.page import Page
+from src.models.person import PersonFilm, PersonFilmography
+from src.services.base import BaseService
+from src.services.cache import CachedResponse
+from src.services.changes import generation_key
+from src.services.snapshot import SnapshotStore
+from src.services.utils import entity_key
 
 PERSON_CACHE_EXPIRE_IN_SECONDS = 60 * 5
-
-
-class PersonService:
-    def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
-        self.redis = redis
-        self.elastic = elastic
-
-    async def all(self, **kwargs) -> List[Optional[Person]]:
-        persons = await self._persons_from_cache(**kwargs)
-        if not persons:
-            persons = await self._get_persons_from_elastic(**kwargs)
-            if not persons:
-                return []
-            await self._put_persons_to_cache(persons, **kwargs)
-        return persons
-
-    async def get_by_id(self, person_id: str) -> Optional[Person]:
-        person = await self._person_from_cache(person_id)
+PERSON_CACHE_NAMESPACE = 'persons'
+PERSON_GENERATION_KEY = generation_key('persons')
+# Fields of the person document needed for the filmography
+PERSON_FILMS_FIELDS = ('uuid', 'films')
+
+
+class PersonService(BaseService[PersonFilmography]):
+    index = 'persons'
+    model = PersonFilmography
+    namespace = PERSON_CACHE_NAMESPACE
+    search_field = 'full_name'
+    entity_name = 'person'
+    cache_ttl = PERSON_CACHE_EXPIRE_IN_SECONDS
+
+    def __init__(self, redis: Redis, elastic: AsyncElasticsearch, local_cache: LocalCache):
+        super().__init__(redis, elastic, local_cache)
+        self.snapshot = SnapshotStore(
+            redis, elastic, local_cache, self.index, PersonFilmography, self.generation_key,
+            self.search_field, settings.SNAPSHOT_PERSONS_MAX_ITEMS,
+        )
+
+    async def get_films_response(self, person_id: str, response_model: Type[BaseModel],
+                                 role: Optional[str] = None) -> Optional[CachedResponse]:
+        """
+        Returns the ready JSON list of the films of the person as `response_model` items, only those where
+        the person had the `role` if it is specified. The filmography is a part of the person document,
+        so it takes one ES get at most.
+        """
+        return await self.cache.get_or_render(
+            f'{entity_key(person_id)}:films:{role or ""}:response:{response_model.__name__}',
+            partial(self._render_films, person_id, response_model, role),
+            tags=[person_id],
+        )
+
+    async def _render_films(self, person_id: str, response_model: Type[BaseModel],
+                            role: Optional[str]) -> Optional[CachedResponse]:
+        person = await self.get_by_id(person_id, PERSON_FILMS_FIELDS)
         if not person:
-            person = await self._get_person_from_elastic(person_id)
-            if not person:
-                return None
-            await self._put_person_to_cache(person)
-
-        return person
-
-    @staticmethod
-    async def _make_person_from_es_doc(doc: dict) -> Person:
-        person = doc['_source'].get('person')
-        if person and isinstance(person, str):
-            doc['_source']['person'] = [{'id': item, 'name': item} for item in person.split(' ')]
-        result = Person(id=doc['_id'], **doc['_source'])
-        return result
-
-    async def _get_person_from_elastic(self, person_id: str) -> Optional[Person]:
-        try:
-            doc = await self.elastic.get(index='genres', id=person_id)
-        except NotFoundError:
-            logger.debug(f'An error occurred while trying to find person in ES (id: {person_id})')
-            return None
-        person = doc['_source'].get('person')
-        if person and isinstance(person, str):
-            doc['_source']['person'] = [{'id': item, 'name': item} for item in person.split(' ')]
-        return Person(id=doc['_id'], **doc['_source'])
-
-    async def _get_persons_from_elastic(self, **kwargs) -> Optional[List[Person]]:
-        page_size = kwargs.get('page_size', 10)
-        page = kwargs.get('page', 1)
-        sort = kwargs.get('sort', '')
-        genre = kwargs.get('genre', None)
-        query = kwargs.get('query', None)
-        body = None
-        if genre:
-            body = {
-                'query': {
-                    'query_string': {
-                        'default_field': 'genre',
-                        'query': genre
-                    }
-                }
-            }
-        if query:
-            body = {
-                'query': {
-                    'match': {
-                        'title': {
-                            'query': query,
-                            'fuzziness': 1,
-                            'operator': 'and'
-                        }
-                    }
-                }
-            }
-        try:
-            docs = await self.elastic.search(index='genres',
-                                             body=body,
-                                             params={
-                                                 'size': page_size,
-                                                 'from': page - 1,
-                                                 'sort': sort,
-                                             })
-        except NotFoundError:
-            logger.debug('An error occurred while trying to get persons in ES)')
             return None
-
-        return [await PersonService._make_person_from_es_doc(doc) for doc in docs['hits']['hits']]
-
-    async def _person_from_cache(self, person_id: str) -> Optional[Person]:
-        data = await self.redis.get(person_id)
-        if not data:
-            logger.debug(f'The genre was not found in the cache (id: {person_id})')
-            return None
-
-        return Person.parse_raw(data)
-
-    async def _persons_from_cache(self, **kwargs) -> Optional[List[Person]]:
-        key = await get_key_by_args(**kwargs)
-        data = await self.redis.get(key)
-        if not data:
-            logger.debug('Persons was not found in the cache')
-            return None
-
-        return [Person.parse_raw(item) for item in orjson.loads(data)]
-
-    async def _put_person_to_cache(self, person: Person):
-        await self.redis.set(person.uuid, person.json(by_alias=True), ex=PERSON_CACHE_EXPIRE_IN_SECONDS)
-
-    async def _put_persons_to_cache(self, persons: List[Person], **search_params):
-        key = await get_key_by_args(**search_params)
-        await self.redis.set(key,
-                             orjson.dumps([person.json(by_alias=True) for person in persons]),
-                             ex=PERSON_CACHE_EXPIRE_IN_SECONDS)
+        films = [film for film in person.films if not role or role in film.roles]
+        return CachedResponse.from_page(Page[PersonFilm](items=films), response_model)
 
 
 @lru_cache()
 def get_person_service(
     redis: Redis = Depends(get_redis),
     elastic: AsyncElasticsearch = Depends(get_elastic),
+    local_cache: LocalCache = Depends(get_local_cache),
 ) -> PersonService:
-    return PersonService(redis, elastic)
+    return PersonService(redis, elastic, local_cache)
@@ -0,0 +1,106 @@
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Optional
+
+from aioredis import Redis
+from loguru import logger
+
+from src.core.config import settings
+
+LOCK_POLL_INTERVAL_IN_SECONDS = 0.05
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent cache misses of the same key into one load.
+
+    Within a worker the callers of the same key await one shared task. Across workers the load is
+    guarded by a short Redis lock: the workers that did not get it wait until the value appears in
+    the cache (or the lock is gone) instead of sending their own query to ES.
+    """
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self._refreshing: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str,
+                 load: Callable[[], Awaitable[Any]],
+                 from_cache: Callable[[], Awaitable[Optional[Any]]]) -> Any:
+        """
+        :param key: cache key of the value
+        :param load: gets the value from the source and puts it to the cache
+        :param from_cache: gets the value from the cache
+        """
+        task = self._in_flight.get(key)
+        if not task:
+            # The load is a separate task, so a cancelled caller does not cancel it for the others
+            task = asyncio.create_task(self._load(key, load, from_cache))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def refresh(self, key: str, load: Callable[[], Awaitable[Any]]):
+        """
+        Starts the load of the key in the background, unless this or another worker is already loading it.
+        """
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(key, load))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _load(self, key: str,
+                    load: Callable[[], Awaitable[Any]],
+                    from_cache: Callable[[], Awaitable[Optional[Any]]]) -> Any:
+        lock_key = f'lock:{key}'
+        try:
+            token = await self._acquire(lock_key)
+        except Exception as e:
+            logger.error(f'Failed to take the cache lock (key: {key}): {e}')
+            return await load()
+
+        if token:
+            try:
+                return await load()
+            finally:
+                await self._release(lock_key, token)
+
+        deadline = time.monotonic() + settings.CACHE_LOCK_TIMEOUT_IN_SECONDS
+        while time.monotonic() < deadline and await self.redis.exists(lock_key):
+            await asyncio.sleep(LOCK_POLL_INTERVAL_IN_SECONDS)
+        value = await from_cache()
+        if value:
+            return value
+        logger.debug(f'The value was not loaded by the lock holder, loading it (key: {key})')
+        return await load()
+
+    async def _refresh(self, key: str, load: Callable[[], Awaitable[Any]]):
+        lock_key = f'lock:{key}'
+        try:
+            token = await self._acquire(lock_key)
+            if not token:
+                return
+            try:
+                await load()
+            finally:
+                await self._release(lock_key, token)
+        except Exception as e:
+            logger.error(f'Failed to refresh the cache entry (key: {key}): {e}')
+
+    async def _acquire(self, lock_key: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        timeout = int(settings.CACHE_LOCK_TIMEOUT_IN_SECONDS * 1000)
+        if await self.redis.set(lock_key, token, nx=True, px=timeout):
+            return token
+        return None
+
+    async def _release(self, lock_key: str, token: str):
+        await self.redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
@@ -0,0 +1,232 @@
+import asyncio
+from pathlib import Path
+from typing import Optional, Type
+
+import orjson
+from aioredis import Redis
+from elasticsearch import AsyncElasticsearch, NotFoundError
+from loguru import logger
+from pydantic import BaseModel
+
+from src.core.config import settings
+from src.db.local_cache import LocalCache
+from src.db.shared_cache import SharedSegment
+from src.models.page import Page, Total
+from src.services.cache import CachedResponse
+from src.services.pagination import decode_snapshot_cursor, encode_snapshot_cursor, parse_sort, total_headers
+from src.services.utils import LIST_PARAMS_DEFAULTS, list_key, parse_document
+
+# Parameters of a list the snapshot is able to serve, the other ones (filters) go to ES
+SNAPSHOT_PARAMS = {'page', 'page_size', 'cursor', 'sort', 'query', 'fields', 'with_total'}
+# Scores of a search match, from the best one
+EXACT_SCORE = 4
+WHOLE_PREFIX_SCORE = 3
+WORD_PREFIX_SCORE = 2
+SUBSTRING_SCORE = 1
+
+
+class IndexSnapshot:
+    """Immutable copy of all the documents of a small index, searched by prefix or substring of one field."""
+
+    def __init__(self, generation: int, items: list[BaseModel], search_field: str):
+        self.generation = generation
+        self.items = {item.uuid: item for item in items}
+        self._docs = [(item, item.dict(by_alias=True)) for item in items]
+        self._search_values = [str(doc.get(search_field, '')).lower() for _, doc in self._docs]
+
+    def get(self, item_id: str) -> Optional[BaseModel]:
+        return self.items.get(item_id)
+
+    def page(self, offset: Optional[int] = None, **params) -> tuple[list[BaseModel], int, Optional[int]]:
+        """
+        The page of the items with the list parameters as ES takes them, the number of all the matching
+        items and the offset of the next page, None for the last one. The page starts at the `offset`
+        of the matches if it is specified (the one of the cursor), otherwise at the page number.
+        The search query matches if it is a substring of the field: the value equal to it goes first,
+        then the whole value starting with it, then a word starting with it; the score ties are sorted by id.
+        """
+        query = params.get('query')
+        scored = []
+        for (item, doc), value in zip(self._docs, self._search_values):
+            score = self._score(value, query) if query else WHOLE_PREFIX_SCORE
+            if score:
+                scored.append((score, item, doc))
+        sort = parse_sort(params.get('sort') or '')
+        for clause in reversed(sort):
+            (field, direction), = clause.items()
+            scored.sort(key=lambda match: self._sort_value(match, field), reverse=direction == 'desc')
+        page_size = params.get('page_size', LIST_PARAMS_DEFAULTS['page_size'])
+        if offset is None:
+            offset = (params.get('page', LIST_PARAMS_DEFAULTS['page']) - 1) * page_size
+        page = scored[offset:offset + page_size]
+        next_offset = offset + page_size if offset + page_size < len(scored) else None
+        return [item for _, item, _ in page], len(scored), next_offset
+
+    def suggest(self, prefix: str, size: int) -> list[BaseModel]:
+        """The items with a word of the field starting with the prefix, the ones starting with it go first."""
+        matches = []
+        for (item, _), value in zip(self._docs, self._search_values):
+            score = self._score(value, prefix)
+            if score >= WORD_PREFIX_SCORE:
+                matches.append((-score, value, item))
+        return [item for _, _, item in sorted(matches, key=lambda match: match[:2])[:size]]
+
+    @staticmethod
+    def _score(value: str, query: str) -> int:
+        if value == query:
+            return EXACT_SCORE
+        if value.startswith(query):
+            return WHOLE_PREFIX_SCORE
+        position = value.find(query)
+        if position < 0:
+            return 0
+        if not value[position - 1].isalnum():
+            return WORD_PREFIX_SCORE
+        return SUBSTRING_SCORE
+
+    @staticmethod
+    def _sort_value(match: tuple[int, BaseModel, dict], field: str) -> tuple:
+        score, _, doc = match
+        if field == '_score':
+            return False, score
+        value = doc.get(field.removesuffix('.raw'))
+        # None goes last, as the missing values in ES
+        return value is None, value
+
+
+class SnapshotStore:
+    """
+    The snapshot of the index kept by each worker and the answers to the list and detail requests from it,
+    without any I/O. The rendered responses are kept in L1 for the generation of the snapshot.
+
+    The generation of the index is checked every SNAPSHOT_REFRESH_INTERVAL_IN_SECONDS, once the ETL bumps it
+    the index is read anew and the snapshot is swapped. An index of more than `max_items` documents is not
+    kept, it is served by ES and Redis as usual.
+
+    With SHARED_CACHE_DIR the documents are shared by the workers of the host through a SharedSegment:
+    the leader reads them from ES and publishes them, the other workers wait one refresh for them.
+    """
+
+    def __init__(self, redis: Redis, elastic: AsyncElasticsearch, local_cache: LocalCache, index: str,
+                 model: Type[BaseModel], generation_key: str, search_field: str, max_items: int):
+        self.redis = redis
+        self.elastic = elastic
+        self.local_cache = local_cache
+        self.index = index
+        self.model = model
+        self.generation_key = generation_key
+        self.search_field = search_field
+        self.max_items = max_items
+        self.snapshot: Optional[IndexSnapshot] = None
+        # The generation the index was last read for, even if it turned out to be too large
+        self.generation: Optional[int] = None
+        # The documents of the index shared by the workers of the host, read from ES by the leader only
+        self.shared = None
+        if settings.SHARED_CACHE_DIR:
+            self.shared = SharedSegment(
+                Path(settings.SHARED_CACHE_DIR) / f'{settings.PROJECT_NAME}-{index}.segment',
+            )
+        self._awaited_generation: Optional[int] = None
+
+    def render_all(self, response_model: Type[BaseModel], **params) -> Optional[CachedResponse]:
+        """
+        The list response, None if the snapshot is not loaded, the parameters are not supported
+        or the cursor is the one of ES (the list was read from ES before the snapshot was loaded).
+
+        The pages are ranked by the snapshot itself (see IndexSnapshot.page), so their cursor is its own:
+        the offset of the next page in the snapshot of the generation. Once the snapshot is replaced
+        its cursors expire, as the offsets of the changed list are not the same.
+        """
+        snapshot = self.snapshot
+        if not snapshot or not params.keys() <= SNAPSHOT_PARAMS:
+            return None
+        sort = parse_sort(params.get('sort') or '')
+        offset = None
+        if params.get('cursor'):
+            offset = decode_snapshot_cursor(params['cursor'], sort, snapshot.generation)
+            if offset is None:
+                return None
+        key = list_key(snapshot.generation, response=response_model.__name__, **params)
+        key = f'snapshot:{self.index}:{key}'
+        response = self.local_cache.get(key)
+        if not response:
+            items, total, next_offset = snapshot.page(offset, **params)
+            next_cursor = None
+            if next_offset is not None:
+                next_cursor = encode_snapshot_cursor(snapshot.generation, next_offset, sort)
+            page = Page[self.model].construct(items=items, next_cursor=next_cursor)
+            response = CachedResponse.from_page(page, response_model)
+            if params.get('with_total'):
+                response.headers.update(total_headers(Total(value=total), next_cursor, **params))
+            self.local_cache.set(key, response)
+        return response
+
+    def render_by_id(self, item_id: str, response_model: Type[BaseModel]) -> Optional[CachedResponse]:
+        """
+        The detail response, None if the snapshot is not loaded or has no such item
+        (it may have been added after the snapshot was taken).
+        """
+        snapshot = self.snapshot
+        item = snapshot.get(item_id) if snapshot else None
+        if not item:
+            return None
+        key = f'snapshot:{self.index}:v{snapshot.generation}:{item_id}:{response_model.__name__}'
+        response = self.local_cache.get(key)
+        if not response:
+            response = CachedResponse.from_item(item, response_model)
+            self.local_cache.set(key, response)
+        return response
+
+    def render_suggestions(self, response_model: Type[BaseModel], prefix: str,
+                           size: int) -> Optional[CachedResponse]:
+        """The autocomplete response, None if the snapshot is not loaded."""
+        snapshot = self.snapshot
+        if not snapshot:
+            return None
+        key = f'snapshot:{self.index}:v{snapshot.generation}:suggest:{size}:{prefix}'
+        response = self.local_cache.get(key)
+        if not response:
+            page = Page[self.model].construct(items=snapshot.suggest(prefix, size))
+            response = CachedResponse.from_page(page, response_model)
+            self.local_cache.set(key, response)
+        return response
+
+    async def load(self):
+        generation = int(await self.redis.get(self.generation_key) or 0)
+        if generation == self.generation:
+            return
+        data = self.shared.get(str(generation)) if self.shared else None
+        if data:
+            hits = orjson.loads(data)
+        elif self.shared and not self.shared.is_leader() and self._awaited_generation != generation:
+            # The leader is about to publish the generation, it is read from ES by one worker only
+            self._awaited_generation = generation
+            return
+        else:
+            try:
+                response = await self.elastic.search(
+                    index=self.index, body={'size': self.max_items + 1, 'sort': [{'id': 'asc'}]},
+                )
+            except NotFoundError:
+                logger.warning(f'The index {self.index} is not found, its snapshot is not loaded')
+                return
+            hits = response['hits']['hits']
+            if self.shared:
+                self.shared.publish({str(generation): orjson.dumps(hits)})
+        self.generation = generation
+        if len(hits) > self.max_items:
+            logger.warning(f'The index {self.index} has more than {self.max_items} documents, it is not kept')
+            self.snapshot = None
+            return
+        items = [parse_document(self.model, dict(hit['_source'], id=hit['_id'])) for hit in hits]
+        self.snapshot = IndexSnapshot(generation, items, self.search_field)
+        logger.info(f'Loaded the snapshot of {self.index}: {len(items)} documents, generation {generation}')
+
+    async def run(self):
+        """Loads the snapshot and keeps it up to date, until cancelled."""
+        while True:
+            try:
+                await self.load()
+            except Exception as e:
+                logger.warning(f'Failed to load the snapshot of {self.index}: {e!r}')
+            await asyncio.sleep(settings.SNAPSHOT_REFRESH_INTERVAL_IN_SECONDS)
@@ -0,0 +1,61 @@
+import time
+
+from elasticsearch import AsyncElasticsearch, NotFoundError, RequestError
+from loguru import logger
+
+# The completion field the ETL fills with the words of the title or the name
+SUGGEST_FIELD = 'suggest'
+SUGGESTION_NAME = 'suggestions'
+# How long an index without the completion field is served by the prefix query before the suggester
+# is tried again (the ETL adds the field to the mapping of an existing index on its next load)
+COMPLETION_RETRY_IN_SECONDS = 60 * 5
+
+# Indices found without the completion field, and until when (monotonic) they are not tried again
+_completion_missing: dict[str, float] = {}
+
+
+def normalize_prefix(prefix: str) -> str:
+    """The prefix as the "simple" analyzer of the completion field sees it, so that it is one cache key."""
+    return ' '.join(prefix.split()).lower()
+
+
+async def suggest(elastic: AsyncElasticsearch, index: str, field: str, prefix: str, size: int) -> list[dict]:
+    """
+    Documents of the index with the `field` only, whose `field` has a word starting with the prefix.
+
+    It is a completion suggester, which is answered from memory by ES. An index built before the
+    completion field was added to it falls back to a prefix query on the field. The worker remembers
+    such an index for COMPLETION_RETRY_IN_SECONDS, so that it is not failed over on every request.
+    """
+    if _completion_missing.get(index, 0) > time.monotonic():
+        return await _prefix_query(elastic, index, field, prefix, size)
+    body = {
+        '_source': [field],
+        'suggest': {
+            SUGGESTION_NAME: {
+                'prefix': prefix,
+                'completion': {'field': SUGGEST_FIELD, 'size': size},
+            },
+        },
+    }
+    try:
+        response = await elastic.search(index=index, body=body)
+        options = response['suggest'][SUGGESTION_NAME][0]['options']
+        return [dict(option['_source'], id=option['_id']) for option in options]
+    except NotFoundError:
+        logger.debug(f'An error occurred while trying to get suggestions in ES (index: {index})')
+        return []
+    except RequestError as e:
+        logger.warning(
+            f'The completion suggester failed on {index}, the prefix query is used '
+            f'for {COMPLETION_RETRY_IN_SECONDS}s: {e}'
+        )
+        _completion_missing[index] = time.monotonic() + COMPLETION_RETRY_IN_SECONDS
+    return await _prefix_query(elastic, index, field, prefix, size)
+
+
+async def _prefix_query(elastic: AsyncElasticsearch, index: str, field: str, prefix: str,
+                        size: int) -> list[dict]:
+    body = {'_source': [field], 'size': size, 'query': {'match_bool_prefix': {field: prefix}}}
+    response = await elastic.search(index=index, body=body)
+    return [dict(hit['_source'], id=hit['_id']) for hit in response['hits']['hits']]
@@ -1,5 +1,70 @@
-import json
+import hashlib
+from typing import Optional, Type
 
+import orjson
+from pydantic import BaseModel
 
-async def get_key_by_args(*args, **kwargs) -> str:
-    return f'{args}:{json.dumps({"kwargs": kwargs}, sort_keys=True)}'
+from src.core.config import settings
+from src.models.utils import construct_trusted
+from src.services.pagination import parse_sort
+
+# Values of the list parameters which are the same as not specifying them
+LIST_PARAMS_DEFAULTS = {'page': 1, 'page_size': 10, 'with_total': False}
+# Parameters of a list which select its items, the rest only pick a page of them
+FILTER_PARAMS = ('genre', 'query')
+
+
+def canonical_params(**params) -> dict:
+    """
+    Normalizes the parameters of a list, so that equivalent requests share one cache entry.
+    The search query is case and whitespace insensitive (as its ES analyzer), the sort is spelled out
+    in full, and the parameters which do not change the result are dropped.
+    """
+    if params.get('query'):
+        params['query'] = ' '.join(params['query'].split()).lower()
+    if params.get('genre'):
+        params['genre'] = params['genre'].strip()
+    if 'sort' in params:
+        params['sort'] = ','.join(
+            f'{field}:{direction.lower()}' for item in parse_sort(params['sort'] or '')
+            for field, direction in item.items()
+        )
+    if params.get('cursor'):
+        # The page is ignored when the cursor is specified
+        params.pop('page', None)
+    return {
+        name: value for name, value in params.items()
+        if value not in (None, '') and LIST_PARAMS_DEFAULTS.get(name) != value
+    }
+
+
+def filter_params(**params) -> dict:
+    return {name: params[name] for name in FILTER_PARAMS if params.get(name)}
+
+
+def list_key(generation: int, **params) -> str:
+    """Cache key of a list. The lists of the previous generations are not read anymore and just expire."""
+    digest = hashlib.blake2b(orjson.dumps(params, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+    return f'list:v{generation}:{digest}'
+
+
+def entity_key(entity_id: str, fields: Optional[tuple[str, ...]] = None) -> str:
+    """Cache key of the entity, a sparse fieldset of it is cached separately from the whole one."""
+    if fields is None:
+        return entity_id
+    return f'{entity_id}:{",".join(fields)}'
+
+
+def source_includes(model: Type[BaseModel], fields: Optional[tuple[str, ...]]) -> Optional[list[str]]:
+    """Fields of the ES document (_source includes) to get the given fields of the model."""
+    if fields is None:
+        return None
+    # The uuid is the _id of the document, but the includes must not be empty, otherwise ES returns everything
+    return [model.__fields__[name].alias for name in fields if name != 'uuid'] or ['id']
+
+
+def parse_document(model: Type[BaseModel], data: dict) -> BaseModel:
+    """The model of the ES document, validated unless ELASTIC_VALIDATE_DOCUMENTS is off (trusting the ETL)."""
+    if settings.ELASTIC_VALIDATE_DOCUMENTS:
+        return model(**data)
+    return construct_trusted(model, data)
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from collections import Counter
+
+import orjson
+from aioredis import Redis
+from elasticsearch import AsyncElasticsearch
+from loguru import logger
+
+from src.core.config import settings
+
+# Sorted set of the list/search parameters of one hour, scored by the number of requests
+QUERIES_KEY = 'warmup:queries:{namespace}:{hour}'
+# Size of the pages the genres are loaded by
+GENRES_PAGE_SIZE = 100
+
+
+class QueryStats:
+    """
+    Counts the list and search requests by their (canonical) parameters.
+
+    The counts are kept in memory and added to Redis every QUERY_STATS_FLUSH_INTERVAL_IN_SECONDS,
+    so a request costs a dict update. They are bucketed by hour, the buckets expire after
+    WARMUP_QUERIES_WINDOW_IN_HOURS.
+    """
+
+    def __init__(self):
+        self.counts: Counter[tuple[str, bytes]] = Counter()
+
+    def record(self, namespace: str, params: dict):
+        if params.get('cursor') or not settings.WARMUP_TOP_QUERIES:
+            # A cursor is bound to a snapshot of the index, it is not worth replaying
+            return
+        self.counts[namespace, orjson.dumps(params, option=orjson.OPT_SORT_KEYS)] += 1
+
+    async def flush(self, redis: Redis):
+        if not self.counts:
+            return
+        counts, self.counts = self.counts, Counter()
+        hour = int(time.time() // 3600)
+        async with redis.pipeline(transaction=False) as pipe:
+            for (namespace, params), count in counts.items():
+                key = QUERIES_KEY.format(namespace=namespace, hour=hour)
+                pipe.zincrby(key, count, params)
+                pipe.expire(key, settings.WARMUP_QUERIES_WINDOW_IN_HOURS * 3600)
+            await pipe.execute()
+
+    async def run(self, redis: Redis):
+        """Flushes the counts periodically, until cancelled."""
+        while True:
+            await asyncio.sleep(settings.QUERY_STATS_FLUSH_INTERVAL_IN_SECONDS)
+            try:
+                await self.flush(redis)
+            except Exception as e:
+                logger.warning(f'Failed to flush the query stats: {e!r}')
+
+    @staticmethod
+    async def top(redis: Redis, namespace: str, limit: int) -> list[dict]:
+        """The parameters of the most frequent requests of the last WARMUP_QUERIES_WINDOW_IN_HOURS."""
+        hour = int(time.time() // 3600)
+        async with redis.pipeline(transaction=False) as pipe:
+            for bucket in range(hour - settings.WARMUP_QUERIES_WINDOW_IN_HOURS + 1, hour + 1):
+                key = QUERIES_KEY.format(namespace=namespace, hour=bucket)
+                pipe.zrevrange(key, 0, limit - 1, withscores=True)
+            buckets = await pipe.execute()
+        counts = Counter()
+        for bucket in buckets:
+            for params, count in bucket:
+                counts[params] += count
+        top = []
+        for params, _ in counts.most_common(limit):
+            params = orjson.loads(params)
+            if 'fields' in params:
+                params['fields'] = tuple(params['fields'])
+            top.append(params)
+        return top
+
+
+query_stats = QueryStats()
+
+
+async def warm_up(redis: Redis, elastic: AsyncElasticsearch, services: dict):
+    """
+    Opens the connections to Redis and ES and fills the cache before the traffic comes:
+    the top WARMUP_TOP_FILMS films by rating, all the genres and the WARMUP_TOP_QUERIES most frequent
+    recent lists and searches of each namespace (films, genres, persons).
+    """
+    started_at = time.monotonic()
+    await asyncio.gather(
+        *(redis.ping() for _ in range(settings.WARMUP_CONNECTIONS)),
+        *(elastic.ping() for _ in range(settings.WARMUP_CONNECTIONS)),
+    )
+    if settings.WARMUP_TOP_FILMS:
+        await services['films'].all(page_size=settings.WARMUP_TOP_FILMS, sort='imdb_rating:desc')
+    page = 1
+    while (await services['genres'].all(page=page, page_size=GENRES_PAGE_SIZE)).items:
+        page += 1
+
+    loaded = 0
+    if settings.WARMUP_TOP_QUERIES:
+        for namespace, service in services.items():
+            for params in await QueryStats.top(redis, namespace, settings.WARMUP_TOP_QUERIES):
+                # The totals are counted for the responses, the list is the same with or without them
+                params.pop('with_total', None)
+                try:
+                    await service.all(**params)
+                    loaded += 1
+                except Exception as e:
+                    logger.warning(f'Failed to warm up the {namespace} list {params}: {e!r}')
+    logger.info(f'The cache is warmed up in {time.monotonic() - started_at:.1f}s ({loaded} recent lists)')
@@ -0,0 +1,116 @@
+import asyncio
+
+import fakeredis.aioredis
+import httpx
+import pytest
+
+from src.core.admission import OverloadedError, PrioritySemaphore, RateLimitMiddleware
+from src.core.config import settings
+from src.main import app
+
+
+async def hold(semaphore: PrioritySemaphore, priority: int, order: list, name: str):
+    async with semaphore.slot(priority):
+        order.append(name)
+        await asyncio.sleep(0.01)
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    async def scenario():
+        semaphore = PrioritySemaphore(limit=1, timeout=1)
+        order = []
+        await semaphore.acquire(0)
+        waiters = [
+            asyncio.create_task(hold(semaphore, priority, order, name))
+            for priority, name in ((2, 'search 1'), (1, 'other'), (0, 'get 1'), (2, 'search 2'), (0, 'get 2'))
+        ]
+        await asyncio.sleep(0)
+        semaphore.release()
+        await asyncio.gather(*waiters)
+        return order, semaphore._active
+
+    order, active = asyncio.run(scenario())
+    assert order == ['get 1', 'get 2', 'other', 'search 1', 'search 2']
+    assert active == 0
+
+
+def test_waiter_gives_up_after_the_timeout():
+    async def scenario():
+        semaphore = PrioritySemaphore(limit=1, timeout=0.01)
+        await semaphore.acquire(0)
+        with pytest.raises(OverloadedError):
+            await semaphore.acquire(2)
+        assert not semaphore._waiters
+        semaphore.release()
+        # The slot is free again, the next one gets it at once
+        await asyncio.wait_for(semaphore.acquire(2), 0.1)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        semaphore = PrioritySemaphore(limit=1, timeout=1)
+        await semaphore.acquire(0)
+        cancelled = asyncio.create_task(semaphore.acquire(0))
+        waiting = asyncio.create_task(semaphore.acquire(2))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert len(semaphore._waiters) == 1
+        semaphore.release()
+        await asyncio.wait_for(waiting, 0.1)
+        semaphore.release()
+        return semaphore._active
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_slot_handed_over_to_a_cancelled_waiter_is_released():
+    async def scenario():
+        semaphore = PrioritySemaphore(limit=1, timeout=1)
+        await semaphore.acquire(0)
+        waiter = asyncio.create_task(semaphore.acquire(0))
+        await asyncio.sleep(0)
+        # The slot goes to the waiter, which is cancelled before it wakes up
+        semaphore.release()
+        waiter.cancel()
+        result, = await asyncio.gather(waiter, return_exceptions=True)
+        if not isinstance(result, asyncio.CancelledError):
+            # wait_for before Python 3.12 returns the result which is already there rather than cancels
+            semaphore.release()
+        return semaphore._active, semaphore._waiters
+
+    assert asyncio.run(scenario()) == (0, [])
+
+
+def test_no_limit():
+    async def scenario():
+        semaphore = PrioritySemaphore(limit=0, timeout=0.01)
+        async with semaphore.slot(2), semaphore.slot(2):
+            return semaphore._active
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_rate_limit(monkeypatch):
+    monkeypatch.setattr(settings, 'RATE_LIMIT_SEARCH_PER_SECOND', 0.001)
+    monkeypatch.setattr(settings, 'RATE_LIMIT_SEARCH_BURST', 2)
+    redis = fakeredis.aioredis.FakeRedis()
+
+    async def endpoint(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def scenario():
+        limited = RateLimitMiddleware(endpoint, app, lambda: redis)
+        transport = httpx.ASGITransport(app=limited)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            searches = [await client.get('/api/v1/films/search') for _ in range(3)]
+            other = await client.get('/api/v1/films/')
+        return searches, other
+
+    searches, other = asyncio.run(scenario())
+    assert [response.status_code for response in searches] == [200, 200, 429]
+    assert int(searches[-1].headers['retry-after']) > 0
+    assert other.status_code == 200
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from elasticsearch import NotFoundError
+
+from benchmarks.es_stub import ElasticsearchStub, make_documents
+from src.db.elastic import BatchingElasticsearch, get_search_error
+
+WINDOW = 0.01
+
+
+def make_client(max_size: int = 10) -> tuple[BatchingElasticsearch, ElasticsearchStub]:
+    stub = ElasticsearchStub(make_documents(films=20, persons=10))
+    return BatchingElasticsearch(stub, WINDOW, max_size), stub
+
+
+def test_concurrent_searches_share_one_msearch():
+    async def scenario():
+        elastic, stub = make_client()
+        bodies = [{'size': size, 'sort': [{'id': 'asc'}]} for size in (1, 2, 3)]
+        responses = await asyncio.gather(*(elastic.search(index='movies', body=body) for body in bodies))
+        return stub.requests, [len(response['hits']['hits']) for response in responses]
+
+    assert asyncio.run(scenario()) == (1, [1, 2, 3])
+
+
+def test_batch_is_sent_at_max_size():
+    async def scenario():
+        elastic, stub = make_client(max_size=2)
+        await asyncio.gather(*(elastic.search(index='genres', body={}) for _ in range(4)))
+        return stub.requests
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_error_of_one_search_goes_to_its_caller_only():
+    async def scenario():
+        elastic, _ = make_client()
+        return await asyncio.gather(
+            elastic.search(index='movies', body={}), elastic.search(index='missing', body={}),
+            return_exceptions=True,
+        )
+
+    found, missing = asyncio.run(scenario())
+    assert found['hits']['hits']
+    assert isinstance(missing, NotFoundError)
+
+
+def test_single_search_and_search_with_params_are_not_batched():
+    async def scenario():
+        elastic, stub = make_client()
+        await elastic.search(index='movies', body={})
+        await elastic.search(index='movies', body={}, params={'preference': 'x'})
+        with pytest.raises(NotFoundError):
+            await elastic.search(index='missing', body={})
+        return stub.requests
+
+    assert asyncio.run(scenario()) == 3
+
+
+def test_search_error():
+    error = get_search_error({'status': 404, 'error': {'type': 'index_not_found_exception'}})
+    assert isinstance(error, NotFoundError)
+    assert error.error == 'index_not_found_exception'
+    assert get_search_error({'status': 429, 'error': 'rejected'}).status_code == 429
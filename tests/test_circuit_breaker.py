@@ -0,0 +1,210 @@
+import asyncio
+import time
+
+import fakeredis.aioredis
+import httpx
+import pytest
+from elasticsearch import Connection, ConnectionError, NotFoundError, TransportError
+
+from benchmarks.es_stub import ElasticsearchStub, make_documents
+from src.core.admission import PrioritySemaphore
+from src.core.config import settings
+from src.db import elastic, local_cache, redis
+from src.db.elastic import (CLOSED, HALF_OPEN, OPEN, BatchingElasticsearch, CircuitBreaker, CircuitOpenError,
+                            InstrumentedTransport)
+from src.main import app
+from src.models.genre import Genre
+from src.services.cache import Cache
+
+RESET_TIMEOUT = 0.05
+
+
+class FakeConnection(Connection):
+    """Connection answering with the given outcomes in turn: a status code or an exception to raise."""
+
+    outcomes: list = []
+    timeouts: list = []
+
+    async def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(),
+                              headers=None):
+        FakeConnection.timeouts.append(timeout)
+        outcome = FakeConnection.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        if outcome >= 400:
+            raise TransportError(outcome, 'error', {})
+        return outcome, {}, '{"took": 1}'
+
+
+@pytest.fixture
+def breaker(monkeypatch) -> CircuitBreaker:
+    breaker = CircuitBreaker(failures=2, reset_timeout=RESET_TIMEOUT)
+    monkeypatch.setattr(elastic, 'elastic_breaker', breaker)
+    monkeypatch.setattr(elastic, 'elastic_limiter', PrioritySemaphore(limit=0, timeout=1))
+    return breaker
+
+
+def perform(path: str, *outcomes, **params):
+    FakeConnection.outcomes, FakeConnection.timeouts = list(outcomes), []
+    transport = InstrumentedTransport([{'host': 'es'}], connection_class=FakeConnection, max_retries=0)
+    return asyncio.run(transport.perform_request('GET', path, params=params))
+
+
+def test_opens_after_failures_in_a_row(breaker):
+    breaker.before_call()
+    breaker.on_failure()
+    breaker.on_success()
+    breaker.on_failure()
+    assert breaker.state == CLOSED
+    breaker.on_failure()
+    assert breaker.state == OPEN
+    assert not breaker.available()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_trial_call_closes_or_opens_it_again(breaker):
+    for _ in range(2):
+        breaker.on_failure()
+    time.sleep(RESET_TIMEOUT)
+    assert breaker.available()
+    assert breaker.before_call() is True
+    assert breaker.state == HALF_OPEN
+    # Only one trial call at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.on_failure(probe=True)
+    breaker.release(True)
+    assert breaker.state == OPEN
+
+    time.sleep(RESET_TIMEOUT)
+    probe = breaker.before_call()
+    breaker.on_success(probe)
+    breaker.release(probe)
+    assert breaker.state == CLOSED
+    assert breaker.before_call() is False
+
+
+def test_end_of_another_call_does_not_end_the_trial_one(breaker):
+    before_trial = breaker.before_call()
+    for _ in range(2):
+        breaker.on_failure()
+    time.sleep(RESET_TIMEOUT)
+    probe = breaker.before_call()
+    # The call started before the breaker opened ends while the trial one is in flight
+    breaker.release(before_trial)
+    assert not breaker.available()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.release(probe)
+    assert breaker.available()
+
+
+def test_outcome_of_a_call_started_before_opening_is_ignored(breaker):
+    before_opening = breaker.before_call()
+    for _ in range(2):
+        breaker.on_failure()
+    breaker.on_success(before_opening)
+    assert breaker.state == OPEN
+    time.sleep(RESET_TIMEOUT)
+    probe = breaker.before_call()
+    breaker.on_success(before_opening)
+    breaker.on_failure(before_opening)
+    assert breaker.state == HALF_OPEN
+    breaker.on_success(probe)
+    breaker.release(probe)
+    assert breaker.state == CLOSED
+
+
+def test_transport_counts_the_failures_of_es(breaker):
+    with pytest.raises(ConnectionError):
+        perform('/movies/_search', ConnectionError('N/A', 'refused', None))
+    with pytest.raises(TransportError):
+        perform('/movies/_search', 503)
+    assert breaker.state == OPEN
+    # Fails fast without calling ES
+    with pytest.raises(CircuitOpenError):
+        perform('/movies/_search')
+
+
+def test_transport_does_not_count_the_errors_of_the_request(breaker):
+    for status in (400, 404, 400):
+        with pytest.raises(TransportError):
+            perform('/movies/_doc/1', status)
+    assert breaker.state == CLOSED
+    assert perform('/movies/_doc/1', 200) == {'took': 1}
+
+
+def test_transport_sets_the_timeout_of_the_operation(breaker):
+    perform('/movies/_doc/1', 200)
+    assert FakeConnection.timeouts == [settings.ELASTIC_GET_TIMEOUT_IN_SECONDS]
+    perform('/movies/_search', 200)
+    assert FakeConnection.timeouts == [settings.ELASTIC_SEARCH_TIMEOUT_IN_SECONDS]
+    perform('/movies/_search', 200, request_timeout=7)
+    assert FakeConnection.timeouts == [7]
+
+
+def test_msearch_items_rejected_by_es_are_failures(breaker):
+    class OverloadedStub(ElasticsearchStub):
+        async def msearch(self, body: list[dict], **kwargs) -> dict:
+            await self._request()
+            return {'responses': [{'status': 429, 'error': {'type': 'es_rejected_execution_exception'}}] * 2}
+
+    async def scenario():
+        batching = BatchingElasticsearch(OverloadedStub(make_documents(films=10, persons=10)), 0.01, 10)
+        return await asyncio.gather(
+            *(batching.search(index='movies', body={}) for _ in range(2)), return_exceptions=True,
+        )
+
+    errors = asyncio.run(scenario())
+    assert [error.status_code for error in errors] == [429, 429]
+    assert breaker.state == OPEN
+
+
+def test_msearch_items_not_found_are_not_failures(breaker):
+    async def scenario():
+        batching = BatchingElasticsearch(ElasticsearchStub(make_documents(films=10, persons=10)), 0.01, 10)
+        return await asyncio.gather(
+            *(batching.search(index='missing', body={}) for _ in range(3)), return_exceptions=True,
+        )
+
+    assert all(isinstance(error, NotFoundError) for error in asyncio.run(scenario()))
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.parametrize('error', [
+    ConnectionError('N/A', 'refused', None), TransportError(503, 'unavailable', {}),
+], ids=['not connected', '5xx'])
+def test_expired_entry_is_served_while_es_fails(breaker, error):
+    async def scenario(error: Exception):
+        l1 = local_cache.LocalCache(max_items=10, ttl=60)
+        cache = Cache(fakeredis.aioredis.FakeRedis(), l1, 60, 'genres')
+        await cache.set('a', Genre(id='a', name='Drama'))
+        l1.get('genres:a').expires_at = 0
+
+        async def load():
+            raise error
+
+        return await cache.get_or_load('a', Genre, load)
+
+    assert asyncio.run(scenario(error)).name == 'Drama'
+    with pytest.raises(TransportError):
+        asyncio.run(scenario(TransportError(400, 'parsing_exception', {})))
+
+
+def test_failure_of_es_without_a_cached_response_is_503(breaker):
+    class OverloadedStub(ElasticsearchStub):
+        async def search(self, **kwargs) -> dict:
+            raise TransportError(503, 'unavailable', {})
+
+    async def scenario():
+        redis.redis = fakeredis.aioredis.FakeRedis()
+        elastic.es = OverloadedStub(make_documents(films=10, persons=10))
+        local_cache.local_cache = local_cache.LocalCache(max_items=10, ttl=60)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.get('/api/v1/films/')
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 503
+    assert 'retry-after' in response.headers
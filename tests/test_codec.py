@@ -0,0 +1,75 @@
+import pytest
+
+from src.core.config import settings
+from src.models.genre import Genre
+from src.models.page import Page
+from src.services import codec
+from src.services.codec import Codec, CodecError, JsonCodec, MsgpackCodec, decode, get_codec
+
+HEADER = [1700000000.5, 0.25]
+GENRE = Genre(id='0b105f87-e0a5-45dc-8ce7-f8632088f390', name='Drama')
+PAGE = Page[str](items=[f'id-{number}' for number in range(200)], next_cursor='cursor')
+
+
+def make_codecs() -> list:
+    codecs = [pytest.param('json', '', id='json'), pytest.param('msgpack', '', id='msgpack')]
+    for compression, package in (('lz4', codec.lz4), ('zstd', codec.zstandard)):
+        codecs.append(pytest.param(
+            'msgpack', compression, id=f'msgpack-{compression}',
+            marks=pytest.mark.skipif(package is None, reason=f'{compression} is not installed'),
+        ))
+    return codecs
+
+
+@pytest.fixture(params=[False, True], ids=['validated', 'trusted'])
+def trusted_decode(request, monkeypatch):
+    monkeypatch.setattr(settings, 'CACHE_TRUSTED_DECODE', request.param)
+
+
+@pytest.mark.parametrize('name,compression', make_codecs())
+@pytest.mark.parametrize('value', [GENRE, PAGE], ids=['genre', 'page'])
+def test_round_trip(name, compression, value, trusted_decode):
+    entry = (JsonCodec() if name == 'json' else MsgpackCodec(compression, min_size=64)).encode(HEADER, value)
+    header, decoded = decode(entry, type(value))
+    assert header == HEADER
+    assert decoded == value
+
+
+@pytest.mark.parametrize('compression', ['lz4', 'zstd'])
+def test_small_values_are_not_compressed(compression):
+    if getattr(codec, {'lz4': 'lz4', 'zstd': 'zstandard'}[compression]) is None:
+        pytest.skip(f'{compression} is not installed')
+    entry = MsgpackCodec(compression, min_size=1024).encode(HEADER, GENRE)
+    assert entry[1] == codec.NO_COMPRESSION
+    assert decode(entry, Genre) == (HEADER, GENRE)
+
+
+def test_entries_of_any_codec_are_decoded():
+    """The codec may be switched on the fly, the entries of the previous one are still read."""
+    entries = [get_codec('json').encode(HEADER, GENRE), get_codec('msgpack').encode(HEADER, GENRE)]
+    assert [decode(entry, Genre) for entry in entries] == [(HEADER, GENRE)] * 2
+
+
+@pytest.mark.parametrize('entry', [
+    b'[1, 2]',
+    b'[1, 2]\n{"name": "Drama"}',
+    bytes((99, 0)) + b'data',
+    bytes((codec.MSGPACK_FORMAT_VERSION, 99)) + b'data',
+    bytes((codec.MSGPACK_FORMAT_VERSION, codec.NO_COMPRESSION)) + b'\xc1',
+])
+def test_invalid_entry(entry):
+    with pytest.raises(CodecError):
+        decode(entry, Genre)
+
+
+def test_unknown_codec():
+    with pytest.raises(CodecError):
+        get_codec('pickle')
+
+
+def test_codec_without_encode_is_abstract():
+    class Incomplete(Codec):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,132 @@
+import asyncio
+
+import fakeredis.aioredis
+import httpx
+import pytest
+
+from benchmarks.es_stub import ElasticsearchStub, make_documents
+from src.db import elastic, local_cache, redis
+from src.main import app
+from src.services.genre import get_genre_service
+from src.services.pagination import NEXT_CURSOR_HEADER
+from src.services.person import get_person_service
+
+PAGE_SIZE = 3
+LISTS = [
+    ('/api/v1/films/', {}),
+    ('/api/v1/films/', {'sort': 'imdb_rating:desc'}),
+    ('/api/v1/films/search', {'query': 'star'}),
+    ('/api/v1/genres/', {}),
+    ('/api/v1/genres/', {'sort': 'name.raw:desc'}),
+    ('/api/v1/genres/search', {'query': 'a'}),
+    ('/api/v1/genres/search', {'query': 'a', 'sort': 'name.raw:asc'}),
+    ('/api/v1/persons/', {}),
+    ('/api/v1/persons/search', {'query': 'person'}),
+]
+
+
+async def load_snapshots(snapshot_persons: bool = True) -> dict:
+    """Sets up the API with the stub of ES, loads the snapshots of the small indices, returns the services."""
+    redis.redis = fakeredis.aioredis.FakeRedis()
+    elastic.es = ElasticsearchStub(make_documents(films=50, persons=20))
+    local_cache.local_cache = local_cache.LocalCache(max_items=1000, ttl=60)
+    services = dict(redis=redis.redis, elastic=elastic.es, local_cache=local_cache.local_cache)
+    person_service = get_person_service(**services)
+    person_service.snapshot.max_items = 1000 if snapshot_persons else 0
+    for service in (get_genre_service(**services), person_service):
+        if service.snapshot.max_items:
+            await service.snapshot.load()
+    return services
+
+
+async def read_two_pages(path: str, params: dict, snapshot_persons: bool) -> tuple[list, list]:
+    """The ids of the first page of the list and of the page its cursor points to."""
+    await load_snapshots(snapshot_persons)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        first = await client.get(path, params=dict(params, page_size=PAGE_SIZE))
+        assert first.status_code == 200
+        cursor = first.headers.get(NEXT_CURSOR_HEADER)
+        assert cursor, f'No cursor on the first page of {path} {params}'
+        second = await client.get(path, params=dict(params, page_size=PAGE_SIZE, cursor=cursor))
+        assert second.status_code == 200
+    return [item['id'] for item in first.json()], [item['id'] for item in second.json()]
+
+
+async def read_pages(path: str, params: dict) -> list[list]:
+    """The ids of all the pages of the list, read by the cursors."""
+    pages = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        page_params = dict(params, page_size=PAGE_SIZE)
+        while True:
+            response = await client.get(path, params=page_params)
+            assert response.status_code == 200
+            pages.append([item['id'] for item in response.json()])
+            if NEXT_CURSOR_HEADER not in response.headers:
+                return pages
+            page_params['cursor'] = response.headers[NEXT_CURSOR_HEADER]
+
+
+@pytest.mark.parametrize('snapshot_persons', [False, True], ids=['persons from ES', 'persons snapshot'])
+@pytest.mark.parametrize('path,params', LISTS)
+def test_first_page_has_next_cursor(path, params, snapshot_persons):
+    first, second = asyncio.run(read_two_pages(path, params, snapshot_persons))
+    assert len(first) == PAGE_SIZE
+    assert second
+    assert not set(first) & set(second)
+
+
+@pytest.mark.parametrize('params', [{'query': 'a'}, {'query': 'a', 'sort': 'name.raw:desc'}, {}])
+def test_snapshot_serves_the_search_and_its_cursor_pages(params):
+    async def scenario():
+        await load_snapshots()
+        requests = elastic.es.requests
+        pages = await read_pages('/api/v1/genres/search' if params else '/api/v1/genres/', params)
+        return pages, elastic.es.requests - requests
+
+    pages, requests = asyncio.run(scenario())
+    assert requests == 0
+    assert len(pages) > 1
+    ids = [item_id for page in pages for item_id in page]
+    assert len(ids) == len(set(ids))
+
+
+def test_snapshot_cursor_expires_with_the_snapshot():
+    async def scenario():
+        services = await load_snapshots()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            first = await client.get('/api/v1/genres/search', params={'query': 'a', 'page_size': PAGE_SIZE})
+            await redis.redis.incr(get_genre_service(**services).generation_key)
+            await get_genre_service(**services).snapshot.load()
+            params = {'query': 'a', 'page_size': PAGE_SIZE, 'cursor': first.headers[NEXT_CURSOR_HEADER]}
+            return await client.get('/api/v1/genres/search', params=params)
+
+    assert asyncio.run(scenario()).status_code == 410
+
+
+def test_cursor_of_another_sort_is_rejected():
+    async def scenario():
+        redis.redis = fakeredis.aioredis.FakeRedis()
+        elastic.es = ElasticsearchStub(make_documents(films=50, persons=20))
+        local_cache.local_cache = local_cache.LocalCache(max_items=1000, ttl=60)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            first = await client.get('/api/v1/films/', params={'page_size': PAGE_SIZE})
+            cursor = first.headers[NEXT_CURSOR_HEADER]
+            return await client.get('/api/v1/films/', params={'sort': 'imdb_rating:desc', 'cursor': cursor})
+
+    assert asyncio.run(scenario()).status_code == 400
+
+
+def test_invalid_sort_is_rejected():
+    async def scenario():
+        redis.redis = fakeredis.aioredis.FakeRedis()
+        elastic.es = ElasticsearchStub(make_documents(films=50, persons=20))
+        local_cache.local_cache = local_cache.LocalCache(max_items=1000, ttl=60)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.get('/api/v1/films/', params={'sort': 'title:sideways'})
+
+    assert asyncio.run(scenario()).status_code == 422
@@ -0,0 +1,92 @@
+import asyncio
+
+import fakeredis.aioredis
+
+from src.db.local_cache import LocalCache, tracking_prefixes
+from src.models.genre import Genre
+from src.services.cache import Cache
+
+
+def test_fill_is_dropped_only_if_its_key_was_invalidated():
+    cache = LocalCache(max_items=10, ttl=60)
+    version = cache.version
+    cache.invalidate(['films:a'])
+    cache.set('films:a', 'stale', version)
+    cache.set('films:b', 'fresh', version)
+    assert cache.get('films:a') is None
+    assert cache.get('films:b') == 'fresh'
+    cache.set('films:a', 'fresh', cache.version)
+    assert cache.get('films:a') == 'fresh'
+
+
+def test_full_invalidation_outdates_all_the_reads():
+    cache = LocalCache(max_items=10, ttl=60)
+    version = cache.version
+    cache.set('films:a', 'old')
+    cache.invalidate()
+    cache.set('films:b', 'stale', version)
+    assert len(cache) == 0
+
+
+def test_forgotten_invalidations_outdate_the_older_reads():
+    cache = LocalCache(max_items=2, ttl=60)
+    version = cache.version
+    cache.invalidate(['films:a'])
+    cache.invalidate(['films:b', 'films:c'])
+    # The invalidation of "films:a" is forgotten, so a read started before it can not be trusted
+    cache.set('films:d', 'stale', version)
+    assert cache.get('films:d') is None
+    cache.set('films:d', 'fresh', cache.version)
+    assert cache.get('films:d') == 'fresh'
+
+
+def test_echo_of_own_writes_keeps_the_values():
+    cache = LocalCache(max_items=10, ttl=60)
+    cache.expect_echo(['films:a', 'films:a', 'films:b'])
+    cache.set('films:a', 'own')
+    cache.set('films:b', 'own')
+    cache.set('films:c', 'read')
+    # Redis sends the messages in the order of the writes: the own ones of the keys, then another one
+    cache.on_invalidation(['films:a', 'films:b', 'films:c'])
+    cache.on_invalidation(['films:a'])
+    assert (cache.get('films:a'), cache.get('films:b'), cache.get('films:c')) == ('own', 'own', None)
+    cache.on_invalidation(['films:a', 'films:b'])
+    assert (cache.get('films:a'), cache.get('films:b')) == (None, None)
+
+
+def test_failed_write_is_not_expected_back():
+    cache = LocalCache(max_items=10, ttl=60)
+    cache.expect_echo(['films:a'])
+    cache.invalidate(['films:a'])
+    cache.set('films:a', 'read')
+    cache.on_invalidation(['films:a'])
+    assert cache.get('films:a') is None
+
+
+def test_cache_keeps_its_own_writes_in_l1():
+    local_cache = LocalCache(max_items=10, ttl=60)
+    cache = Cache(fakeredis.aioredis.FakeRedis(), local_cache, 60, 'genres')
+
+    async def scenario():
+        await cache.set_many({'a': Genre(id='a', name='Drama'), 'b': Genre(id='b', name='Comedy')})
+        # The echo of the own writes, then the write of "b" by another worker
+        local_cache.on_invalidation(['genres:a', 'genres:b'])
+        local_cache.on_invalidation(['genres:b'])
+
+    asyncio.run(scenario())
+    assert local_cache.get('genres:a').value.name == 'Drama'
+    assert local_cache.get('genres:b') is None
+
+
+def test_lru_eviction():
+    cache = LocalCache(max_items=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+
+
+def test_tracking_prefixes_do_not_overlap():
+    prefixes = ['films:', 'genres:', 'genres:generation', 'movies:generation', 'films:']
+    assert tracking_prefixes(prefixes) == ['films:', 'genres:', 'movies:generation']
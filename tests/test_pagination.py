@@ -0,0 +1,84 @@
+import asyncio
+import base64
+
+import orjson
+import pytest
+from elasticsearch import NotFoundError
+
+from src.core.config import settings
+from src.services.pagination import (ExpiredCursorError, InvalidCursorError, InvalidSortError, decode_cursor,
+                                     decode_snapshot_cursor, encode_cursor, encode_snapshot_cursor,
+                                     parse_sort, reads_point_in_time, search_page)
+
+SORT = parse_sort('imdb_rating:desc')
+
+
+class ExpiredPitElastic:
+    """ES whose every point in time has expired."""
+
+    async def search(self, **kwargs):
+        raise NotFoundError(404, 'search_context_missing_exception', {})
+
+
+def test_parse_sort_appends_tiebreaker():
+    assert parse_sort('') == [{'_score': 'desc'}, {'id': 'asc'}]
+    assert parse_sort('title:asc, imdb_rating') == [{'title': 'asc'}, {'imdb_rating': 'asc'}, {'id': 'asc'}]
+    assert parse_sort('id:desc') == [{'id': 'desc'}]
+    assert parse_sort('title:DESC') == [{'title': 'desc'}, {'id': 'asc'}]
+
+
+def test_parse_sort_rejects_unknown_direction():
+    with pytest.raises(InvalidSortError):
+        parse_sort('title:sideways')
+
+
+@pytest.mark.parametrize('pit_id', [None, 'pit-1'])
+def test_cursor_round_trip(pit_id):
+    cursor = encode_cursor([8.5, 'a1'], SORT, pit_id)
+    assert decode_cursor(cursor, SORT) == ([8.5, 'a1'], pit_id)
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor',
+    base64.urlsafe_b64encode(b'[1, 2]').decode(),
+    base64.urlsafe_b64encode(orjson.dumps({'sa': [8.5, 'a1']})).decode(),
+    base64.urlsafe_b64encode(orjson.dumps({'sa': 1, 'sort': SORT})).decode(),
+    base64.urlsafe_b64encode(orjson.dumps({'sa': [8.5], 'sort': SORT})).decode(),
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, SORT)
+
+
+def test_cursor_of_another_sort():
+    cursor = encode_cursor(['a1'], parse_sort('id:asc'))
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, parse_sort('id:desc'))
+
+
+def test_snapshot_cursor():
+    cursor = encode_snapshot_cursor(7, 30, SORT)
+    assert decode_snapshot_cursor(cursor, SORT, 7) == 30
+    assert decode_snapshot_cursor(encode_cursor([8.5, 'a1'], SORT), SORT, 7) is None
+    with pytest.raises(ExpiredCursorError):
+        decode_snapshot_cursor(cursor, SORT, 8)
+    with pytest.raises(InvalidCursorError):
+        decode_snapshot_cursor(cursor, parse_sort('id:desc'), 7)
+    # The snapshot is not kept anymore, the list is read from ES
+    with pytest.raises(ExpiredCursorError):
+        decode_cursor(cursor, SORT)
+
+
+def test_expired_point_in_time(monkeypatch):
+    monkeypatch.setattr(settings, 'ELASTIC_PIT_KEEP_ALIVE', '1m')
+    cursor = encode_cursor([8.5, 'a1'], SORT, 'pit-1')
+    assert reads_point_in_time(cursor=cursor)
+    with pytest.raises(ExpiredCursorError):
+        asyncio.run(search_page(ExpiredPitElastic(), 'movies', None, sort='imdb_rating:desc', cursor=cursor))
+
+
+def test_pages_without_point_in_time(monkeypatch):
+    monkeypatch.setattr(settings, 'ELASTIC_PIT_KEEP_ALIVE', '')
+    assert not reads_point_in_time(cursor=encode_cursor([8.5, 'a1'], SORT))
+    monkeypatch.setattr(settings, 'ELASTIC_PIT_KEEP_ALIVE', '1m')
+    assert not reads_point_in_time(page=2)
@@ -0,0 +1,109 @@
+import asyncio
+
+import fakeredis.aioredis
+
+from src.services.single_flight import SingleFlight
+
+
+def test_concurrent_misses_share_one_load():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        single_flight = SingleFlight(redis)
+        loads = []
+
+        async def load():
+            loads.append(1)
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        async def from_cache():
+            return None
+
+        results = await asyncio.gather(*(single_flight.do('films:a', load, from_cache) for _ in range(5)))
+        assert results == ['value'] * 5
+        assert len(loads) == 1
+        # The lock is released once the value is loaded
+        assert not await redis.exists('lock:films:a')
+
+    asyncio.run(scenario())
+
+
+def test_lock_is_released_when_the_load_fails():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        single_flight = SingleFlight(redis)
+
+        async def load():
+            raise RuntimeError('ES is down')
+
+        try:
+            await single_flight.do('films:a', load, load)
+        except RuntimeError:
+            pass
+        assert not await redis.exists('lock:films:a')
+
+    asyncio.run(scenario())
+
+
+def test_release_keeps_the_lock_of_another_holder():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        single_flight = SingleFlight(redis)
+        token = await single_flight._acquire('lock:films:a')
+        assert token
+        assert await single_flight._acquire('lock:films:a') is None
+        # The lock has expired and another worker has taken it
+        await redis.set('lock:films:a', 'another')
+        await single_flight._release('lock:films:a', token)
+        assert await redis.get('lock:films:a') == b'another'
+        await single_flight._release('lock:films:a', 'another')
+        assert not await redis.exists('lock:films:a')
+
+    asyncio.run(scenario())
+
+
+def test_waiter_reads_the_value_of_the_lock_holder():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        single_flight = SingleFlight(redis)
+        await redis.set('lock:films:a', 'another worker')
+        loads = []
+
+        async def load():
+            loads.append(1)
+            return 'own value'
+
+        async def from_cache():
+            return await redis.get('films:a')
+
+        async def another_worker():
+            await asyncio.sleep(0.1)
+            await redis.set('films:a', 'value')
+            await redis.delete('lock:films:a')
+
+        result, _ = await asyncio.gather(single_flight.do('films:a', load, from_cache), another_worker())
+        assert result == b'value'
+        assert not loads
+
+    asyncio.run(scenario())
+
+
+def test_refresh_is_skipped_while_the_key_is_locked():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        single_flight = SingleFlight(redis)
+        await redis.set('lock:films:a', 'another worker')
+        loads = []
+
+        async def load():
+            loads.append(1)
+
+        single_flight.refresh('films:a', load)
+        await asyncio.sleep(0.01)
+        assert not loads
+        await redis.delete('lock:films:a')
+        single_flight.refresh('films:a', load)
+        await asyncio.sleep(0.01)
+        assert loads == [1]
+
+    asyncio.run(scenario())
@@ -0,0 +1,24 @@
+from src.models.genre import Genre
+from src.services.snapshot import IndexSnapshot
+
+GENRES = ['Drama Comedy', 'Comedy', 'Dark Comedy', 'Comedy Drama', 'Tragicomedy', 'Action']
+
+
+def make_snapshot() -> IndexSnapshot:
+    return IndexSnapshot(1, [Genre(id=f'genre-{i}', name=name) for i, name in enumerate(GENRES)], 'name')
+
+
+def test_search_ranks_exact_then_prefix_then_word_then_substring():
+    items, total, next_offset = make_snapshot().page(query='comedy', page_size=10)
+    assert [item.name for item in items] == [
+        'Comedy', 'Comedy Drama', 'Drama Comedy', 'Dark Comedy', 'Tragicomedy',
+    ]
+    assert (total, next_offset) == (5, None)
+
+
+def test_pages_continue_from_the_offset():
+    snapshot = make_snapshot()
+    first, _, next_offset = snapshot.page(query='comedy', page_size=2)
+    second, _, _ = snapshot.page(next_offset, query='comedy', page_size=2, page=1)
+    assert next_offset == 2
+    assert [item.name for item in first + second] == ['Comedy', 'Comedy Drama', 'Drama Comedy', 'Dark Comedy']
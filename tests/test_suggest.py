@@ -0,0 +1,37 @@
+import asyncio
+
+from elasticsearch import RequestError
+
+from src.services import suggest as suggest_module
+from src.services.suggest import suggest
+
+
+class IndexWithoutCompletion:
+    """ES whose index has no completion field, as one built before it was added."""
+
+    def __init__(self):
+        self.searches = []
+
+    async def search(self, index: str, body: dict) -> dict:
+        self.searches.append('suggest' if 'suggest' in body else 'prefix')
+        if 'suggest' in body:
+            raise RequestError(400, 'search_phase_execution_exception', {})
+        return {'hits': {'hits': [{'_id': 'a1', '_source': {'name': 'Drama'}}]}}
+
+
+def test_missing_completion_field_is_remembered(monkeypatch):
+    monkeypatch.setattr(suggest_module, '_completion_missing', {})
+    elastic = IndexWithoutCompletion()
+    for _ in range(3):
+        assert asyncio.run(suggest(elastic, 'genres', 'name', 'dr', 5)) == [{'id': 'a1', 'name': 'Drama'}]
+    assert elastic.searches == ['suggest', 'prefix', 'prefix', 'prefix']
+
+
+def test_completion_is_tried_again_later(monkeypatch):
+    monkeypatch.setattr(suggest_module, '_completion_missing', {})
+    elastic = IndexWithoutCompletion()
+    asyncio.run(suggest(elastic, 'genres', 'name', 'dr', 5))
+    # The retry interval is over
+    suggest_module._completion_missing['genres'] = 0
+    asyncio.run(suggest(elastic, 'genres', 'name', 'dr', 5))
+    assert elastic.searches == ['suggest', 'prefix', 'suggest', 'prefix']
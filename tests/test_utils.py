@@ -0,0 +1,28 @@
+from src.services.utils import canonical_params, filter_params, list_key
+
+
+def test_equivalent_requests_share_the_params():
+    first = canonical_params(query='  Star   Wars ', sort='imdb_rating', page=1, page_size=10, genre=None)
+    second = canonical_params(query='star wars', sort='imdb_rating:ASC, id:asc', with_total=False)
+    assert first == second == {'query': 'star wars', 'sort': 'imdb_rating:asc,id:asc'}
+    assert list_key(1, **first) == list_key(1, **second)
+
+
+def test_default_sort_is_spelled_out():
+    assert canonical_params(sort='') == {'sort': '_score:desc,id:asc'}
+
+
+def test_page_is_ignored_with_a_cursor():
+    assert canonical_params(page=3, page_size=20, cursor='abc') == {'page_size': 20, 'cursor': 'abc'}
+
+
+def test_params_selecting_another_page_differ():
+    assert canonical_params(page=2) != canonical_params(page=1)
+    assert list_key(1, **canonical_params(page=2)) != list_key(1, **canonical_params(page=1))
+    # A new generation of the index makes the lists outdated
+    assert list_key(2, page=2) != list_key(1, page=2)
+
+
+def test_filter_params():
+    params = canonical_params(genre=' Drama ', query='Star', page=2, sort='title.raw')
+    assert filter_params(**params) == {'genre': 'Drama', 'query': 'star'}